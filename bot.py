@@ -8,6 +8,48 @@ esa transferencia como FALLIDA y seguir. Al final reintenta las fallidas hasta
 que se completen (reintentos indefinidos por pasadas). Se asegura de cerrar ventanas y
 esperar 3 segundos entre reintentos. Salida de logs mínima (solo ARRANCA /
 COMPLETADA / FALLIDA por intento) + resumen al final de cada pasada.
+
+REUSE_SESSION (default 1) -> un solo navegador logueado para todo el lote: login + OTP
+una vez y se vuelve a TRANSFER_URL por cada transferencia (re-login solo si la sesión
+expiró). REUSE_SESSION=0 vuelve al modo de ventana independiente por transferencia.
+TRANSFER_WORKERS=N (default 1) -> N navegadores en paralelo, cada uno con su driver;
+las pasadas de reintento se mantienen igual.
+OTP_DISPATCHER (default 1) -> un único watcher IMAP reparte los códigos (login y
+transferencia) a los workers que los esperan, sin que se roben los mails entre sí.
+IMAP_IDLE (default 1) -> espera de mails por IMAP IDLE (push) en lugar de polling fijo.
+WAIT_EVENTOS (default 1) -> las pausas fijas del flujo pasan a ser esperas por evento
+(DOM listo, AJAX quieto vía CDP Network, elemento habilitado) con el sleep viejo como tope.
+PAGE_SCHEMA_CACHE (default 1) -> recuerda en page_schema.json en qué selector/frame apareció
+cada campo de cada pantalla y lo prueba primero en la próxima corrida (un sondeo corto,
+PAGE_SCHEMA_PROBE_SEC; si falla, la entrada se borra y se reescribe con lo que encuentre la
+búsqueda completa).
+BALANCE_LEDGER (default 1) -> lee los saldos de las cuentas origen una vez, asigna todas las
+filas del CSV a una cuenta antes de operar y descuenta localmente; las filas que no entran en
+ninguna cuenta se informan al inicio y no se reintentan.
+BROWSER_POOL_SIZE (default = TRANSFER_WORKERS) -> navegadores Chrome pre-lanzados en segundo
+plano; cada transferencia/sesión toma uno listo y al terminar vuelve limpio (sin cookies).
+SHARED_CHROMEDRIVER (default 1) -> la ruta de chromedriver se resuelve una sola vez por
+máquina (chromedriver_cache.json, invalidada si cambia Chrome) y todas las sesiones comparten
+un mismo proceso chromedriver.
+LEAN_BROWSER (default 0) -> perfil liviano para transferencias y exportaciones: bloquea
+imágenes, fuentes, media y trackers vía CDP, apaga extensiones/sync/servicios de fondo y
+guarda el perfil en tmpfs (/dev/shm). LEAN_BLOCKED_URLS agrega patrones a bloquear.
+TRANSFER_BACKEND=http -> transferencias sin navegador: login, 2FA, formulario por pasos y
+token con requests HTTP (pool de conexiones + cookies propias). LOHAS_BASE_URL cambia el
+host (p. ej. un servidor local de prueba). Default: selenium.
+SESSION_STORE (default 1) -> tras un 2FA exitoso las cookies de Lohas se guardan cifradas
+(SESSION_STORE_PATH, en una carpeta privada del usuario y con permisos 0600) y el próximo
+proceso (scan, export o transferencias) las restaura sin login ni OTP mientras no venzan
+(SESSION_TTL_SEC). Ver session_store.py.
+RETRY_CHECK (default 1) -> antes de cada pasada de reintento trae lo nuevo de los movimientos de
+Lohas a movimientos_store (un único bot_csv.py CSV_WORKER=1 para toda la corrida, que entra con la
+sesión guardada) y concilia las fallidas contra ellos: las que ya figuran ejecutadas entre el
+inicio y el fin de su intento (± CONCILIACION_DESFASE_SEC) se dan por completadas y no se reenvían.
+Si el movimiento no es el único posible (ver conciliacion.py) quedan para revisar a mano.
+RETRY_CHECK_ACCOUNTS (default "*") limita las cuentas a sincronizar; si el store ya está al día
+se usa sin volver a exportar. Si no se puede actualizar, se avisa y se reintenta sin verificar.
+IMAP_CACHE_SIZE (default 512) -> mails ya leídos que se recuerdan (LRU por UID) para no
+bajarlos ni parsearlos de nuevo en cada vuelta de polling o pasada de reintento.
 """
 from __future__ import annotations
 import builtins
@@ -17,14 +59,36 @@ import re
 import sys
 import time
 import imaplib
+import select
+import ssl
+import queue
 import email
 import email.header
+import email.message
+import email.parser
+import base64
+import atexit
+import shutil
+import tempfile
+import quopri
 import threading
+import subprocess
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.utils import parsedate_to_datetime
 from typing import List, Optional, Tuple, Callable, Dict, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+from html.parser import HTMLParser
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, urljoin, urlencode
+import urllib3
 from dotenv import load_dotenv
+from session_store import store_por_defecto, cookies_cdp, cookies_desde_dict
+from movimientos_store import MovimientosStore
+from movimientos_columnas import columnas_desde_store
+from conciliacion import conciliar, CONCILIACION_DESFASE_SEC
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -98,8 +162,8 @@ builtins.print = _minimal_print
 
 # Selenium + webdriver-manager
 from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.by import By
-# from selenium.webdriver.chrome.service import Service as ChromeService  # Not available in Selenium 3.x
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
@@ -109,7 +173,12 @@ from webdriver_manager.chrome import ChromeDriverManager
 # ---------------------------
 # CONFIG
 # ---------------------------
-URL_B = "https://app.lohas.eco/app_Login"
+# Sesión de Lohas (cookies) cifrada en disco y compartida entre procesos (ver session_store.py)
+SESION_GUARDADA = store_por_defecto()
+
+# Base de Lohas (se puede apuntar a un servidor local de prueba)
+LOHAS_BASE_URL = os.getenv("LOHAS_BASE_URL", "https://app.lohas.eco").rstrip("/")
+URL_B = f"{LOHAS_BASE_URL}/app_Login"
 
 # Credenciales Lohas (desde .env - requeridas)
 USER_B = os.getenv("USER_LOHAS", "")
@@ -131,7 +200,7 @@ CONFIRM_BTN_ID = "sub_form_b"
 RESEND_BTN_ID = "sc_resend_bot"
 
 # URL destino final (reemplazo de clicks en "Transferencias")
-TRANSFER_URL = "https://app.lohas.eco/form_transferencias/"
+TRANSFER_URL = f"{LOHAS_BASE_URL}/form_transferencias/"
 
 # Campo y botón dentro de la página de transferencias
 CUENTA_FIELD_ID = "id_sc_field_cuenta"
@@ -153,6 +222,36 @@ GMAIL_PASS = os.getenv("GMAIL_PASS", "")
 # Modo visible (sin headless)
 HEADLESS = False
 
+# Reutilizar un único navegador logueado para todo el lote (REUSE_SESSION=0 -> un login por transferencia)
+REUSE_SESSION = os.getenv("REUSE_SESSION", "1").lower() not in ("0", "false", "no")
+
+# Leer saldos de cuentas origen una vez y asignar las transferencias por adelantado (0 -> por transferencia)
+BALANCE_LEDGER = os.getenv("BALANCE_LEDGER", "1").lower() not in ("0", "false", "no")
+
+# Cantidad de navegadores ejecutando transferencias en paralelo (1 = secuencial)
+try:
+    TRANSFER_WORKERS = max(1, int(os.getenv("TRANSFER_WORKERS", "1")))
+except ValueError:
+    TRANSFER_WORKERS = 1
+
+# Verificar en los movimientos de Lohas si una fallida ya salió antes de reintentarla
+RETRY_CHECK = os.getenv("RETRY_CHECK", "1").lower() not in ("0", "false", "no")
+RETRY_CHECK_ACCOUNTS = os.getenv("RETRY_CHECK_ACCOUNTS", "*")
+try:
+    RETRY_CHECK_TIMEOUT_SEC = max(30.0, float(os.getenv("RETRY_CHECK_TIMEOUT_SEC", "300")))
+except ValueError:
+    RETRY_CHECK_TIMEOUT_SEC = 300.0
+
+# Motor de las transferencias: "selenium" (navegador) o "http" (POSTs directos al Scriptcase)
+TRANSFER_BACKEND = os.getenv("TRANSFER_BACKEND", "selenium").strip().lower()
+HTTP_TIMEOUT_SEC = 60.0
+
+# Navegadores Chrome pre-lanzados en segundo plano (default: uno por worker; 0 -> crear al momento)
+try:
+    BROWSER_POOL_SIZE = max(0, int(os.getenv("BROWSER_POOL_SIZE", str(TRANSFER_WORKERS))))
+except ValueError:
+    BROWSER_POOL_SIZE = TRANSFER_WORKERS
+
 # regex para extraer OTP (frase exacta y fallback dígitos)
 OTP_PHRASE_RE = re.compile(r"su\s+c[oó]digo\s+de\s+inicio\s+de\s+sesi[oó]n\s+es\s*[:\s,-]*?(\d{4,8})", re.I)
 OTP_DIGITS_RE = re.compile(r"\b(\d{4,8})\b")
@@ -163,6 +262,63 @@ TRANSFER_DIGITS_RE = re.compile(r"\b(\d{4,8})\b")
 
 KNOWN_SENDER = "sistema@lohas.eco"
 
+# Despachador central de códigos: un watcher IMAP por proceso reparte los códigos
+# entre los workers que los esperan (OTP_DISPATCHER=0 -> polling propio por búsqueda)
+OTP_DISPATCHER = os.getenv("OTP_DISPATCHER", "1").lower() not in ("0", "false", "no")
+# Tolerancia (s) entre el reloj local y la fecha del mail al asignar códigos
+OTP_CLOCK_SKEW_SEC = 20
+
+# IMAP IDLE: el servidor avisa apenas llega un mail (IMAP_IDLE=0 -> polling a intervalo fijo)
+IMAP_IDLE = os.getenv("IMAP_IDLE", "1").lower() not in ("0", "false", "no")
+# Máximo por ciclo de IDLE (Gmail corta IDLE a los ~29 min; ciclos cortos detectan conexiones muertas)
+IMAP_IDLE_MAX_WAIT = 25.0
+
+# Cada cuánto el pool IMAP manda NOOP a las conexiones ociosas para mantenerlas vivas
+IMAP_KEEPALIVE_SEC = 60.0
+
+# UIDs por debajo de UIDNEXT que se revisan al buscar el código de transferencia
+# (el mail puede llegar antes de empezar a buscarlo)
+TRANSFER_LOOKBACK_UIDS = 20
+
+# Bytes del cuerpo que se bajan por mail (BODY.PEEK[TEXT]<0.N>); el código siempre está al principio
+IMAP_FETCH_BYTES = 16384
+
+# Mensajes ya parseados que se recuerdan por proceso (LRU por UID; IMAP_CACHE_SIZE=0 -> sin cache)
+try:
+    IMAP_CACHE_SIZE = max(0, int(os.getenv("IMAP_CACHE_SIZE", "512")))
+except ValueError:
+    IMAP_CACHE_SIZE = 512
+# Caracteres del cuerpo que se guardan por mensaje cacheado
+IMAP_CACHE_SNIPPET = 4000
+
+# Esperas por evento: en vez de dormir un tiempo fijo se espera a que la página quede lista
+# (DOM + AJAX quieto + elemento habilitado); los sleeps de antes quedan solo como tope
+WAIT_EVENTOS = os.getenv("WAIT_EVENTOS", "1").lower() not in ("0", "false", "no")
+# Segundos sin tráfico AJAX para considerar la página quieta
+WAIT_QUIET_SEC = 0.3
+# Tras un click que navega (Próximo, login) se pide más silencio antes de seguir
+WAIT_QUIET_NAV_SEC = 1.0
+WAIT_POLL_SEC = 0.1
+# Requests que nunca terminan (long-polling) dejan de contar como pendientes a los N segundos
+RED_PENDIENTE_MAX_SEC = 15.0
+
+# Cache en disco de dónde se encontró cada campo (selector + frame) por URL de Lohas
+PAGE_SCHEMA_CACHE = os.getenv("PAGE_SCHEMA_CACHE", "1").lower() not in ("0", "false", "no")
+PAGE_SCHEMA_PATH = os.getenv("PAGE_SCHEMA_PATH", os.path.join(os.getcwd(), "page_schema.json"))
+# Sondeo al selector del esquema antes de buscar con todos (tope fijo: una entrada vieja no
+# se come el timeout de cada búsqueda)
+PAGE_SCHEMA_PROBE_SEC = 1.0
+
+# Ruta de chromedriver resuelta una vez y recordada junto a la huella del Chrome instalado
+CHROMEDRIVER_CACHE_PATH = os.getenv("CHROMEDRIVER_CACHE_PATH", os.path.join(os.getcwd(), "chromedriver_cache.json"))
+# Un único proceso chromedriver para todas las sesiones de la corrida (0 -> uno por navegador)
+SHARED_CHROMEDRIVER = os.getenv("SHARED_CHROMEDRIVER", "1").lower() not in ("0", "false", "no")
+
+# Perfil liviano (opt-in): sin imágenes/fuentes/media, sin extras de Chrome y perfil en tmpfs
+LEAN_BROWSER = os.getenv("LEAN_BROWSER", "0").lower() not in ("0", "false", "no")
+# Patrones extra a bloquear (coma separados, sintaxis de Network.setBlockedURLs)
+LEAN_BLOCKED_URLS = [u.strip() for u in os.getenv("LEAN_BLOCKED_URLS", "").split(",") if u.strip()]
+
 # ---------------------------
 # UTIL
 # ---------------------------
@@ -216,9 +372,128 @@ def imap_connect(host: str, user: str, pwd: str) -> imaplib.IMAP4_SSL:
     M = imaplib.IMAP4_SSL(host)
     M.login(user, pwd)
     M.select("INBOX")
+    # identifica el buzón en el cache de mensajes (los UIDs son por cuenta)
+    M._cuenta = f"{user}@{host}"
     return M
 
 
+class ImapConnectionPool:
+    """
+    Pool de conexiones IMAP ya autenticadas (TLS + LOGIN + SELECT hechos) que se
+    prestan a las búsquedas de OTP / código. Un hilo de keepalive manda NOOP a las
+    conexiones ociosas y al prestar una conexión que no responde se reconecta sola.
+    """
+
+    def __init__(self, host: str, user: str, pwd: str, max_idle: int = 4, keepalive_sec: float = IMAP_KEEPALIVE_SEC):
+        self.host = host
+        self.user = user
+        self.pwd = pwd
+        self.max_idle = max_idle
+        self.keepalive_sec = keepalive_sec
+        self._idle: List[Tuple[imaplib.IMAP4_SSL, float]] = []
+        self._lock = threading.Lock()
+        self._keepalive: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _viva(M: imaplib.IMAP4_SSL) -> bool:
+        try:
+            typ, _ = M.noop()
+            return typ == "OK"
+        except Exception:
+            return False
+
+    @staticmethod
+    def _cerrar(M: imaplib.IMAP4_SSL):
+        try:
+            M.logout()
+        except Exception:
+            pass
+
+    def tomar(self) -> imaplib.IMAP4_SSL:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                M, last_used = self._idle.pop()
+            # si estuvo ociosa un rato, verificar con NOOP antes de prestarla
+            if time.time() - last_used < 5 or self._viva(M):
+                try:
+                    M.select("INBOX")
+                    return M
+                except Exception:
+                    pass
+            self._cerrar(M)
+        self._iniciar_keepalive()
+        return imap_connect(self.host, self.user, self.pwd)
+
+    def devolver(self, M: imaplib.IMAP4_SSL, descartar: bool = False):
+        if descartar or getattr(M, "_idle_roto", False) or getattr(M, "state", "") != "SELECTED":
+            self._cerrar(M)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((M, time.time()))
+                return
+        self._cerrar(M)
+
+    @contextmanager
+    def conexion(self):
+        M = self.tomar()
+        try:
+            yield M
+        except (imaplib.IMAP4.abort, OSError):
+            self.devolver(M, descartar=True)
+            raise
+        except BaseException:
+            self.devolver(M)
+            raise
+        else:
+            self.devolver(M)
+
+    def _iniciar_keepalive(self):
+        with self._lock:
+            if self._keepalive is not None:
+                return
+            self._keepalive = threading.Thread(target=self._keepalive_loop, name="imap-keepalive", daemon=True)
+            self._keepalive.start()
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(self.keepalive_sec)
+            with self._lock:
+                ociosas, self._idle = self._idle, []
+            vivas = []
+            for M, last_used in ociosas:
+                if time.time() - last_used < self.keepalive_sec or self._viva(M):
+                    vivas.append((M, last_used))
+                else:
+                    self._cerrar(M)
+            with self._lock:
+                self._idle = vivas + self._idle
+
+    def cerrar_todo(self):
+        with self._lock:
+            ociosas, self._idle = self._idle, []
+        for M, _ in ociosas:
+            self._cerrar(M)
+
+
+_IMAP_POOLS: Dict[Tuple[str, str], ImapConnectionPool] = {}
+_IMAP_POOLS_LOCK = threading.Lock()
+
+
+def get_imap_pool(user: str, pwd: str, host: str = GMAIL_IMAP_HOST) -> ImapConnectionPool:
+    """
+    Pool compartido del proceso para (host, user).
+    """
+    with _IMAP_POOLS_LOCK:
+        pool = _IMAP_POOLS.get((host, user))
+        if pool is None:
+            pool = ImapConnectionPool(host, user, pwd)
+            _IMAP_POOLS[(host, user)] = pool
+        return pool
+
+
 def uid_search_all(M: imaplib.IMAP4_SSL, criteria: str) -> List[int]:
     typ, data = M.uid("SEARCH", None, criteria)
     if typ != "OK" or not data or not data[0]:
@@ -226,62 +501,217 @@ def uid_search_all(M: imaplib.IMAP4_SSL, criteria: str) -> List[int]:
     return [int(x) for x in data[0].split()]
 
 
-def uid_fetch_text(M: imaplib.IMAP4_SSL, uid: int) -> Tuple[str, str, Optional[str]]:
-    typ, data = M.uid("FETCH", str(uid), "(RFC822)")
-    if typ != "OK" or not data or not data[0]:
-        return "", "", None
-    raw = data[0][1]
-    msg = email.message_from_bytes(raw)
-    subj = email.header.make_header(email.header.decode_header(msg.get("Subject", "")))
-    subject = str(subj)
-    date_header = msg.get("Date", None)
-    body_text = ""
-    if msg.is_multipart():
-        plaintexts = []
-        htmltexts = []
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            disp = (part.get("Content-Disposition") or "").lower()
-            if ctype == "text/plain" and "attachment" not in disp:
-                try:
-                    payload = part.get_payload(decode=True)
-                    charset = part.get_content_charset() or "utf-8"
-                    plaintexts.append(payload.decode(charset, errors="ignore"))
-                except Exception:
-                    try:
-                        plaintexts.append(part.get_payload(decode=True).decode("utf-8", errors="ignore"))
-                    except Exception:
-                        pass
-            elif ctype == "text/html" and "attachment" not in disp:
-                try:
-                    payload = part.get_payload(decode=True)
-                    charset = part.get_content_charset() or "utf-8"
-                    htmltexts.append(payload.decode(charset, errors="ignore"))
-                except Exception:
-                    try:
-                        htmltexts.append(part.get_payload(decode=True).decode("utf-8", errors="ignore"))
-                    except Exception:
-                        pass
-        if plaintexts:
-            body_text = "\n\n".join(plaintexts)
-        elif htmltexts:
-            body_text = "\n\n".join(strip_tags(h) for h in htmltexts)
-    else:
+def imap_uidnext(M: imaplib.IMAP4_SSL) -> int:
+    """
+    UIDNEXT del INBOX: primero el que informó el último SELECT, si no STATUS.
+    Sin UIDNEXT (servidor raro) se cae al UID SEARCH ALL de siempre.
+    """
+    try:
+        _, data = M.response("UIDNEXT")
+        vals = [int(x) for x in (data or []) if x]
+        if vals:
+            return vals[-1]
+    except Exception:
+        pass
+    try:
+        typ, data = M.status("INBOX", "(UIDNEXT)")
+        if typ == "OK" and data and data[0]:
+            raw = data[0].decode(errors="ignore") if isinstance(data[0], bytes) else str(data[0])
+            m = re.search(r"UIDNEXT\s+(\d+)", raw)
+            if m:
+                return int(m.group(1))
+    except Exception:
+        pass
+    all_uids = uid_search_all(M, "ALL")
+    return (max(all_uids) + 1) if all_uids else 1
+
+
+def imap_search_desde(M: imaplib.IMAP4_SSL, since_uid: int, *parts: str):
+    """
+    Igual que imap_search_utf8 pero acotado a `UID since_uid+1:*`, así el costo no crece con el buzón.
+    `n:*` con n mayor al último UID devuelve el último mensaje, por eso se vuelve a filtrar acá.
+    """
+    typ, data = imap_search_utf8(M, 'UID', f'{since_uid + 1}:*', *parts)
+    if typ != 'OK' or not data or not data[0]:
+        return typ, data
+    uids = [x for x in data[0].split() if int(x) > since_uid]
+    return typ, [b" ".join(uids)]
+
+
+class ParsedMessageCache:
+    """
+    LRU (cuenta, uid) -> mensaje ya parseado: subject, recorte del cuerpo, Date y los
+    códigos ya extraídos. Los UIDs del INBOX no se reutilizan, así que cada mail se
+    baja y decodifica una sola vez por corrida aunque lo vean varias búsquedas.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cuenta: str, uid: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._items.get((cuenta, uid))
+            if item is not None:
+                self._items.move_to_end((cuenta, uid))
+            return item
+
+    def put(self, cuenta: str, uid: int, subject: str, body: str, date_header: Optional[str]) -> Dict[str, Any]:
+        item = {"subject": subject, "body": (body or "")[:IMAP_CACHE_SNIPPET], "date": date_header, "codigos": {}}
+        if self.maxsize <= 0:
+            return item
+        with self._lock:
+            self._items[(cuenta, uid)] = item
+            self._items.move_to_end((cuenta, uid))
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return item
+
+    def codigo(self, cuenta: str, uid: int, tipo: str, extractor: Callable[[str, str], Optional[str]],
+               subject: str, body: str) -> Optional[str]:
+        item = self.get(cuenta, uid)
+        if item is None:
+            return extractor(subject, body)
+        with self._lock:
+            if tipo in item["codigos"]:
+                return item["codigos"][tipo]
+        code = extractor(subject, body)
+        with self._lock:
+            item["codigos"][tipo] = code
+        return code
+
+
+MENSAJES_CACHE = ParsedMessageCache(IMAP_CACHE_SIZE)
+
+
+def _cuenta_imap(M: imaplib.IMAP4_SSL) -> str:
+    return getattr(M, "_cuenta", None) or str(id(M))
+
+
+# Solo los headers que se usan + el principio del cuerpo; PEEK no marca el mail como leído
+_FETCH_PARCIAL = (
+    "(UID BODY.PEEK[HEADER.FIELDS (SUBJECT DATE CONTENT-TYPE CONTENT-TRANSFER-ENCODING)] "
+    "BODY.PEEK[TEXT]<0.%d>)" % IMAP_FETCH_BYTES
+)
+_FETCH_INICIO_RE = re.compile(rb"^\d+ \(")
+_FETCH_UID_RE = re.compile(rb"UID (\d+)")
+
+
+def _decodificar_payload(raw: bytes, cte: Optional[str], charset: Optional[str]) -> str:
+    cte = (cte or "").strip().lower()
+    try:
+        if cte == "base64":
+            # el cuerpo puede venir truncado: descartar lo que no completa un bloque
+            limpio = re.sub(rb"[^A-Za-z0-9+/=]", b"", raw)
+            raw = base64.b64decode(limpio[: len(limpio) - len(limpio) % 4])
+        elif cte == "quoted-printable":
+            raw = quopri.decodestring(raw)
+    except Exception:
+        pass
+    try:
+        return raw.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return raw.decode("utf-8", errors="ignore")
+
+
+def _texto_de_cuerpo(content_type: Optional[str], cte: Optional[str], raw: bytes) -> str:
+    """
+    Texto legible de un BODY[TEXT] (posiblemente truncado) sin armar el árbol MIME completo:
+    en multipart se parte por boundary y solo se decodifican las partes de texto.
+    """
+    hdr = email.message.Message()
+    hdr["Content-Type"] = content_type or "text/plain"
+    ctype = hdr.get_content_type()
+    if not ctype.startswith("multipart/"):
+        texto = _decodificar_payload(raw, cte, hdr.get_content_charset())
+        if ctype == "text/html" or "<html" in texto.lower():
+            texto = strip_tags(texto)
+        return texto
+    boundary = hdr.get_boundary()
+    if not boundary:
+        return ""
+    planos, htmls = [], []
+    for chunk in raw.split(b"--" + boundary.encode()):
+        cabecera, sep, cuerpo = chunk.partition(b"\r\n\r\n")
+        if not sep:
+            cabecera, sep, cuerpo = chunk.partition(b"\n\n")
+        if not sep:
+            continue
+        sub = email.parser.BytesHeaderParser().parsebytes(cabecera.lstrip(b"\r\n"))
+        if not sub.get("Content-Type") or "attachment" in (sub.get("Content-Disposition") or "").lower():
+            continue
+        sub_ctype = sub.get_content_type()
+        if sub_ctype.startswith("multipart/"):
+            planos.append(_texto_de_cuerpo(sub.get("Content-Type"), None, cuerpo))
+        elif sub_ctype == "text/plain":
+            planos.append(_decodificar_payload(cuerpo, sub.get("Content-Transfer-Encoding"), sub.get_content_charset()))
+        elif sub_ctype == "text/html":
+            htmls.append(_decodificar_payload(cuerpo, sub.get("Content-Transfer-Encoding"), sub.get_content_charset()))
+    planos = [p for p in planos if p]
+    if planos:
+        return "\n\n".join(planos)
+    return "\n\n".join(strip_tags(h) for h in htmls)
+
+
+def _agrupar_fetch(data) -> List[Tuple[bytes, Dict[str, bytes]]]:
+    """Agrupa la respuesta de un FETCH de varios mensajes en (metadatos, {HEADER|TEXT: literal})."""
+    mensajes: List[Tuple[bytes, Dict[str, bytes]]] = []
+    for item in data or []:
+        if isinstance(item, tuple):
+            cab, literal = item[0], item[1]
+            if _FETCH_INICIO_RE.match(cab) or not mensajes:
+                mensajes.append((b"", {}))
+            meta, partes = mensajes[-1]
+            clave = "HEADER" if cab.rsplit(b"BODY[", 1)[-1].startswith(b"HEADER") else "TEXT"
+            partes[clave] = literal
+            mensajes[-1] = (meta + cab, partes)
+        elif isinstance(item, bytes):
+            if _FETCH_INICIO_RE.match(item):
+                mensajes.append((item, {}))
+            elif mensajes:
+                mensajes[-1] = (mensajes[-1][0] + item, mensajes[-1][1])
+    return mensajes
+
+
+def uid_fetch_textos(M: imaplib.IMAP4_SSL, uids) -> Dict[int, Tuple[str, str, Optional[str]]]:
+    """
+    Trae varios mails en un solo FETCH (headers + primeros IMAP_FETCH_BYTES del cuerpo).
+    Devuelve {uid: (subject, body, date_header)}; los UIDs que no vinieron no aparecen.
+    Los que ya están en MENSAJES_CACHE no se vuelven a pedir.
+    """
+    cuenta = _cuenta_imap(M)
+    res: Dict[int, Tuple[str, str, Optional[str]]] = {}
+    faltan = []
+    for uid in sorted({int(u) for u in uids}):
+        item = MENSAJES_CACHE.get(cuenta, uid)
+        if item is not None:
+            res[uid] = (item["subject"], item["body"], item["date"])
+        else:
+            faltan.append(uid)
+    if not faltan:
+        return res
+    typ, data = M.uid("FETCH", ",".join(str(u) for u in faltan), _FETCH_PARCIAL)
+    if typ != "OK" or not data:
+        return res
+    parser = email.parser.BytesHeaderParser()
+    for meta, partes in _agrupar_fetch(data):
+        m = _FETCH_UID_RE.search(meta)
+        if not m:
+            continue
         try:
-            payload = msg.get_payload(decode=True)
-            if payload is None:
-                body_text = ""
-            else:
-                charset = msg.get_content_charset() or "utf-8"
-                body_text = payload.decode(charset, errors="ignore")
-                if "<html" in body_text.lower():
-                    body_text = strip_tags(body_text)
+            hdr = parser.parsebytes(partes.get("HEADER", b""))
+            subject = str(email.header.make_header(email.header.decode_header(hdr.get("Subject", ""))))
+            body = _texto_de_cuerpo(hdr.get("Content-Type"), hdr.get("Content-Transfer-Encoding"), partes.get("TEXT", b""))
+            item = MENSAJES_CACHE.put(cuenta, int(m.group(1)), subject, body, hdr.get("Date", None))
+            res[int(m.group(1))] = (item["subject"], item["body"], item["date"])
         except Exception:
-            try:
-                body_text = msg.get_payload(decode=True).decode("utf-8", errors="ignore")
-            except Exception:
-                body_text = ""
-    return subject, body_text, date_header
+            continue
+    return res
+
+
+def uid_fetch_text(M: imaplib.IMAP4_SSL, uid: int) -> Tuple[str, str, Optional[str]]:
+    return uid_fetch_textos(M, [uid]).get(int(uid), ("", "", None))
 
 
 def imap_search_utf8(M: imaplib.IMAP4_SSL, *parts: str):
@@ -308,6 +738,83 @@ def imap_search_utf8(M: imaplib.IMAP4_SSL, *parts: str):
             return "NO", []
 
 
+def _imap_datos_en_buffer(M: imaplib.IMAP4_SSL) -> bool:
+    """
+    ¿Hay algo que M.readline() puede devolver sin bloquear? select() solo ve el socket: lo
+    que imaplib ya leyó a M.file (p. ej. el EXISTS que vino en el mismo paquete que el "+")
+    o que SSL ya descifró no lo despierta. peek() con el socket no bloqueante no espera.
+    """
+    timeout = M.sock.gettimeout()
+    try:
+        M.sock.setblocking(False)
+        return bool(M.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        M.sock.settimeout(timeout)
+
+
+def imap_idle_wait(M: imaplib.IMAP4_SSL, timeout: float) -> bool:
+    """
+    IMAP IDLE (RFC 2177): bloquea hasta que el servidor avisa un mail nuevo (EXISTS)
+    o hasta `timeout` segundos. Devuelve True si llegó aviso de mail nuevo.
+    """
+    tag = M._new_tag()
+    M.send(tag + b" IDLE\r\n")
+    resp = M.readline()
+    if not resp.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE rechazado: {resp!r}")
+    nuevo = False
+    deadline = time.time() + max(0.0, timeout)
+    while not nuevo:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        # select() en vez de timeout del socket: un timeout deja inutilizable el file de imaplib;
+        # antes, lo que ya está en el buffer (select no lo ve)
+        ready = _imap_datos_en_buffer(M)
+        if not ready:
+            ready = select.select([M.sock], [], [], min(remaining, 1.0))[0]
+        if not ready:
+            continue
+        line = M.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("conexión cerrada durante IDLE")
+        if line.startswith(b"*") and (b"EXISTS" in line.upper() or b"RECENT" in line.upper()):
+            nuevo = True
+    M.send(b"DONE\r\n")
+    while True:
+        line = M.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("conexión cerrada al terminar IDLE")
+        if line.startswith(tag):
+            break
+        if b"EXISTS" in line.upper():
+            nuevo = True
+    M.tagged_commands.pop(tag, None)
+    return nuevo
+
+
+def imap_soporta_idle(M: imaplib.IMAP4_SSL) -> bool:
+    return IMAP_IDLE and "IDLE" in getattr(M, "capabilities", ()) and not getattr(M, "_idle_roto", False)
+
+
+def esperar_mail_nuevo(M: imaplib.IMAP4_SSL, poll_every: float, limite: float) -> None:
+    """
+    Espera entre rondas de búsqueda: con IDLE vuelve apenas llega un mail (como máximo
+    `limite` segundos, acotado a IMAP_IDLE_MAX_WAIT); sin IDLE duerme poll_every (polling).
+    """
+    if imap_soporta_idle(M):
+        try:
+            imap_idle_wait(M, min(max(limite, 0.0), IMAP_IDLE_MAX_WAIT))
+            return
+        except Exception:
+            # servidor/conexión sin IDLE utilizable -> polling para el resto de esta conexión
+            M._idle_roto = True
+    if poll_every > 0:
+        time.sleep(poll_every)
+
+
 # ---------------------------
 # EXTRACCION OTP y CÓDIGO TRANSFERENCIA
 # ---------------------------
@@ -335,20 +842,32 @@ def extract_transfer_code_from_text(subject: str, body: str) -> Optional[str]:
     return None
 
 
+_EXTRACTORES_CODIGO = {"login": extract_otp_from_text, "transfer": extract_transfer_code_from_text}
+
+
+def codigo_cacheado(M: imaplib.IMAP4_SSL, uid: int, tipo: str, subject: str, body: str) -> Optional[str]:
+    """Código ("login" / "transfer") del mail, extraído una sola vez por UID."""
+    return MENSAJES_CACHE.codigo(_cuenta_imap(M), uid, tipo, _EXTRACTORES_CODIGO[tipo], subject, body)
+
+
 def get_latest_otp_gmail(user: str, pwd: str, timeout_sec: int = 120, poll_every: float = 2.0, since_uid: Optional[int] = None) -> Tuple[str, int]:
+    # Con el despachador activo no se abre otra conexión: se espera el código que reparte el watcher
+    waiter = registrar_espera_codigo("login", since_uid) if user == GMAIL_USER else None
+    if waiter is not None:
+        return esperar_codigo(waiter, timeout_sec)
     start = time.time()
+    pool = get_imap_pool(user, pwd)
     M = None
     try:
-        M = imap_connect(GMAIL_IMAP_HOST, user, pwd)
+        M = pool.tomar()
         if since_uid is None:
-            all_uids = uid_search_all(M, "ALL")
-            since_uid = max(all_uids) if all_uids else 0
+            since_uid = imap_uidnext(M) - 1
         attempt = 0
         while time.time() - start < timeout_sec:
             attempt += 1
             # Buscar mensajes del remitente
             try:
-                typ, data = imap_search_utf8(M, 'ALL', 'FROM', f'"{KNOWN_SENDER}"')
+                typ, data = imap_search_desde(M, since_uid, 'FROM', f'"{KNOWN_SENDER}"')
                 if typ == 'OK' and data and data[0]:
                     uids = [int(x) for x in data[0].split()]
                     uids = sorted(uids, reverse=True)
@@ -357,24 +876,24 @@ def get_latest_otp_gmail(user: str, pwd: str, timeout_sec: int = 120, poll_every
             except Exception:
                 uids = []
 
+            try:
+                textos = uid_fetch_textos(M, uids)
+            except Exception:
+                textos = {}
             for uid in uids:
                 if since_uid and uid <= since_uid:
                     continue
                 try:
-                    subject, body, _ = uid_fetch_text(M, uid)
-                    otp = extract_otp_from_text(subject, body)
+                    subject, body, _ = textos.get(uid, ("", "", None))
+                    otp = codigo_cacheado(M, uid, "login", subject, body)
                     if otp:
-                        try:
-                            M.logout()
-                        except Exception:
-                            pass
                         return otp, uid
                 except Exception:
                     continue
 
             # UNSEEN FROM
             try:
-                typ, data = imap_search_utf8(M, 'UNSEEN', 'FROM', f'"{KNOWN_SENDER}"')
+                typ, data = imap_search_desde(M, since_uid, 'UNSEEN', 'FROM', f'"{KNOWN_SENDER}"')
                 if typ == 'OK' and data and data[0]:
                     uids_unseen = [int(x) for x in data[0].split()]
                     uids_unseen = sorted(uids_unseen, reverse=True)
@@ -383,24 +902,24 @@ def get_latest_otp_gmail(user: str, pwd: str, timeout_sec: int = 120, poll_every
             except Exception:
                 uids_unseen = []
 
+            try:
+                textos = uid_fetch_textos(M, uids_unseen)
+            except Exception:
+                textos = {}
             for uid in uids_unseen:
                 if since_uid and uid <= since_uid:
                     continue
                 try:
-                    subject, body, _ = uid_fetch_text(M, uid)
-                    otp = extract_otp_from_text(subject, body)
+                    subject, body, _ = textos.get(uid, ("", "", None))
+                    otp = codigo_cacheado(M, uid, "login", subject, body)
                     if otp:
-                        try:
-                            M.logout()
-                        except Exception:
-                            pass
                         return otp, uid
                 except Exception:
                     continue
 
             # Fallback UNSEEN generic
             try:
-                typ, data = imap_search_utf8(M, 'UNSEEN')
+                typ, data = imap_search_desde(M, since_uid, 'UNSEEN')
                 if typ == 'OK' and data and data[0]:
                     uids_generic = [int(x) for x in data[0].split()]
                     uids_generic = sorted(uids_generic, reverse=True)
@@ -409,22 +928,22 @@ def get_latest_otp_gmail(user: str, pwd: str, timeout_sec: int = 120, poll_every
             except Exception:
                 uids_generic = []
 
+            try:
+                textos = uid_fetch_textos(M, uids_generic)
+            except Exception:
+                textos = {}
             for uid in uids_generic:
                 if since_uid and uid <= since_uid:
                     continue
                 try:
-                    subject, body, _ = uid_fetch_text(M, uid)
-                    otp = extract_otp_from_text(subject, body)
+                    subject, body, _ = textos.get(uid, ("", "", None))
+                    otp = codigo_cacheado(M, uid, "login", subject, body)
                     if otp:
-                        try:
-                            M.logout()
-                        except Exception:
-                            pass
                         return otp, uid
                 except Exception:
                     continue
 
-            time.sleep(poll_every)
+            esperar_mail_nuevo(M, poll_every, timeout_sec - (time.time() - start))
             try:
                 M.select("INBOX")
             except Exception:
@@ -433,30 +952,34 @@ def get_latest_otp_gmail(user: str, pwd: str, timeout_sec: int = 120, poll_every
         raise TimeoutError("OTP no llegó a tiempo a Gmail (timeout)")
     finally:
         if M:
-            try:
-                M.logout()
-            except Exception:
-                pass
+            pool.devolver(M)
 
 
-def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "Envío de código", timeout_sec: int = 180, poll_every: float = 3.0) -> Tuple[str, int]:
+def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "Envío de código", timeout_sec: int = 180, poll_every: float = 3.0, since_uid: Optional[int] = None) -> Tuple[str, int]:
     """
     Búsqueda optimizada del código de transferencia (igual que antes, pero sin prints).
+    Con el despachador activo espera el próximo código de transferencia que llegue.
+    Sin since_uid se arranca unos pocos UIDs antes de UIDNEXT (TRANSFER_LOOKBACK_UIDS).
     """
+    waiter = registrar_espera_codigo("transfer", since_uid) if user == GMAIL_USER else None
+    if waiter is not None:
+        return esperar_codigo(waiter, timeout_sec)
     start = time.time()
     print("DEBUG: Buscando código de transferencia en Gmail…")
+    pool = get_imap_pool(user, pwd)
     M = None
     generic_digits_re = re.compile(r"\b(\d{4,8})\b")
     try:
-        M = imap_connect(GMAIL_IMAP_HOST, user, pwd)
+        M = pool.tomar()
+        if since_uid is None:
+            since_uid = max(0, imap_uidnext(M) - 1 - TRANSFER_LOOKBACK_UIDS)
         attempt = 0
         while time.time() - start < timeout_sec:
             attempt += 1
             print(f"DEBUG: Intento de búsqueda de código (#{attempt})")
-            time.sleep(0 if poll_every <= 0 else poll_every)
             # 1) UNSEEN + SUBJECT
             try:
-                typ, data = imap_search_utf8(M, 'UNSEEN', 'SUBJECT', f'"{subject_search}"')
+                typ, data = imap_search_desde(M, since_uid, 'UNSEEN', 'SUBJECT', f'"{subject_search}"')
                 if typ == 'OK' and data and data[0]:
                     uids = [int(x) for x in data[0].split()]
                     uids = sorted(uids, reverse=True)
@@ -466,26 +989,26 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
                 uids = []
 
             if uids:
+                try:
+                    textos = uid_fetch_textos(M, uids)
+                except Exception:
+                    textos = {}
                 for uid in uids:
                     try:
-                        subj, body, date_hdr = uid_fetch_text(M, uid)
+                        subj, body, date_hdr = textos.get(uid, ("", "", None))
                         msg_dt = parse_email_date(date_hdr)
-                        code = extract_transfer_code_from_text(subj, body)
+                        code = codigo_cacheado(M, uid, "transfer", subj, body)
                         if not code:
                             m2 = generic_digits_re.search(body or "") or generic_digits_re.search(subj or "")
                             if m2:
                                 code = m2.group(1)
                         if code and message_time_matches_now(msg_dt):
                             print(f"DEBUG: Código de transferencia encontrado: {code}")
-                            try:
-                                M.logout()
-                            except Exception:
-                                pass
                             return code, uid
                     except Exception:
                         continue
                 print(f"DEBUG: No apareció el código todavía (intento #{attempt})")
-                time.sleep(0 if poll_every <= 0 else poll_every)
+                esperar_mail_nuevo(M, poll_every, timeout_sec - (time.time() - start))
                 try:
                     M.select("INBOX")
                 except Exception:
@@ -494,7 +1017,7 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
 
             # 2) RECENT + SUBJECT
             try:
-                typ, data = imap_search_utf8(M, 'RECENT', 'SUBJECT', f'"{subject_search}"')
+                typ, data = imap_search_desde(M, since_uid, 'RECENT', 'SUBJECT', f'"{subject_search}"')
                 if typ == 'OK' and data and data[0]:
                     uids = [int(x) for x in data[0].split()]
                     uids = sorted(uids, reverse=True)
@@ -504,26 +1027,26 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
                 uids = []
 
             if uids:
+                try:
+                    textos = uid_fetch_textos(M, uids)
+                except Exception:
+                    textos = {}
                 for uid in uids:
                     try:
-                        subj, body, date_hdr = uid_fetch_text(M, uid)
+                        subj, body, date_hdr = textos.get(uid, ("", "", None))
                         msg_dt = parse_email_date(date_hdr)
-                        code = extract_transfer_code_from_text(subj, body)
+                        code = codigo_cacheado(M, uid, "transfer", subj, body)
                         if not code:
                             m2 = generic_digits_re.search(body or "") or generic_digits_re.search(subj or "")
                             if m2:
                                 code = m2.group(1)
                         if code and message_time_matches_now(msg_dt):
                             print(f"DEBUG: Código de transferencia encontrado: {code}")
-                            try:
-                                M.logout()
-                            except Exception:
-                                pass
                             return code, uid
                     except Exception:
                         continue
                 print(f"DEBUG: No apareció el código todavía (intento #{attempt})")
-                time.sleep(0 if poll_every <= 0 else poll_every)
+                esperar_mail_nuevo(M, poll_every, timeout_sec - (time.time() - start))
                 try:
                     M.select("INBOX")
                 except Exception:
@@ -532,7 +1055,7 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
 
             # 3) SUBJECT (todos)
             try:
-                typ, data = imap_search_utf8(M, 'SUBJECT', f'"{subject_search}"')
+                typ, data = imap_search_desde(M, since_uid, 'SUBJECT', f'"{subject_search}"')
                 if typ == 'OK' and data and data[0]:
                     uids = [int(x) for x in data[0].split()]
                     uids = sorted(uids, reverse=True)
@@ -542,26 +1065,26 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
                 uids = []
 
             if uids:
+                try:
+                    textos = uid_fetch_textos(M, uids)
+                except Exception:
+                    textos = {}
                 for uid in uids:
                     try:
-                        subj, body, date_hdr = uid_fetch_text(M, uid)
+                        subj, body, date_hdr = textos.get(uid, ("", "", None))
                         msg_dt = parse_email_date(date_hdr)
-                        code = extract_transfer_code_from_text(subj, body)
+                        code = codigo_cacheado(M, uid, "transfer", subj, body)
                         if not code:
                             m2 = generic_digits_re.search(body or "") or generic_digits_re.search(subj or "")
                             if m2:
                                 code = m2.group(1)
                         if code and message_time_matches_now(msg_dt):
                             print(f"DEBUG: Código de transferencia encontrado: {code}")
-                            try:
-                                M.logout()
-                            except Exception:
-                                pass
                             return code, uid
                     except Exception:
                         continue
                 print(f"DEBUG: No apareció el código todavía (intento #{attempt})")
-                time.sleep(0 if poll_every <= 0 else poll_every)
+                esperar_mail_nuevo(M, poll_every, timeout_sec - (time.time() - start))
                 try:
                     M.select("INBOX")
                 except Exception:
@@ -570,7 +1093,7 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
 
             # 4) Fallback: UNSEEN generic - buscar frase exacta en cuerpo
             try:
-                typ, data = imap_search_utf8(M, 'UNSEEN')
+                typ, data = imap_search_desde(M, since_uid, 'UNSEEN')
                 if typ == 'OK' and data and data[0]:
                     uids_unseen = [int(x) for x in data[0].split()]
                     uids_unseen = sorted(uids_unseen, reverse=True)
@@ -579,9 +1102,13 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
             except Exception:
                 uids_unseen = []
 
+            try:
+                textos = uid_fetch_textos(M, uids_unseen)
+            except Exception:
+                textos = {}
             for uid in uids_unseen:
                 try:
-                    subj, body, date_hdr = uid_fetch_text(M, uid)
+                    subj, body, date_hdr = textos.get(uid, ("", "", None))
                     msg_dt = parse_email_date(date_hdr)
                     m = TRANSFER_CODE_RE.search(body or "")
                     code = None
@@ -593,43 +1120,39 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
                             code = m2.group(1)
                     if code and message_time_matches_now(msg_dt):
                         print(f"DEBUG: Código de transferencia encontrado: {code}")
-                        try:
-                            M.logout()
-                        except Exception:
-                            pass
                         return code, uid
                 except Exception:
                     continue
 
-            # 5) Fallback: revisar últimos N mensajes por cuerpo
+            # 5) Fallback: revisar por cuerpo todo lo llegado desde la marca
             try:
-                typ_all, data_all = M.uid('SEARCH', None, 'ALL')
+                typ_all, data_all = imap_search_desde(M, since_uid)
                 if typ_all == 'OK' and data_all and data_all[0]:
                     all_uids = [int(x) for x in data_all[0].split()]
-                    check_uids = sorted(all_uids[-200:], reverse=True)
+                    check_uids = sorted(all_uids, reverse=True)
                 else:
                     check_uids = []
             except Exception:
                 check_uids = []
 
+            try:
+                textos = uid_fetch_textos(M, check_uids)
+            except Exception:
+                textos = {}
             for uid in check_uids:
                 try:
-                    subj, body, date_hdr = uid_fetch_text(M, uid)
+                    subj, body, date_hdr = textos.get(uid, ("", "", None))
                     msg_dt = parse_email_date(date_hdr)
                     m = TRANSFER_CODE_RE.search(body or "")
                     if m and message_time_matches_now(msg_dt):
                         found_code = m.group(1)
                         print(f"DEBUG: Código de transferencia encontrado: {found_code}")
-                        try:
-                            M.logout()
-                        except Exception:
-                            pass
                         return found_code, uid
                 except Exception:
                     continue
 
             print(f"DEBUG: No apareció el código todavía (intento #{attempt})")
-            time.sleep(0 if poll_every <= 0 else poll_every)
+            esperar_mail_nuevo(M, poll_every, timeout_sec - (time.time() - start))
             try:
                 M.select("INBOX")
             except Exception:
@@ -638,10 +1161,395 @@ def get_latest_transfer_code_gmail(user: str, pwd: str, subject_search: str = "E
         raise TimeoutError("Mail de confirmación (Envío de código) no llegó a tiempo (timeout)")
     finally:
         if M:
+            pool.devolver(M)
+
+
+# ---------------------------
+# DESPACHADOR CENTRAL DE CÓDIGOS (un solo watcher del buzón para todos los workers)
+# ---------------------------
+def clasificar_codigo(subject: str, body: str) -> Optional[Tuple[str, str]]:
+    """
+    Clasifica un mail de KNOWN_SENDER. Devuelve (tipo, código) con tipo
+    "transfer" (código de confirmación de transferencia) o "login" (OTP de inicio
+    de sesión), o None si el mail no trae código.
+    """
+    m = TRANSFER_CODE_RE.search(body or "") or TRANSFER_CODE_RE.search(subject or "")
+    if m:
+        return "transfer", m.group(1)
+    m = OTP_PHRASE_RE.search(body or "") or OTP_PHRASE_RE.search(subject or "")
+    if m:
+        return "login", m.group(1)
+    m = TRANSFER_DIGITS_RE.search(body or "") or TRANSFER_DIGITS_RE.search(subject or "")
+    if not m:
+        return None
+    subj_low = (subject or "").lower()
+    if "envío de código" in subj_low or "envio de codigo" in subj_low or "transferencia" in subj_low:
+        return "transfer", m.group(1)
+    return "login", m.group(1)
+
+
+class CodeWaiter:
+    """
+    Espera registrada por un worker para un código de tipo `kind`.
+    Solo acepta mails con UID > min_uid y fecha posterior a la registración.
+    """
+
+    def __init__(self, kind: str, min_uid: int, requested_at: float):
+        self.kind = kind
+        self.min_uid = min_uid
+        self.requested_at = requested_at
+        self.event = threading.Event()
+        self.code: Optional[str] = None
+        self.uid: Optional[int] = None
+
+
+class MailboxDispatcher:
+    """
+    Watcher único del INBOX: lee cada mail nuevo de KNOWN_SENDER una sola vez y
+    entrega su código al CodeWaiter que corresponde (mismo tipo, UID posterior a
+    su registración, fecha compatible) en orden FIFO. Así varios workers pueden
+    esperar códigos a la vez sin robarse los mails entre ellos. Los de transferencia
+    no se pueden atribuir por contenido: TURNO_CODIGO deja uno solo en espera a la vez.
+    """
+
+    def __init__(self, user: str, pwd: str, poll_every: float = 1.0, idle_every: float = 30.0):
+        self.user = user
+        self.pwd = pwd
+        self.poll_every = poll_every
+        self.idle_every = idle_every
+        self._cond = threading.Condition()
+        self._waiters: List[CodeWaiter] = []
+        self._unclaimed: List[Tuple[int, str, str, Optional[datetime], float]] = []
+        self._last_uid = 0
+        self._ready = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, timeout: float = 30.0) -> bool:
+        self._thread = threading.Thread(target=self._run, name="mailbox-dispatcher", daemon=True)
+        self._thread.start()
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def register(self, kind: str, min_uid: Optional[int] = None) -> CodeWaiter:
+        """
+        Registra una espera. Llamar ANTES de disparar el mail (click en Ingresar /
+        Próximo) para que el código no pueda llegar antes que la espera.
+        """
+        with self._cond:
+            waiter = CodeWaiter(kind, self._last_uid if min_uid is None else min_uid, time.time())
+            for item in list(self._unclaimed):
+                uid, item_kind, code, msg_dt, _ = item
+                if item_kind == kind and uid > waiter.min_uid and self._fecha_compatible(waiter, msg_dt):
+                    self._unclaimed.remove(item)
+                    self._entregar(waiter, code, uid)
+                    return waiter
+            self._waiters.append(waiter)
+            self._cond.notify_all()
+        return waiter
+
+    def wait(self, waiter: CodeWaiter, timeout_sec: float) -> Tuple[str, int]:
+        if not waiter.event.wait(timeout_sec):
+            self.cancel(waiter)
+            if not waiter.event.is_set():
+                raise TimeoutError(f"Código ({waiter.kind}) no llegó a tiempo a Gmail (timeout)")
+        return waiter.code, waiter.uid
+
+    def cancel(self, waiter: CodeWaiter):
+        with self._cond:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    @staticmethod
+    def _fecha_compatible(waiter: CodeWaiter, msg_dt: Optional[datetime]) -> bool:
+        if msg_dt is None:
+            return True
+        try:
+            return msg_dt.timestamp() >= waiter.requested_at - OTP_CLOCK_SKEW_SEC
+        except Exception:
+            return True
+
+    @staticmethod
+    def _entregar(waiter: CodeWaiter, code: str, uid: int):
+        waiter.code = code
+        waiter.uid = uid
+        waiter.event.set()
+
+    def _despachar(self, uid: int, kind: str, code: str, msg_dt: Optional[datetime]):
+        with self._cond:
+            for waiter in self._waiters:
+                if waiter.kind == kind and uid > waiter.min_uid and self._fecha_compatible(waiter, msg_dt):
+                    self._waiters.remove(waiter)
+                    self._entregar(waiter, code, uid)
+                    return
+            # nadie lo esperaba (todavía): guardarlo un rato por si alguien pide desde un UID anterior
+            now = time.time()
+            self._unclaimed.append((uid, kind, code, msg_dt, now))
+            self._unclaimed = [u for u in self._unclaimed if now - u[4] < 300]
+
+    def _poll(self, M: imaplib.IMAP4_SSL):
+        try:
+            M.select("INBOX")
+        except Exception:
+            pass
+        typ, data = imap_search_desde(M, self._last_uid, 'FROM', f'"{KNOWN_SENDER}"')
+        if typ != 'OK' or not data or not data[0]:
+            return
+        nuevos = sorted(int(x) for x in data[0].split() if int(x) > self._last_uid)
+        textos = uid_fetch_textos(M, nuevos)
+        for uid in nuevos:
+            subject, body, date_hdr = textos.get(uid, ("", "", None))
+            with self._cond:
+                self._last_uid = max(self._last_uid, uid)
+            found = clasificar_codigo(subject, body)
+            if found:
+                self._despachar(uid, found[0], found[1], parse_email_date(date_hdr))
+
+    def _run(self):
+        pool = get_imap_pool(self.user, self.pwd)
+        M = None
+        while not self._stop:
+            try:
+                if M is None:
+                    M = pool.tomar()
+                    if not self._ready.is_set():
+                        self._last_uid = imap_uidnext(M) - 1
+                        self._ready.set()
+                self._poll(M)
+                if self._stop:
+                    break
+                if imap_soporta_idle(M):
+                    # push: vuelve apenas llega un mail nuevo (o al vencer el ciclo)
+                    try:
+                        imap_idle_wait(M, min(self.idle_every, IMAP_IDLE_MAX_WAIT))
+                        continue
+                    except (imaplib.IMAP4.abort, OSError):
+                        raise
+                    except Exception:
+                        M._idle_roto = True
+                with self._cond:
+                    if self._stop:
+                        break
+                    self._cond.wait(self.poll_every if self._waiters else self.idle_every)
+            except Exception as e:
+                print(f"ERROR_DEBUG:Despachador IMAP: {e}")
+                if M is not None:
+                    pool.devolver(M, descartar=True)
+                M = None
+                time.sleep(2)
+        if M is not None:
+            pool.devolver(M)
+
+
+_DISPATCHER: Optional[MailboxDispatcher] = None
+_DISPATCHER_LOCK = threading.Lock()
+
+
+def get_mailbox_dispatcher() -> Optional[MailboxDispatcher]:
+    """
+    Devuelve el despachador del proceso (lo arranca la primera vez).
+    None si está deshabilitado (OTP_DISPATCHER=0), sin credenciales o si no pudo conectar.
+    """
+    global _DISPATCHER
+    if not OTP_DISPATCHER or not (GMAIL_USER and GMAIL_PASS):
+        return None
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None:
+            disp = MailboxDispatcher(GMAIL_USER, GMAIL_PASS)
+            if not disp.start():
+                disp.stop()
+                return None
+            _DISPATCHER = disp
+        return _DISPATCHER
+
+
+def registrar_espera_codigo(kind: str, since_uid: Optional[int] = None) -> Optional[CodeWaiter]:
+    disp = get_mailbox_dispatcher()
+    return disp.register(kind, since_uid) if disp else None
+
+
+def esperar_codigo(waiter: CodeWaiter, timeout_sec: float) -> Tuple[str, int]:
+    return get_mailbox_dispatcher().wait(waiter, timeout_sec)
+
+
+def cancelar_espera_codigo(waiter: Optional[CodeWaiter]):
+    if waiter is not None and _DISPATCHER is not None:
+        _DISPATCHER.cancel(waiter)
+
+
+class TurnoCodigoTransferencia:
+    """
+    El mail del token no dice de qué transferencia es: con varios workers, dos pedidos en
+    vuelo a la vez podrían intercambiarse los códigos. Cada worker toma el turno antes del
+    click que dispara el mail y lo suelta apenas tiene su código (o se rindió), así el único
+    código de transferencia esperado en el proceso es siempre el propio. Soltar es idempotente.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def tomar(self):
+        if not getattr(self._local, "tomado", False):
+            self._lock.acquire()
+            self._local.tomado = True
+
+    def soltar(self):
+        if getattr(self._local, "tomado", False):
+            self._local.tomado = False
+            self._lock.release()
+
+    @contextmanager
+    def turno(self):
+        self.tomar()
+        try:
+            yield
+        finally:
+            self.soltar()
+
+
+TURNO_CODIGO = TurnoCodigoTransferencia()
+
+
+# ---------------------------
+# ESPERAS POR EVENTO (DOM + AJAX quieto + elemento habilitado)
+# ---------------------------
+def habilitar_log_red(options: webdriver.ChromeOptions, descargas: bool = False) -> None:
+    """
+    Pide a chromedriver los eventos CDP Network.* (performance log) que usa esperar_pagina_lista.
+    Con `descargas` también los Page.download* (bot_csv sigue con ellos cada export).
+    """
+    if not WAIT_EVENTOS and not descargas:
+        return
+    try:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": descargas})
+    except Exception:
+        pass
+
+
+class PageActivity:
+    """
+    Requests en vuelo del navegador según los eventos CDP Network.* del performance log.
+    Solo cuentan XHR/Fetch/Document (los AJAX de Scriptcase y las navegaciones).
+    Si el driver no tiene el log habilitado queda `disponible = False` y se usa jQuery.active.
+    Como el log se consume al leerlo, acá también quedan las descargas (Page/Browser.download*):
+    guid -> {"archivo": nombre sugerido, "estado": inProgress|completed|canceled, "ruta": ...}.
+    """
+
+    _TIPOS = ("XHR", "Fetch", "Document")
+
+    def __init__(self, driver: webdriver.Chrome):
+        self.driver = driver
+        self.pendientes: Dict[str, float] = {}
+        self.ultima_actividad = 0.0
+        self.disponible = True
+        self.descargas: Dict[str, Dict[str, Any]] = {}
+
+    def actualizar(self):
+        if not self.disponible:
+            return
+        try:
+            entries = self.driver.get_log("performance")
+        except Exception:
+            self.disponible = False
+            return
+        ahora = time.time()
+        for entry in entries:
             try:
-                M.logout()
+                msg = json.loads(entry["message"])["message"]
             except Exception:
-                pass
+                continue
+            method = msg.get("method", "")
+            params = msg.get("params") or {}
+            rid = params.get("requestId")
+            if method == "Network.requestWillBeSent":
+                if params.get("type") in self._TIPOS:
+                    self.pendientes[rid] = ahora
+                    self.ultima_actividad = ahora
+            elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+                if self.pendientes.pop(rid, None) is not None:
+                    self.ultima_actividad = ahora
+            elif method in ("Page.downloadWillBegin", "Browser.downloadWillBegin"):
+                self.descargas[params.get("guid")] = {"archivo": params.get("suggestedFilename"),
+                                                      "estado": "inProgress", "ruta": None}
+            elif method in ("Page.downloadProgress", "Browser.downloadProgress"):
+                d = self.descargas.setdefault(params.get("guid"), {"archivo": None, "estado": "inProgress", "ruta": None})
+                d["estado"] = params.get("state") or d["estado"]
+                d["ruta"] = params.get("filePath") or d["ruta"]
+        for rid, desde in list(self.pendientes.items()):
+            if ahora - desde > RED_PENDIENTE_MAX_SEC:
+                del self.pendientes[rid]
+
+
+def actividad_red(driver: webdriver.Chrome) -> PageActivity:
+    act = getattr(driver, "_actividad_red", None)
+    if act is None:
+        act = PageActivity(driver)
+        driver._actividad_red = act
+    return act
+
+
+# Estado de todos los documentos same-origin (desde window.top, sin cambiar de frame)
+_JS_ESTADO_PAGINA = r"""
+const sel = arguments[0];
+function docs(w, out){
+  try { out.push(w.document); for (let i = 0; i < w.frames.length; i++) docs(w.frames[i], out); } catch(e) {}
+  return out;
+}
+let raiz = window;
+try { if (window.top.document) raiz = window.top; } catch(e) {}
+let listo = true, ajax = 0, el = null;
+for (const d of docs(raiz, [])) {
+  if (d.readyState !== 'complete') listo = false;
+  try { const jq = d.defaultView.jQuery; if (jq && jq.active) ajax += jq.active; } catch(e) {}
+  if (sel && !el) { try { el = d.querySelector(sel); } catch(e) {} }
+}
+let elOk = true;
+if (sel) {
+  elOk = !!el && !el.disabled && !(el.classList && el.classList.contains('disabled'));
+  if (elOk) {
+    const st = el.ownerDocument.defaultView.getComputedStyle(el);
+    elOk = el.getClientRects().length > 0 && st.visibility !== 'hidden';
+  }
+}
+return {listo: listo, ajax: ajax, el: elOk};
+"""
+
+
+def esperar_pagina_lista(driver: webdriver.Chrome, max_wait: float, selector: Optional[str] = None,
+                         quieto: float = WAIT_QUIET_SEC) -> bool:
+    """
+    Espera a que la página esté lista en lugar de dormir un tiempo fijo: documentos en
+    readyState complete, sin AJAX pendiente (CDP Network + jQuery.active) durante `quieto`
+    segundos y, si se pasa `selector` (CSS), ese elemento visible y habilitado en algún frame.
+    max_wait es el sleep que había antes y se usa solo como tope. Devuelve False si se agotó.
+    """
+    if not WAIT_EVENTOS:
+        time.sleep(max_wait)
+        return True
+    inicio = time.time()
+    limite = inicio + max_wait
+    ocupada = inicio
+    act = actividad_red(driver)
+    while True:
+        act.actualizar()
+        try:
+            estado = driver.execute_script(_JS_ESTADO_PAGINA, selector) or {}
+        except Exception:
+            estado = {}
+        ahora = time.time()
+        if not estado.get("listo") or estado.get("ajax") or act.pendientes:
+            ocupada = ahora
+        if estado.get("el") and ahora - max(ocupada, act.ultima_actividad) >= quieto:
+            return True
+        if ahora >= limite:
+            return False
+        time.sleep(min(WAIT_POLL_SEC, max(0.0, limite - ahora)))
 
 
 # ---------------------------
@@ -740,149 +1648,247 @@ def find_otp_input_and_debug(driver: webdriver.Chrome, wait: WebDriverWait, time
     raise TimeoutException("No se encontró input OTP automáticamente")
 
 
-def _find_in_shadow_dom(driver: webdriver.Chrome, css_selector: str):
-    js = r"""
-    const sel = arguments[0];
-    function deepQuery(selector, root=document){
-      const parts = selector.split('>>>').map(s=>s.trim());
-      let cur = root;
-      for(const p of parts){
-        if(!cur) return null;
-        const el = cur.querySelector(p);
-        if(!el) return null;
-        if(parts.indexOf(p) !== parts.length-1){
-          cur = el.shadowRoot || el;
-        } else {
-          return el;
-        }
-      }
-      return cur;
+# Búsqueda en un solo execute_script: todos los frames same-origin + shadow roots, por prioridad
+_JS_BUSCAR_PROFUNDO = r"""
+const sels = arguments[0], soloVisibles = arguments[1], pista = arguments[2];
+function visible(el){
+  try {
+    return el.getClientRects().length > 0 && el.ownerDocument.defaultView.getComputedStyle(el).visibility !== 'hidden';
+  } catch(e) { return true; }
+}
+function frames(w, path, out){
+  let d;
+  try { d = w.document; if (!d) return out; } catch(e) { return out; }
+  out.push([w, d, path]);
+  for (let i = 0; i < w.frames.length; i++) frames(w.frames[i], path.concat([i]), out);
+  return out;
+}
+function sombras(doc){
+  const out = [], pila = [doc];
+  while (pila.length) {
+    const r = pila.pop();
+    for (const e of r.querySelectorAll('*')) { if (e.shadowRoot) { out.push(e.shadowRoot); pila.push(e.shadowRoot); } }
+  }
+  return out;
+}
+function candidatos(root, doc, tipo, valor){
+  let c = [];
+  try {
+    if (tipo === 'id') c = Array.from(root.querySelectorAll('[id="' + CSS.escape(valor) + '"]'));
+    else if (tipo === 'name') c = Array.from(root.querySelectorAll('[name="' + CSS.escape(valor) + '"]'));
+    else if (tipo === 'css') c = Array.from(root.querySelectorAll(valor));
+    else if (tipo === 'xpath') {
+      const r = doc.evaluate(valor, root, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+      for (let i = 0; i < r.snapshotLength; i++) c.push(r.snapshotItem(i));
     }
-    let q = document.querySelector(sel);
-    if(q) return q;
-    function walk(node){
-      if(node.querySelector){
-        let t = node.querySelector(sel);
-        if(t) return t;
+  } catch(e) { return []; }
+  return c.filter(e => e && e.nodeType === 1);
+}
+function entregar(w, el, path, idx){
+  if (!path.length) return {el: el, path: [], idx: idx};
+  w.__lohasDeepEl = el;
+  return {el: null, path: path, idx: idx};
+}
+// con pista (frame path del cache de esquema) solo se mira ese documento
+let docs = [];
+if (pista) {
+  try { let w = window; for (const i of pista) w = w.frames[i]; docs = [[w, w.document, pista]]; } catch(e) { docs = []; }
+} else {
+  docs = frames(window, [], []);
+}
+const cacheSombras = new Map();
+for (let k = 0; k < sels.length; k++) {
+  const [tipo, valor] = sels[k];
+  let oculto = null;
+  for (const [w, d, path] of docs) {
+    // primero el DOM normal; los shadow roots solo si ahí no hay nada visible
+    for (const root of [d, null]) {
+      let raices = [root];
+      if (root === null) {
+        if (!cacheSombras.has(d)) cacheSombras.set(d, sombras(d));
+        raices = cacheSombras.get(d);
       }
-      const children = node.children || [];
-      for(let i=0;i<children.length;i++){
-        const c = children[i];
-        if(c.shadowRoot){
-          const found = walk(c.shadowRoot);
-          if(found) return found;
+      for (const r of raices) {
+        for (const el of candidatos(r, d, tipo, valor)) {
+          if (visible(el)) return entregar(w, el, path, k);
+          if (!oculto) oculto = [w, el, path];
         }
-        const found2 = walk(c);
-        if(found2) return found2;
       }
-      return null;
     }
-    return walk(document);
+  }
+  if (oculto && !soloVisibles) return entregar(oculto[0], oculto[1], oculto[2], k);
+}
+return null;
+"""
+
+# Fallback histórico de locate_element_across_frames: links/botones de aceptar/confirmar
+_ACCEPT_FALLBACK_XPATH = "//a[contains(translate(normalize-space(.), 'ACEPTAR', 'aceptar'), 'acept') or contains(translate(normalize-space(.), 'CONFIRMAR', 'confirmar'), 'confirm') or contains(translate(normalize-space(.), 'VERIFICAR', 'verificar'), 'verif') or contains(translate(normalize-space(.), 'ENVIAR', 'enviar'), 'enviar') or //button]"
+
+
+def selector_profundo(by: By, value: str) -> Tuple[str, str]:
+    """Traduce un (By, valor) de Selenium al (tipo, valor) que entiende localizar_profundo."""
+    if by == By.ID:
+        return ("id", value)
+    if by == By.NAME:
+        return ("name", value)
+    if by == By.XPATH:
+        return ("xpath", value)
+    if by == By.TAG_NAME:
+        return ("css", value)
+    if by == By.CLASS_NAME:
+        return ("css", "." + value)
+    if by == By.LINK_TEXT:
+        return ("xpath", f"//a[normalize-space()='{value}']")
+    if by == By.PARTIAL_LINK_TEXT:
+        return ("xpath", f"//a[contains(., '{value}')]")
+    return ("css", value)
+
+
+class PageSchemaCache:
+    """
+    Esquema aprendido de las páginas de Lohas: para cada (URL, campo lógico) guarda qué
+    selector y qué frame path funcionaron. Se persiste en JSON y en la próxima corrida se
+    prueba primero con una búsqueda directa; si ahí no aparece, la entrada se borra y la
+    búsqueda completa registra dónde está ahora.
     """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._datos: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+
+    def _cargar(self) -> Dict[str, Dict[str, Any]]:
+        if self._datos is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._datos = json.load(f) or {}
+            except Exception:
+                self._datos = {}
+        return self._datos
+
+    def _guardar(self):
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._datos, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"ERROR_DEBUG:No se pudo guardar el esquema de páginas: {e}")
+
+    def get(self, pagina: str, campo: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._cargar().get(pagina, {}).get(campo)
+
+    def registrar(self, pagina: str, campo: str, selector: Tuple[str, str], path: List[int]):
+        with self._lock:
+            datos = self._cargar()
+            nuevo = {"sel": list(selector), "path": list(path)}
+            viejo = datos.get(pagina, {}).get(campo)
+            if viejo == nuevo:
+                return
+            if viejo is not None:
+                print(f"ERROR_DEBUG:Esquema desactualizado para {campo} en {pagina}, se reemplaza")
+            datos.setdefault(pagina, {})[campo] = nuevo
+            self._guardar()
+
+    def invalidar(self, pagina: str, campo: str):
+        with self._lock:
+            datos = self._cargar()
+            if datos.get(pagina, {}).pop(campo, None) is None:
+                return
+            if not datos[pagina]:
+                del datos[pagina]
+            print(f"ERROR_DEBUG:Esquema desactualizado para {campo} en {pagina}, se descarta")
+            self._guardar()
+
+
+PAGE_SCHEMA = PageSchemaCache(PAGE_SCHEMA_PATH)
+
+
+def clave_pagina(driver: webdriver.Chrome) -> str:
+    """URL sin query ni fragmento: identifica la pantalla de Lohas en el esquema."""
     try:
-        res = driver.execute_script(js, css_selector)
-        return res
+        parts = urlsplit(driver.current_url or "")
+        return f"{parts.netloc}{parts.path}"
     except Exception:
-        return None
+        return ""
 
 
-def _recursive_search_frames(driver: webdriver.Chrome, finder: Callable[[], Optional[webdriver.remote.webelement.WebElement]], depth: int = 0, max_depth: int = 6) -> Optional[webdriver.remote.webelement.WebElement]:
-    if depth > max_depth:
-        return None
+def _buscar_profundo_una_vez(driver: webdriver.Chrome, selectores: List[Tuple[str, str]], solo_visibles: bool,
+                             pista: Optional[List[int]] = None):
+    """Un intento de búsqueda: devuelve (elemento, índice del selector, frame path) o (None, -1, [])."""
+    try:
+        driver.switch_to.default_content()
+        res = driver.execute_script(_JS_BUSCAR_PROFUNDO, [list(s) for s in selectores], solo_visibles, pista)
+    except Exception:
+        res = None
+    if not res:
+        return None, -1, []
+    path = res.get("path") or []
+    idx = res.get("idx", 0)
+    if not path and res.get("el"):
+        return res.get("el"), idx, []
     try:
-        el = finder()
+        for i in path:
+            driver.switch_to.frame(i)
+        el = driver.execute_script("const e = window.__lohasDeepEl; window.__lohasDeepEl = null; return e;")
         if el:
-            try:
-                if el.is_displayed():
-                    return el
-            except Exception:
-                return el
+            return el, idx, path
     except Exception:
         pass
     try:
-        iframes = driver.find_elements(By.TAG_NAME, "iframe")
+        driver.switch_to.default_content()
     except Exception:
-        iframes = []
-    for i, fr in enumerate(iframes):
-        try:
-            try:
-                driver.switch_to.frame(fr)
-            except Exception:
-                try:
-                    driver.switch_to.default_content()
-                    driver.switch_to.frame(i)
-                except Exception:
-                    driver.switch_to.default_content()
-                    continue
-            found = _recursive_search_frames(driver, finder, depth + 1, max_depth)
-            if found:
-                return found
-            try:
-                driver.switch_to.parent_frame()
-            except Exception:
-                driver.switch_to.default_content()
-        except Exception:
-            try:
-                driver.switch_to.default_content()
-            except Exception:
-                pass
-    return None
+        pass
+    return None, -1, []
 
 
-def locate_element_across_frames(driver: webdriver.Chrome, by: By, value: str, timeout: float = 15.0, poll: float = 0.5) -> Optional[webdriver.remote.webelement.WebElement]:
+def localizar_profundo(driver: webdriver.Chrome, selectores: List[Tuple[str, str]], timeout: float = 15.0,
+                       poll: float = 0.25, solo_visibles: bool = False, campo: Optional[str] = None,
+                       respaldo: Optional[List[Tuple[str, str]]] = None) -> Optional[webdriver.remote.webelement.WebElement]:
+    """
+    Busca la lista priorizada de selectores ("id" | "name" | "css" | "xpath", valor) en todos los
+    frames same-origin y shadow roots con un único execute_script por intento. Si el elemento está
+    en un iframe deja el driver posicionado en ese frame (como hacía la búsqueda recursiva).
+    Prefiere elementos visibles; con solo_visibles=False cae al primero oculto del selector.
+    - campo: nombre lógico del campo; si se pasa se usa/actualiza el esquema en disco (PAGE_SCHEMA):
+      primero un sondeo corto al selector guardado (PAGE_SCHEMA_PROBE_SEC); si no aparece, la
+      entrada se descarta y la búsqueda con todos registra el selector y frame nuevos.
+    - respaldo: selectores de último recurso que se prueban después pero nunca se guardan en el esquema.
+    """
+    esquema = PAGE_SCHEMA if (campo and PAGE_SCHEMA_CACHE) else None
+    pagina = clave_pagina(driver) if esquema else ""
     deadline = time.time() + timeout
-    last_exc = None
-    while time.time() < deadline:
-        try:
-            driver.switch_to.default_content()
-        except Exception:
-            pass
-        def finder():
-            try:
-                return driver.find_element(by, value)
-            except Exception:
-                return None
-        try:
-            found = _recursive_search_frames(driver, finder)
-            if found:
-                return found
-        except Exception as e:
-            last_exc = e
-        try:
-            driver.switch_to.default_content()
-            el = finder()
-            if el:
-                return el
-        except Exception:
-            pass
-        def finder_text_accept():
-            try:
-                candidates = driver.find_elements(By.XPATH, "//a[contains(translate(normalize-space(.), 'ACEPTAR', 'aceptar'), 'acept') or contains(translate(normalize-space(.), 'CONFIRMAR', 'confirmar'), 'confirm') or contains(translate(normalize-space(.), 'VERIFICAR', 'verificar'), 'verif') or contains(translate(normalize-space(.), 'ENVIAR', 'enviar'), 'enviar') or //button]")
-                for c in candidates:
-                    try:
-                        if c.is_displayed():
-                            return c
-                    except Exception:
-                        return c
-                return None
-            except Exception:
-                return None
-        try:
-            driver.switch_to.default_content()
-            found_text = _recursive_search_frames(driver, finder_text_accept)
-            if found_text:
-                return found_text
-        except Exception:
-            pass
-        try:
-            driver.switch_to.default_content()
-            sd = _find_in_shadow_dom(driver, value if by == By.CSS_SELECTOR else value)
-            if sd:
-                return sd
-        except Exception:
-            pass
+    if esquema is not None:
+        hit = esquema.get(pagina, campo)
+        if hit:
+            # la página puede no haber terminado de renderizar: unos instantes al selector conocido
+            limite_hit = time.time() + min(timeout, PAGE_SCHEMA_PROBE_SEC)
+            while True:
+                el, _, _ = _buscar_profundo_una_vez(driver, [tuple(hit["sel"])], solo_visibles, hit.get("path") or [])
+                if el:
+                    return el
+                if time.time() >= limite_hit:
+                    break
+                time.sleep(poll)
+            esquema.invalidar(pagina, campo)
+    todos = list(selectores) + list(respaldo or [])
+    while True:
+        el, idx, path = _buscar_profundo_una_vez(driver, todos, solo_visibles)
+        if el:
+            if esquema is not None and 0 <= idx < len(selectores):
+                esquema.registrar(pagina, campo, selectores[idx], path)
+            return el
+        if time.time() >= deadline:
+            return None
         time.sleep(poll)
-    return None
+
+
+def locate_element_across_frames(driver: webdriver.Chrome, by: By, value: str, timeout: float = 15.0, poll: float = 0.5,
+                                 campo: Optional[str] = None) -> Optional[webdriver.remote.webelement.WebElement]:
+    # mismo orden que antes (elemento en frames/shadow, luego links de aceptar) pero en un solo round-trip
+    return localizar_profundo(driver, [selector_profundo(by, value)], timeout=timeout, poll=poll,
+                              campo=campo, respaldo=[("xpath", _ACCEPT_FALLBACK_XPATH)])
 
 
 def safe_click_element(driver: webdriver.Chrome, el: webdriver.remote.webelement.WebElement) -> bool:
@@ -908,7 +1914,6 @@ def safe_click_element(driver: webdriver.Chrome, el: webdriver.remote.webelement
 
 
 def find_first_numeric_input(driver: webdriver.Chrome, timeout: float = 10.0) -> Optional[webdriver.remote.webelement.WebElement]:
-    deadline = time.time() + timeout
     candidates_selectors = [
         ("id", "id_sc_field_importe"),
         ("id", "id_sc_field_monto"),
@@ -921,43 +1926,24 @@ def find_first_numeric_input(driver: webdriver.Chrome, timeout: float = 10.0) ->
         ("css", "input[type='tel']"),
         ("css", "input[type='text']"),
     ]
-    while time.time() < deadline:
-        try:
-            driver.switch_to.default_content()
-        except Exception:
-            pass
-        for typ, sel in candidates_selectors:
+    # todos los candidatos en una sola búsqueda (frames + shadow), en orden de prioridad
+    el = localizar_profundo(driver, candidates_selectors, timeout=timeout, solo_visibles=True, campo="importe")
+    if el:
+        return el
+    try:
+        driver.switch_to.default_content()
+        inputs = driver.find_elements(By.XPATH, "//input[(@type='text' or @type='number' or @type='tel') and not(contains(@style,'display:none'))]")
+        for inp in inputs:
             try:
-                if typ == "id":
-                    el = locate_element_across_frames(driver, By.ID, sel, timeout=1)
-                elif typ == "name":
-                    el = locate_element_across_frames(driver, By.NAME, sel, timeout=1)
-                else:
-                    el = locate_element_across_frames(driver, By.CSS_SELECTOR, sel, timeout=1)
-                if el:
-                    try:
-                        if el.is_displayed():
-                            return el
-                    except Exception:
-                        return el
+                if inp.is_displayed():
+                    name = (inp.get_attribute("name") or "").lower()
+                    idv = (inp.get_attribute("id") or "").lower()
+                    if any(k in name for k in ("monto", "importe", "valor", "amount", "cantidad")) or any(k in idv for k in ("monto", "importe", "valor", "amount")):
+                        return inp
             except Exception:
                 continue
-        try:
-            driver.switch_to.default_content()
-            inputs = driver.find_elements(By.XPATH, "//input[(@type='text' or @type='number' or @type='tel') and not(contains(@style,'display:none'))]")
-            for inp in inputs:
-                try:
-                    if inp.is_displayed():
-                        name = (inp.get_attribute("name") or "").lower()
-                        idv = (inp.get_attribute("id") or "").lower()
-                        ph = (inp.get_attribute("placeholder") or "").lower()
-                        if any(k in name for k in ("monto", "importe", "valor", "amount", "cantidad")) or any(k in idv for k in ("monto", "importe", "valor", "amount")):
-                            return inp
-                except Exception:
-                    continue
-        except Exception:
-            pass
-        time.sleep(0.5)
+    except Exception:
+        pass
     return None
 
 
@@ -988,7 +1974,7 @@ def select_select2_option_choose_varios_or_last(driver: webdriver.Chrome, combo_
         return False
     if not safe_click_element(driver, combo):
         return False
-    time.sleep(1.0)
+    esperar_pagina_lista(driver, 1.0, "li.select2-results__option")
     options = []
     try:
         options = driver.execute_script("return Array.from(document.querySelectorAll('li.select2-results__option'));")
@@ -1056,7 +2042,7 @@ def select_select2_option_choose_varios_or_last(driver: webdriver.Chrome, combo_
 
 def click_accept_button(driver: webdriver.Chrome, wait: WebDriverWait, timeout: float = 15.0):
     try:
-        el = locate_element_across_frames(driver, By.ID, ACCEPT_BTN_ID, timeout=timeout)
+        el = locate_element_across_frames(driver, By.ID, ACCEPT_BTN_ID, timeout=timeout, campo="aceptar")
         if el:
             ok = safe_click_element(driver, el)
             try:
@@ -1091,7 +2077,7 @@ def click_accept_button(driver: webdriver.Chrome, wait: WebDriverWait, timeout:
 
 def click_confirm_button(driver: webdriver.Chrome, wait: WebDriverWait, timeout: float = 15.0):
     try:
-        el = locate_element_across_frames(driver, By.ID, CONFIRM_BTN_ID, timeout=timeout)
+        el = locate_element_across_frames(driver, By.ID, CONFIRM_BTN_ID, timeout=timeout, campo="confirmar")
         if el:
             ok = safe_click_element(driver, el)
             try:
@@ -1153,24 +2139,62 @@ def create_transfer_log_file() -> str:
         return ""
 
 
-def log_transfer(log_file: str, transfer_number: int, cbu_origen: str, cbu_destino: str, monto: str, status: str = "COMPLETADA"):
+_LOG_LOCK = threading.Lock()
+
+
+def log_json_path(log_file: str) -> str:
+    """Log legible por máquina junto al .txt (una línea JSON por intento), lo lee conciliacion.py."""
+    return os.path.splitext(log_file)[0] + ".jsonl"
+
+
+def log_intento(log_file: str, transfer_number: int, cbu_origen: str, cbu_destino: str, monto: str,
+                status: str, transfer_id: str = "", fecha: Optional[str] = None,
+                inicio: Optional[str] = None):
+    """Registra un intento (completado o fallido) en el .jsonl del log; `inicio`: cuando arrancó."""
+    if not log_file:
+        return
+    registro = {
+        "n": transfer_number,
+        "id": transfer_id,
+        "estado": status,
+        "cbu_origen": cbu_origen,
+        "cbu_destino": cbu_destino,
+        "monto": monto,
+        "fecha": fecha or datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+    }
+    if inicio:
+        registro["inicio"] = inicio
+    try:
+        with _LOG_LOCK, open(log_json_path(log_file), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"ERROR_DEBUG:No se pudo escribir el log JSON: {e}")
+
+
+def log_transfer(log_file: str, transfer_number: int, cbu_origen: str, cbu_destino: str, monto: str,
+                 status: str = "COMPLETADA", transfer_id: str = "", fecha: Optional[str] = None,
+                 inicio: Optional[str] = None):
     """
-    Agrega una transferencia al archivo de log.
+    Agrega una transferencia al archivo de log (seguro entre workers concurrentes).
     """
     if not log_file or not os.path.exists(log_file):
         return
     
+    fecha = fecha or datetime.now().strftime('%d/%m/%Y %H:%M:%S')
     try:
-        with open(log_file, 'a', encoding='utf-8') as f:
+        with _LOG_LOCK, open(log_file, 'a', encoding='utf-8') as f:
             f.write(f"Transferencia #{transfer_number}: {status}\n")
+            if transfer_id:
+                f.write(f"  ID:             {transfer_id}\n")
             f.write(f"  CBU de ORIGEN:  {cbu_origen}\n")
             f.write(f"  CBU de DESTINO: {cbu_destino}\n")
             f.write(f"  MONTO:          ${monto}\n")
-            f.write(f"  Fecha/Hora:     {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+            f.write(f"  Fecha/Hora:     {fecha}\n")
             f.write("-" * 80 + "\n\n")
         _orig_print(f"Transfer #{transfer_number} registrada en log")
     except Exception as e:
         _orig_print(f"❌ Error escribiendo en log: {e}")
+    log_intento(log_file, transfer_number, cbu_origen, cbu_destino, monto, status, transfer_id, fecha, inicio)
 
 
 # ---------------------------
@@ -1274,133 +2298,618 @@ def read_transfers_from_csv(csv_path: str) -> List[Dict[str, Any]]:
 
 
 # ---------------------------
-# Opción B (secuencia principal)
+# CHROMEDRIVER (resolución cacheada + servicio compartido)
 # ---------------------------
-def opcion_b_selenium(cbu_destino: str = "0000155300000000001362", monto: str = "10000") -> Tuple[bool, str]:
+def _binario_chrome() -> Optional[str]:
+    """Ejecutable de Chrome instalado (sin lanzarlo), para armar la huella de versión."""
+    env = os.getenv("CHROME_BINARY")
+    if env and os.path.isfile(env):
+        return env
+    for nombre in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome"):
+        p = shutil.which(nombre)
+        if p:
+            return os.path.realpath(p)
+    candidatos = [
+        "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+        "/opt/google/chrome/chrome",
+    ]
+    for base in (os.getenv("PROGRAMFILES"), os.getenv("PROGRAMFILES(X86)"), os.getenv("LOCALAPPDATA")):
+        if base:
+            candidatos.append(os.path.join(base, "Google", "Chrome", "Application", "chrome.exe"))
+    for p in candidatos:
+        if os.path.isfile(p):
+            return p
+    return None
+
+
+def huella_chrome() -> str:
     """
-    Ejecuta una transferencia completa en una nueva instancia de navegador.
-    Devuelve (success: bool, cbu_origen: str).
-    - success: True si la transferencia se consideró exitosa, False en caso contrario.
-    - cbu_origen: CBU de la cuenta origen seleccionada (vacío si falla antes de seleccionar cuenta).
-    IMPORTANTE: no pide inputs manuales. Si OTP o código de transferencia no llegan -> devuelve False.
+    Identifica la instalación de Chrome por ruta + mtime + tamaño del ejecutable: cambia
+    cuando Chrome se actualiza y se calcula con un stat, sin subprocesos ni red.
     """
-    cbu_origen_selected = ""  # Variable para guardar el CBU origen seleccionado
-    options = webdriver.ChromeOptions()
-    options.add_argument("--start-maximized")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-web-security")
-    options.add_argument("--disable-features=VizDisplayCompositor")
-    options.add_argument("--remote-debugging-port=0")  # Use random port
-    if HEADLESS:
-        # usar modo headless moderno si disponible
-        options.add_argument("--headless=new")
+    path = _binario_chrome()
+    if not path:
+        return ""
+    try:
+        st = os.stat(path)
+        return f"{path}|{int(st.st_mtime)}|{st.st_size}"
+    except OSError:
+        return ""
+
+
+class ChromedriverCache:
+    """Ruta de chromedriver ya resuelta, persistida en JSON y válida mientras no cambie Chrome."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _leer(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f) or {}
+        except Exception:
+            return {}
+
+    def get(self, huella: str) -> Optional[str]:
+        datos = self._leer()
+        driver = datos.get("chromedriver")
+        if datos.get("huella") == huella and driver and os.path.isfile(driver):
+            return driver
+        return None
+
+    def guardar(self, huella: str, driver: str):
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"huella": huella, "chromedriver": driver}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"ERROR_DEBUG:No se pudo guardar la ruta de chromedriver: {e}")
+
+    def invalidar(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+CHROMEDRIVER_CACHE = ChromedriverCache(CHROMEDRIVER_CACHE_PATH)
+_CHROMEDRIVER_LOCK = threading.Lock()
+_CHROMEDRIVER_PATH: Optional[str] = None
 
-    # Crear driver con Selenium 4 usando ChromeService
+
+def _resolver_chromedriver_sin_cache() -> Optional[str]:
+    """Misma cadena que antes (Selenium Manager -> webdriver-manager -> PATH), pero sólo la ruta."""
     try:
-        from selenium.webdriver.chrome.service import Service as ChromeService
-    except Exception:
-        ChromeService = None
+        from selenium.webdriver.common.driver_finder import DriverFinder
+        opciones = webdriver.ChromeOptions()
+        if hasattr(DriverFinder, "get_path"):
+            return DriverFinder.get_path(ChromeService(), opciones)
+        return DriverFinder(ChromeService(), opciones).get_driver_path()
+    except Exception as e:
+        print(f"ERROR_DEBUG:Selenium Manager no pudo resolver chromedriver: {e}")
+    try:
+        return ChromeDriverManager().install()
+    except Exception as e:
+        print(f"ERROR_DEBUG:ChromeDriverManager falló: {e}")
+    return shutil.which("chromedriver")
+
+
+def resolver_chromedriver() -> Optional[str]:
+    """
+    Ruta de chromedriver. La primera vez en la máquina (o tras actualizar Chrome) se resuelve y
+    se guarda; después sale del cache en disco y dentro del proceso no se vuelve a mirar.
+    """
+    global _CHROMEDRIVER_PATH
+    with _CHROMEDRIVER_LOCK:
+        if _CHROMEDRIVER_PATH and os.path.isfile(_CHROMEDRIVER_PATH):
+            return _CHROMEDRIVER_PATH
+        huella = huella_chrome()
+        path = CHROMEDRIVER_CACHE.get(huella)
+        if path is None:
+            path = _resolver_chromedriver_sin_cache()
+            if path:
+                CHROMEDRIVER_CACHE.guardar(huella, path)
+        _CHROMEDRIVER_PATH = path
+        return path
+
+
+class ServicioChromedriverCompartido(ChromeService):
+    """
+    ChromeService que varias sesiones comparten: start() no relanza si el proceso sigue vivo
+    y el stop() que hace driver.quit() no lo mata; se termina con detener() al final.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_inicio = threading.Lock()
+
+    def activo(self) -> bool:
+        proc = getattr(self, "process", None)
+        return proc is not None and proc.poll() is None
+
+    def start(self) -> None:
+        with self._lock_inicio:
+            if not self.activo():
+                super().start()
+
+    def stop(self) -> None:
+        pass
+
+    def detener(self):
+        try:
+            super().stop()
+        except Exception:
+            pass
+        if self.activo():
+            # el shutdown remoto falló: matar el proceso directamente
+            try:
+                self.process.kill()
+                self.process.wait(5)
+            except Exception:
+                pass
+
+
+_SERVICIO_CHROMEDRIVER: Optional[ServicioChromedriverCompartido] = None
+_SERVICIO_LOCK = threading.Lock()
+
+
+def servicio_chromedriver() -> Optional[ChromeService]:
+    """
+    Service para crear un navegador sin resolver nada: el compartido (arrancado una sola vez)
+    o, con SHARED_CHROMEDRIVER=0, uno propio con la ruta cacheada. None si no hay chromedriver.
+    """
+    global _SERVICIO_CHROMEDRIVER
+    path = resolver_chromedriver()
+    if not path:
+        return None
+    if not SHARED_CHROMEDRIVER:
+        return ChromeService(path)
+    with _SERVICIO_LOCK:
+        if _SERVICIO_CHROMEDRIVER is None or _SERVICIO_CHROMEDRIVER.path != path:
+            if _SERVICIO_CHROMEDRIVER is not None:
+                _SERVICIO_CHROMEDRIVER.detener()
+            _SERVICIO_CHROMEDRIVER = ServicioChromedriverCompartido(path)
+        _SERVICIO_CHROMEDRIVER.start()
+        return _SERVICIO_CHROMEDRIVER
+
+
+def descartar_chromedriver_cacheado():
+    """La ruta cacheada no sirvió (p. ej. Chrome se actualizó a otra versión mayor): olvidarla."""
+    global _CHROMEDRIVER_PATH, _SERVICIO_CHROMEDRIVER
+    with _CHROMEDRIVER_LOCK:
+        _CHROMEDRIVER_PATH = None
+        CHROMEDRIVER_CACHE.invalidar()
+    with _SERVICIO_LOCK:
+        if _SERVICIO_CHROMEDRIVER is not None:
+            _SERVICIO_CHROMEDRIVER.detener()
+        _SERVICIO_CHROMEDRIVER = None
+
+
+def cerrar_servicio_chromedriver():
+    global _SERVICIO_CHROMEDRIVER
+    with _SERVICIO_LOCK:
+        if _SERVICIO_CHROMEDRIVER is not None:
+            _SERVICIO_CHROMEDRIVER.detener()
+        _SERVICIO_CHROMEDRIVER = None
+
+
+atexit.register(cerrar_servicio_chromedriver)
+
+
+def nuevo_chrome(options: webdriver.ChromeOptions) -> webdriver.Chrome:
+    """
+    webdriver.Chrome sobre el chromedriver cacheado/compartido. Si la ruta cacheada falla se
+    descarta y se vuelve a la resolución completa de siempre para este navegador.
+    """
+    try:
+        service = servicio_chromedriver()
+    except Exception as e:
+        print(f"ERROR_DEBUG:No se pudo iniciar chromedriver cacheado: {e}")
+        descartar_chromedriver_cacheado()
+        service = None
+    if service is not None:
+        try:
+            return webdriver.Chrome(service=service, options=options)
+        except Exception as e:
+            print(f"ERROR_DEBUG:Chromedriver cacheado no pudo crear el navegador: {e}")
+            descartar_chromedriver_cacheado()
 
     try:
         # Preferir Selenium Manager (Selenium 4.6+) para resolver el driver automáticamente
-        driver = webdriver.Chrome(options=options)
+        return webdriver.Chrome(options=options)
     except Exception as e_first:
         print(f"ERROR_DEBUG:Selenium Manager no pudo crear driver: {str(e_first)}")
         # Fallback 1: webdriver-manager descarga y arma el Service con la ruta del exe
         try:
-            if ChromeService is not None:
-                service = ChromeService(ChromeDriverManager().install())
-                driver = webdriver.Chrome(service=service, options=options)
-            else:
-                driver = webdriver.Chrome(options=options)
+            return webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
         except Exception as e:
             print(f"ERROR_DEBUG:ChromeDriverManager falló: {str(e)}")
             # Fallback 2: chromedriver en PATH con Service vacío
             try:
-                if ChromeService is not None:
-                    service = ChromeService()
-                    driver = webdriver.Chrome(service=service, options=options)
-                else:
-                    driver = webdriver.Chrome(options=options)
+                return webdriver.Chrome(service=ChromeService(), options=options)
             except Exception as e2:
                 print(f"ERROR_DEBUG:Fallo creando driver con fallback: {e2}")
                 raise
-    
+
+
+# ---------------------------
+# PERFIL LIVIANO (LEAN_BROWSER)
+# ---------------------------
+# Lo que el bot nunca mira. Las hojas de estilo NO se bloquean: la visibilidad de los campos
+# (localizar_profundo con solo_visibles) y los dropdowns de select2 dependen del CSS.
+RECURSOS_BLOQUEADOS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.wav",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*hotjar.com*",
+]
+
+# Extras que Chrome carga por defecto y el bot no necesita
+_ARGS_LIVIANOS = [
+    "--disable-extensions",
+    "--disable-component-extensions-with-background-pages",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-client-side-phishing-detection",
+    "--disable-domain-reliability",
+    "--metrics-recording-only",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+]
+
+_PERFILES_TEMPORALES: List[str] = []
+
+
+def _dir_perfil_temporal() -> str:
+    """Directorio de perfil propio por navegador, en tmpfs si existe (Linux); si no, en el temp del sistema."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+    path = tempfile.mkdtemp(prefix="lohas-chrome-", dir=base)
+    _PERFILES_TEMPORALES.append(path)
+    return path
+
+
+def _borrar_perfiles_temporales():
+    for path in _PERFILES_TEMPORALES:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+atexit.register(_borrar_perfiles_temporales)
+
+
+def cerrar_navegador(driver: Optional[webdriver.Chrome]) -> None:
+    """driver.quit() y, si tenía perfil temporal (LEAN_BROWSER), liberar ese espacio de tmpfs."""
+    if driver is None:
+        return
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    perfil = getattr(driver, "_perfil_temporal", None)
+    if perfil:
+        shutil.rmtree(perfil, ignore_errors=True)
+
+
+def aplicar_perfil_liviano(options: webdriver.ChromeOptions) -> Optional[str]:
+    """
+    Argumentos y prefs del perfil liviano. Devuelve el directorio de perfil temporal (para
+    asignarlo a driver._perfil_temporal) o None si LEAN_BROWSER está apagado.
+    """
+    if not LEAN_BROWSER:
+        return None
+    for arg in _ARGS_LIVIANOS:
+        options.add_argument(arg)
+    perfil = _dir_perfil_temporal()
+    options.add_argument(f"--user-data-dir={perfil}")
+    options.add_argument(f"--disk-cache-dir={os.path.join(perfil, 'cache')}")
+    # se suman a las prefs existentes (p. ej. las de descarga de bot_csv), no las pisan
+    prefs = dict(options.experimental_options.get("prefs", {}))
+    prefs.update({
+        "profile.managed_default_content_settings.images": 2,
+        "profile.default_content_setting_values.notifications": 2,
+        "credentials_enable_service": False,
+        "profile.password_manager_enabled": False,
+    })
+    options.add_experimental_option("prefs", prefs)
+    return perfil
+
+
+def bloquear_recursos(driver: webdriver.Chrome) -> None:
+    """Corta por CDP las descargas de imágenes, fuentes, media y trackers (LEAN_BROWSER)."""
+    if not LEAN_BROWSER:
+        return
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": RECURSOS_BLOQUEADOS + LEAN_BLOCKED_URLS})
+    except Exception as e:
+        print(f"ERROR_DEBUG:No se pudo activar el bloqueo de recursos: {e}")
+
+
+# ---------------------------
+# Opción B (secuencia principal)
+# ---------------------------
+def crear_driver_chrome() -> webdriver.Chrome:
+    """
+    Crea una instancia nueva de Chrome con las opciones del bot y timeouts configurados.
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument("--start-maximized")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-web-security")
+    options.add_argument("--disable-features=VizDisplayCompositor")
+    options.add_argument("--remote-debugging-port=0")  # Use random port
+    habilitar_log_red(options)
+    if HEADLESS:
+        # usar modo headless moderno si disponible
+        options.add_argument("--headless=new")
+
+    perfil = aplicar_perfil_liviano(options)
+
+    # Chromedriver ya resuelto (cache en disco) y proceso compartido entre sesiones
+    driver = nuevo_chrome(options)
+    driver._perfil_temporal = perfil
+    bloquear_recursos(driver)
+
     # Set proper timeouts to prevent hanging
     driver.set_page_load_timeout(60)
     driver.implicitly_wait(10)
+    return driver
 
-    success = False
-    try:
-        print("ERROR_DEBUG:Iniciando navegación del navegador")
-        driver.get(URL_B)
-        wait = WebDriverWait(driver, 30)
-        print("ERROR_DEBUG:Página cargada, buscando campos de login")
 
-        # Usuario
-        print("ERROR_DEBUG:Buscando campo de usuario")
-        user_input = wait.until(EC.presence_of_element_located((By.ID, FIELD_LOGIN_ID)))
+# ---------------------------
+# POOL DE NAVEGADORES (Chrome pre-lanzados)
+# ---------------------------
+# Orígenes cuyos datos se borran al devolver un navegador al pool
+ORIGENES_LOHAS = (LOHAS_BASE_URL,)
+
+
+class BrowserPool:
+    """
+    Mantiene `size` navegadores ya lanzados (se crean en segundo plano con `fabrica`).
+    tomar() entrega uno sano al instante y dispara la reposición; devolver() lo deja
+    limpio (sin cookies ni storage, en about:blank) para el próximo uso o lo cierra.
+    Con reponer_al_tomar=False (o tomar(reponer=False), para quien se queda el navegador
+    todo el lote) no se lanza un reemplazo al tomar: sólo se reutiliza lo devuelto.
+    """
+
+    def __init__(self, size: int, fabrica: Callable[[], webdriver.Chrome], nombre: str = "browser",
+                 reponer_al_tomar: bool = True):
+        self.size = max(0, size)
+        self.fabrica = fabrica
+        self.nombre = nombre
+        self.reponer_al_tomar = reponer_al_tomar
+        self._libres: "queue.Queue[webdriver.Chrome]" = queue.Queue()
+        self._lanzando = 0
+        self._lock = threading.Lock()
+        self._cerrado = False
+        self._reponer()
+
+    def _reponer(self):
+        with self._lock:
+            if self._cerrado:
+                return
+            faltan = self.size - self._libres.qsize() - self._lanzando
+            self._lanzando += max(0, faltan)
+        for _ in range(max(0, faltan)):
+            threading.Thread(target=self._lanzar, daemon=True, name=f"{self.nombre}-warm").start()
+
+    def _lanzar(self):
+        driver = None
         try:
-            user_input.clear()
-        except Exception:
-            pass
-        user_input.send_keys(USER_B)
-        print("ERROR_DEBUG:Usuario ingresado")
+            driver = self.fabrica()
+        except Exception as e:
+            print(f"ERROR_DEBUG:No se pudo pre-lanzar navegador: {e}")
+        finally:
+            with self._lock:
+                self._lanzando -= 1
+                cerrado = self._cerrado
+        if driver is None:
+            return
+        if cerrado:
+            self._quit(driver)
+        else:
+            self._libres.put(driver)
+
+    @staticmethod
+    def _quit(driver: webdriver.Chrome):
+        cerrar_navegador(driver)
 
-        # Password
-        pass_input = wait.until(EC.presence_of_element_located((By.ID, FIELD_PASS_ID)))
+    @staticmethod
+    def _sano(driver: webdriver.Chrome) -> bool:
         try:
-            pass_input.clear()
+            driver.execute_script("return 1")
+            return True
         except Exception:
-            pass
-        pass_input.send_keys(PASS_B)
+            return False
 
-        # Click Ingresar
-        login_btn = None
-        for by_name, sel in [("CSS_SELECTOR", LOGIN_BTN_CSS), ("XPATH", "//input[@class='button' and @value='Ingresar']"), ("XPATH", "//button[contains(., 'Ingresar')]")]:
+    def tomar(self, timeout: float = 0.0, reponer: Optional[bool] = None) -> webdriver.Chrome:
+        """
+        Navegador listo para usar. Si hay uno pre-lanzado (o termina de lanzarse dentro de
+        `timeout`) se entrega ese; si no, se crea uno en el momento como antes.
+        reponer=None usa reponer_al_tomar del pool.
+        """
+        if reponer is None:
+            reponer = self.reponer_al_tomar
+        deadline = time.time() + timeout
+        while True:
             try:
-                login_btn = wait.until(EC.element_to_be_clickable((getattr(By, by_name), sel)))
+                espera = max(0.0, deadline - time.time())
+                driver = self._libres.get(timeout=espera) if espera > 0 else self._libres.get_nowait()
+            except queue.Empty:
                 break
+            if self._sano(driver):
+                if reponer:
+                    self._reponer()
+                return driver
+            self._quit(driver)
+        if reponer:
+            self._reponer()
+        return self.fabrica()
+
+    def _resetear(self, driver: webdriver.Chrome):
+        handles = driver.window_handles
+        for h in handles[1:]:
+            driver.switch_to.window(h)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.switch_to.default_content()
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origen in ORIGENES_LOHAS:
+            try:
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origen, "storageTypes": "all"})
             except Exception:
-                login_btn = None
-        if not login_btn:
-            # no se encontró el botón -> considerar fallo de transferencia
-            return (False, cbu_origen_selected)
+                pass
+        driver.get("about:blank")
+        # el tracker de red (esperar_pagina_lista) arranca de cero con el próximo dueño
+        driver._actividad_red = None
         try:
-            login_btn.click()
+            driver.get_log("performance")
         except Exception:
+            pass
+
+    def devolver(self, driver: Optional[webdriver.Chrome], descartar: bool = False):
+        if driver is None:
+            return
+        if not descartar and not self._cerrado and self._libres.qsize() < self.size and self._sano(driver):
             try:
-                driver.execute_script("arguments[0].click();", login_btn)
+                self._resetear(driver)
+                self._libres.put(driver)
+                return
             except Exception:
                 pass
+        self._quit(driver)
+        if self.reponer_al_tomar:
+            self._reponer()
+
+    def cerrar(self, espera_lanzamientos: float = 30.0):
+        with self._lock:
+            self._cerrado = True
+        # los que se están lanzando se cierran solos al terminar; se espera un poco para no dejar Chrome huérfanos
+        deadline = time.time() + espera_lanzamientos
+        while self._lanzando > 0 and time.time() < deadline:
+            time.sleep(0.2)
+        while True:
+            try:
+                self._quit(self._libres.get_nowait())
+            except queue.Empty:
+                break
 
-        # Esperar posible redirección al 2FA
-        try:
-            wait.until(EC.url_contains("app_control_2fa"))
-        except Exception:
-            # no necesariamente fatal, seguir intentando encontrar OTP
-            pass
+
+_BROWSER_POOL: Optional[BrowserPool] = None
+_BROWSER_POOL_LOCK = threading.Lock()
+
+
+def get_browser_pool() -> Optional[BrowserPool]:
+    """Pool global de Chrome para las transferencias (None si BROWSER_POOL_SIZE=0)."""
+    global _BROWSER_POOL
+    if BROWSER_POOL_SIZE <= 0:
+        return None
+    with _BROWSER_POOL_LOCK:
+        if _BROWSER_POOL is None:
+            _BROWSER_POOL = BrowserPool(BROWSER_POOL_SIZE, crear_driver_chrome, nombre="transfer")
+        return _BROWSER_POOL
+
+
+def obtener_driver(reponer: bool = True) -> webdriver.Chrome:
+    """reponer=False: el que lo toma se lo queda (sesión reutilizada), no hace falta otro Chrome en espera."""
+    pool = get_browser_pool()
+    return pool.tomar(reponer=reponer) if pool is not None else crear_driver_chrome()
+
+
+def liberar_driver(driver: Optional[webdriver.Chrome], descartar: bool = False):
+    pool = get_browser_pool()
+    if pool is not None:
+        pool.devolver(driver, descartar)
+    else:
+        cerrar_navegador(driver)
+
+
+def cerrar_browser_pool():
+    global _BROWSER_POOL
+    with _BROWSER_POOL_LOCK:
+        pool, _BROWSER_POOL = _BROWSER_POOL, None
+    if pool is not None:
+        pool.cerrar()
+
+
+def login_lohas(driver: webdriver.Chrome) -> bool:
+    """
+    Login completo en Lohas: usuario/contraseña, OTP por Gmail, Aceptar y Confirmar.
+    Devuelve True si se llegó a confirmar el 2FA (sesión autenticada).
+    """
+    print("ERROR_DEBUG:Iniciando navegación del navegador")
+    driver.get(URL_B)
+    wait = WebDriverWait(driver, 30)
+    print("ERROR_DEBUG:Página cargada, buscando campos de login")
+
+    # Usuario
+    print("ERROR_DEBUG:Buscando campo de usuario")
+    user_input = wait.until(EC.presence_of_element_located((By.ID, FIELD_LOGIN_ID)))
+    try:
+        user_input.clear()
+    except Exception:
+        pass
+    user_input.send_keys(USER_B)
+    print("ERROR_DEBUG:Usuario ingresado")
+
+    # Password
+    pass_input = wait.until(EC.presence_of_element_located((By.ID, FIELD_PASS_ID)))
+    try:
+        pass_input.clear()
+    except Exception:
+        pass
+    pass_input.send_keys(PASS_B)
+
+    # Registrar la espera del OTP antes de que el click dispare el mail
+    otp_waiter = registrar_espera_codigo("login") if GMAIL_USER and GMAIL_PASS else None
+
+    try:
+        # Click Ingresar
+        login_btn = None
+        for by_name, sel in [("CSS_SELECTOR", LOGIN_BTN_CSS), ("XPATH", "//input[@class='button' and @value='Ingresar']"), ("XPATH", "//button[contains(., 'Ingresar')]")]:
+            try:
+                login_btn = wait.until(EC.element_to_be_clickable((getattr(By, by_name), sel)))
+                break
+            except Exception:
+                login_btn = None
+        if not login_btn:
+            # no se encontró el botón -> considerar fallo de transferencia
+            return False
+        try:
+            login_btn.click()
+        except Exception:
+            try:
+                driver.execute_script("arguments[0].click();", login_btn)
+            except Exception:
+                pass
+
+        # Esperar posible redirección al 2FA
+        try:
+            wait.until(EC.url_contains("app_control_2fa"))
+        except Exception:
+            # no necesariamente fatal, seguir intentando encontrar OTP
+            pass
 
         # Buscar campo OTP (si no hay -> fallo)
         try:
             otp_input = find_otp_input_and_debug(driver, wait, timeout=10)
         except Exception:
             # no se encontró campo OTP -> considerar transferencia fallida
-            return (False, cbu_origen_selected)
+            return False
 
-        # Preparar baseline UID para IMAP
+        # Preparar baseline UID para IMAP (solo sin despachador)
         since_uid = None
-        if GMAIL_USER and GMAIL_PASS:
+        if GMAIL_USER and GMAIL_PASS and otp_waiter is None:
             try:
-                Mtmp = imap_connect(GMAIL_IMAP_HOST, GMAIL_USER, GMAIL_PASS)
-                all_uids = uid_search_all(Mtmp, "ALL")
-                since_uid = max(all_uids) if all_uids else 0
-                try:
-                    Mtmp.logout()
-                except Exception:
-                    pass
+                with get_imap_pool(GMAIL_USER, GMAIL_PASS).conexion() as Mtmp:
+                    since_uid = imap_uidnext(Mtmp) - 1
             except Exception:
                 since_uid = None
 
@@ -1408,13 +2917,16 @@ def opcion_b_selenium(cbu_destino: str = "0000155300000000001362", monto: str =
         otp_code = ""
         try:
             if GMAIL_USER and GMAIL_PASS:
-                otp_code, got_uid = get_latest_otp_gmail(user=GMAIL_USER, pwd=GMAIL_PASS, timeout_sec=120, poll_every=2.0, since_uid=since_uid)
+                if otp_waiter is not None:
+                    otp_code, got_uid = esperar_codigo(otp_waiter, 120)
+                else:
+                    otp_code, got_uid = get_latest_otp_gmail(user=GMAIL_USER, pwd=GMAIL_PASS, timeout_sec=120, poll_every=2.0, since_uid=since_uid)
             else:
                 # sin credenciales gmail -> no puede operar
-                return (False, cbu_origen_selected)
+                return False
         except Exception:
             # No se obtuvo OTP -> marcar falla
-            return (False, cbu_origen_selected)
+            return False
 
         # Pegar OTP
         try:
@@ -1425,7 +2937,7 @@ def opcion_b_selenium(cbu_destino: str = "0000155300000000001362", monto: str =
             otp_input.send_keys(otp_code)
         except Exception:
             # no se pudo pegar OTP -> fallo
-            return (False, cbu_origen_selected)
+            return False
 
         # Buscar botón validar/confirmar y click (si existe)
         validate_btn = None
@@ -1455,7 +2967,7 @@ def opcion_b_selenium(cbu_destino: str = "0000155300000000001362", monto: str =
         except Exception:
             pass
 
-        time.sleep(1.0)
+        esperar_pagina_lista(driver, 1.0, f"#{CONFIRM_BTN_ID}")
 
         # Click en Confirmar final (sub_form_b)
         ok_confirm = False
@@ -1465,312 +2977,1727 @@ def opcion_b_selenium(cbu_destino: str = "0000155300000000001362", monto: str =
             ok_confirm = False
 
         if ok_confirm:
-            time.sleep(3)
+            guardar_sesion_driver(driver)
+        return ok_confirm
+    finally:
+        # si no se llegó a usar (fallo antes del OTP) liberar la espera
+        cancelar_espera_codigo(otp_waiter)
+
+
+def abrir_transferencias_desde_menu(driver: webdriver.Chrome) -> None:
+    """
+    Abre la pantalla de transferencias desde el menú lateral (flujo tras el login).
+    """
+    esperar_pagina_lista(driver, 3, "#nav_list", quieto=WAIT_QUIET_NAV_SEC)
+    try:
+        # Click en el menú "Transferencias" dentro de ul#nav_list (último wrapper)
+        xpath_menu = (
+            "//ul[@id='nav_list']//li[contains(@class,'wrapper')][last()]//a["
+            "contains(@href,'form_transferencias') or @tab-title='Transferencias' or .//span[contains(normalize-space(),'Transferencias')]"
+            "]"
+        )
+        menu_link = locate_element_across_frames(driver, By.XPATH, xpath_menu, timeout=12)
+        if not menu_link:
+            # Fallback: buscar cualquier enlace de Transferencias visible
+            menu_link = locate_element_across_frames(
+                driver,
+                By.XPATH,
+                "//a[contains(@href,'form_transferencias') or .//span[contains(normalize-space(),'Transferencias')] or @tab-title='Transferencias']",
+                timeout=8,
+            )
+        if menu_link:
+            safe_click_element(driver, menu_link)
+        # Esperar (hasta 2s) a que cargue y continuar
+        esperar_pagina_lista(driver, 2, quieto=WAIT_QUIET_NAV_SEC)
+    except Exception:
+        pass
+
+
+def parse_monto(monto: Any) -> float:
+    """
+    Monto del CSV a float. El CSV viene en formato inglés (20000.00) pero se aceptan
+    también 1.000,50 y 1000,50 (formato argentino). Si no se puede convertir -> 0.
+    """
+    try:
+        monto_str = str(monto).strip()
+        # Detectar si es formato argentino (con coma decimal) o inglés (con punto decimal)
+        if ',' in monto_str and '.' in monto_str:
+            # Formato argentino: 1.000,50 -> eliminar punto (miles) y reemplazar coma por punto
+            return float(monto_str.replace('.', '').replace(',', '.'))
+        elif ',' in monto_str:
+            # Solo coma: formato argentino: 1000,50
+            return float(monto_str.replace(',', '.'))
+        # Solo punto o sin separadores: formato inglés: 1000.50 o 1000
+        return float(monto_str)
+    except Exception as e:
+        print(f"ERROR_DEBUG:Error convirtiendo monto '{monto}': {e}")
+        return 0
+
+
+def parse_saldo(saldo_text: str) -> float:
+    """Saldo de la pantalla ("24.500,00") a float."""
+    return float(saldo_text.replace('.', '').replace(',', '.'))
+
+
+def leer_saldos_cuentas(driver: webdriver.Chrome) -> Optional[List[Dict[str, Any]]]:
+    """
+    Recorre una sola vez las cuentas origen del select de la pantalla de transferencias
+    y devuelve [{'value', 'text', 'cbu', 'saldo'}]. None si no se pudo leer el select.
+    """
+    esperar_pagina_lista(driver, 2, "#id_sc_field_idcuenta")
+    select_origen = locate_element_across_frames(driver, By.ID, "id_sc_field_idcuenta", timeout=15, campo="cuenta_origen")
+    if not select_origen:
+        return None
+    try:
+        options = select_origen.find_elements(By.TAG_NAME, "option")
+    except Exception as e:
+        print(f"ERROR_DEBUG:Error obteniendo opciones del select: {e}")
+        return None
+    cuentas: List[Dict[str, Any]] = []
+    for option in options:
+        try:
+            cuenta_text = option.text
+            cuenta_value = option.get_attribute("value") or ""
+            driver.execute_script("arguments[0].selected = true; arguments[0].dispatchEvent(new Event('change', {bubbles: true}));", option)
+            esperar_pagina_lista(driver, 1.5, "#id_sc_field_saldo")
+            saldo_field = locate_element_across_frames(driver, By.ID, "id_sc_field_saldo", timeout=5, campo="saldo")
+            if not saldo_field:
+                continue
+            saldo = parse_saldo(saldo_field.get_attribute("value") or "")
+        except Exception as e:
+            print(f"ERROR_DEBUG:No se pudo leer el saldo de una cuenta origen: {e}")
+            continue
+        cbu_match = re.search(r'\((\d{22})\)', cuenta_text or "")
+        cuentas.append({
+            'value': cuenta_value,
+            'text': cuenta_text,
+            'cbu': cbu_match.group(1) if cbu_match else "",
+            'saldo': saldo,
+        })
+        print(f"ERROR_DEBUG:Saldo cuenta {cuenta_text}: {saldo}")
+    return cuentas
+
+
+class BalanceLedger:
+    """
+    Saldos de las cuentas origen leídos una vez por sesión. Las transferencias se asignan
+    a cuentas antes de abrir ningún formulario (mayor monto primero, a la cuenta donde
+    entra más justo) y el saldo se descuenta localmente al completarse cada una.
+    Un intento fallido libera su reserva; antes de cada pasada de reintento se releen los
+    saldos (actualizar_saldos) y las pendientes se vuelven a asignar.
+    """
+
+    def __init__(self, cuentas: List[Dict[str, Any]]):
+        self.cuentas: Dict[str, Dict[str, Any]] = {}
+        for c in cuentas:
+            self.cuentas[c['value']] = dict(c, reservado=0.0)
+        self.asignacion: Dict[int, Tuple[str, float]] = {}
+        self._liberadas: Dict[int, Tuple[str, float]] = {}  # fallidas: por si igual salieron
+        self._lock = threading.Lock()
+
+    def disponible(self, value: str) -> float:
+        c = self.cuentas[value]
+        return c['saldo'] - c['reservado']
+
+    def asignar(self, montos: Dict[int, float]) -> List[int]:
+        """
+        Asigna cada transferencia {idx: monto} a una cuenta con saldo (best-fit decreciente)
+        y reserva el monto. Devuelve los índices que no entran en ninguna cuenta.
+        """
+        sin_saldo: List[int] = []
+        with self._lock:
+            for idx in montos:
+                self._soltar(idx)
+                self._liberadas.pop(idx, None)
+            for idx, monto in sorted(montos.items(), key=lambda kv: (-kv[1], kv[0])):
+                candidatas = [v for v in self.cuentas if self.disponible(v) >= monto]
+                if not candidatas:
+                    sin_saldo.append(idx)
+                    continue
+                elegida = min(candidatas, key=lambda v: self.disponible(v) - monto)
+                self.cuentas[elegida]['reservado'] += monto
+                self.asignacion[idx] = (elegida, monto)
+        return sorted(sin_saldo)
+
+    def cuenta_de(self, idx: int) -> Optional[str]:
+        with self._lock:
+            asignada = self.asignacion.get(idx)
+        return asignada[0] if asignada else None
+
+    def _soltar(self, idx: int) -> Optional[Tuple[str, float]]:
+        asignada = self.asignacion.pop(idx, None)
+        if asignada and asignada[0] in self.cuentas:
+            self.cuentas[asignada[0]]['reservado'] -= asignada[1]
+        return asignada
+
+    def confirmar(self, idx: int):
+        """La transferencia salió: el monto deja de estar reservado y se descuenta del saldo."""
+        with self._lock:
+            asignada = self._soltar(idx) or self._liberadas.pop(idx, None)
+            if asignada and asignada[0] in self.cuentas:
+                self.cuentas[asignada[0]]['saldo'] -= asignada[1]
+
+    def liberar(self, idx: int):
+        """El intento falló: su monto deja de bloquear la cuenta hasta que se la reasigne."""
+        with self._lock:
+            asignada = self._soltar(idx)
+            if asignada:
+                self._liberadas[idx] = asignada
+
+    def actualizar_saldos(self, cuentas: List[Dict[str, Any]]):
+        """Saldos releídos de Lohas (ya reflejan lo que salió); se mantienen las reservas vigentes."""
+        with self._lock:
+            self.cuentas = {c['value']: dict(c, reservado=0.0) for c in cuentas}
+            self._liberadas.clear()  # si alguna salió igual, el saldo releído ya la descuenta
+            for idx, (value, monto) in list(self.asignacion.items()):
+                if value in self.cuentas:
+                    self.cuentas[value]['reservado'] += monto
+                else:
+                    del self.asignacion[idx]  # la cuenta ya no está: se reasigna
+
+
+def completar_transferencia(driver: webdriver.Chrome, cbu_destino: str, monto: str,
+                            cuenta_origen: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Completa una transferencia en un navegador ya autenticado y posicionado en la
+    pantalla de transferencias. Devuelve (success: bool, cbu_origen: str).
+    Con cuenta_origen (value de la opción, asignada por BalanceLedger) no se recorren los saldos.
+    """
+    cbu_origen_selected = ""
+    success = False
+    wait = WebDriverWait(driver, 30)
+
+    # --- PARTE 1: Verificar saldo de cuentas origen y seleccionar una con saldo suficiente ---
+    try:
+        # Al entrar a la página de transferencias: esperar (hasta 2s) el select de cuentas
+        esperar_pagina_lista(driver, 2, "#id_sc_field_idcuenta")
+        # Buscar el select de cuentas origen
+        print("ERROR_DEBUG:Buscando select de cuentas origen...")
+        select_origen = locate_element_across_frames(driver, By.ID, "id_sc_field_idcuenta", timeout=15, campo="cuenta_origen")
+        
+        if not select_origen:
+            print("ERROR_DEBUG:No se encontró el select de cuentas origen")
+            return (False, cbu_origen_selected)
+        # Click en el select y esperar (hasta 1.5s) antes de operar
+        try:
+            safe_click_element(driver, select_origen)
+        except Exception:
             try:
-                # Click en el menú "Transferencias" dentro de ul#nav_list (último wrapper)
-                xpath_menu = (
-                    "//ul[@id='nav_list']//li[contains(@class,'wrapper')][last()]//a["
-                    "contains(@href,'form_transferencias') or @tab-title='Transferencias' or .//span[contains(normalize-space(),'Transferencias')]"
-                    "]"
-                )
-                menu_link = locate_element_across_frames(driver, By.XPATH, xpath_menu, timeout=12)
-                if not menu_link:
-                    # Fallback: buscar cualquier enlace de Transferencias visible
-                    menu_link = locate_element_across_frames(
-                        driver,
-                        By.XPATH,
-                        "//a[contains(@href,'form_transferencias') or .//span[contains(normalize-space(),'Transferencias')] or @tab-title='Transferencias']",
-                        timeout=8,
-                    )
-                if menu_link:
-                    safe_click_element(driver, menu_link)
-                # Esperar 2s y continuar
-                time.sleep(2)
+                driver.execute_script("arguments[0].click();", select_origen)
             except Exception:
                 pass
-
-            # --- PARTE 1: Verificar saldo de cuentas origen y seleccionar una con saldo suficiente ---
-            try:
-                # Al entrar a la página de transferencias: esperar 2 segundos
-                time.sleep(2)
-                # Buscar el select de cuentas origen
-                print("ERROR_DEBUG:Buscando select de cuentas origen...")
-                select_origen = locate_element_across_frames(driver, By.ID, "id_sc_field_idcuenta", timeout=15)
-                
-                if not select_origen:
-                    print("ERROR_DEBUG:No se encontró el select de cuentas origen")
-                    return (False, cbu_origen_selected)
-                # Click en el select y esperar 1.5s antes de operar
+        esperar_pagina_lista(driver, 1.5)
+        
+        # Obtener todas las opciones del select
+        try:
+            options = select_origen.find_elements(By.TAG_NAME, "option")
+            print(f"ERROR_DEBUG:Encontradas {len(options)} cuentas origen")
+        except Exception as e:
+            print(f"ERROR_DEBUG:Error obteniendo opciones del select: {e}")
+            return (False, cbu_origen_selected)
+        
+        if not options:
+            print("ERROR_DEBUG:No hay cuentas origen disponibles")
+            return (False, cbu_origen_selected)
+        
+        # Convertir monto a float para comparación
+        monto_float = parse_monto(monto)
+        
+        print(f"ERROR_DEBUG:Monto a transferir: {monto_float}")
+        
+        cuenta_seleccionada = None
+        if cuenta_origen is not None:
+            # cuenta ya asignada por el ledger de saldos: seleccionarla directo, sin recorrer saldos
+            for option in options:
                 try:
-                    safe_click_element(driver, select_origen)
+                    if (option.get_attribute("value") or "") == cuenta_origen:
+                        cuenta_seleccionada = {'option': option, 'text': option.text, 'value': cuenta_origen, 'saldo': None}
+                        break
                 except Exception:
-                    try:
-                        driver.execute_script("arguments[0].click();", select_origen)
-                    except Exception:
-                        pass
-                time.sleep(1.5)
-                
-                # Obtener todas las opciones del select
-                try:
-                    options = select_origen.find_elements(By.TAG_NAME, "option")
-                    print(f"ERROR_DEBUG:Encontradas {len(options)} cuentas origen")
-                except Exception as e:
-                    print(f"ERROR_DEBUG:Error obteniendo opciones del select: {e}")
-                    return (False, cbu_origen_selected)
-                
-                if not options:
-                    print("ERROR_DEBUG:No hay cuentas origen disponibles")
-                    return (False, cbu_origen_selected)
-                
-                # Convertir monto a float para comparación
-                # El CSV viene en formato inglés (punto decimal): 20000.00
+                    continue
+            if not cuenta_seleccionada:
+                print(f"ERROR_DEBUG:La cuenta origen asignada ({cuenta_origen}) no está entre las opciones")
+                return (False, cbu_origen_selected)
+        else:
+            # Iterar sobre cada cuenta origen para verificar saldo
+            for idx, option in enumerate(options):
                 try:
-                    monto_str = str(monto).strip()
-                    # Detectar si es formato argentino (con coma decimal) o inglés (con punto decimal)
-                    if ',' in monto_str and '.' in monto_str:
-                        # Formato argentino: 1.000,50 -> eliminar punto (miles) y reemplazar coma por punto
-                        monto_float = float(monto_str.replace('.', '').replace(',', '.'))
-                    elif ',' in monto_str:
-                        # Solo coma: formato argentino: 1000,50
-                        monto_float = float(monto_str.replace(',', '.'))
-                    else:
-                        # Solo punto o sin separadores: formato inglés: 1000.50 o 1000
-                        monto_float = float(monto_str)
-                except Exception as e:
-                    print(f"ERROR_DEBUG:Error convirtiendo monto '{monto}': {e}")
-                    monto_float = 0
+                    cuenta_text = option.text
+                    cuenta_value = option.get_attribute("value")
+                    print(f"ERROR_DEBUG:Verificando cuenta {idx+1}: {cuenta_text}")
                 
-                print(f"ERROR_DEBUG:Monto a transferir: {monto_float}")
+                    # Seleccionar esta opción
+                    try:
+                        driver.execute_script("arguments[0].selected = true; arguments[0].dispatchEvent(new Event('change', {bubbles: true}));", option)
+                        esperar_pagina_lista(driver, 1.5, "#id_sc_field_saldo")  # AJAX del saldo (tope 1.5s)
+                    except Exception as e:
+                        print(f"ERROR_DEBUG:Error seleccionando opción: {e}")
+                        continue
                 
-                # Iterar sobre cada cuenta origen para verificar saldo
-                cuenta_seleccionada = None
-                for idx, option in enumerate(options):
+                    # Buscar el campo de saldo
                     try:
-                        cuenta_text = option.text
-                        cuenta_value = option.get_attribute("value")
-                        print(f"ERROR_DEBUG:Verificando cuenta {idx+1}: {cuenta_text}")
-                        
-                        # Seleccionar esta opción
-                        try:
-                            driver.execute_script("arguments[0].selected = true; arguments[0].dispatchEvent(new Event('change', {bubbles: true}));", option)
-                            time.sleep(1.5)  # Esperar 1.5s tras elegir opción
-                        except Exception as e:
-                            print(f"ERROR_DEBUG:Error seleccionando opción: {e}")
+                        saldo_field = locate_element_across_frames(driver, By.ID, "id_sc_field_saldo", timeout=5, campo="saldo")
+                        if not saldo_field:
+                            print(f"ERROR_DEBUG:No se encontró campo de saldo para cuenta {idx+1}")
                             continue
-                        
-                        # Buscar el campo de saldo
+                    
+                        saldo_text = saldo_field.get_attribute("value") or ""
+                        print(f"ERROR_DEBUG:Saldo leído (raw): '{saldo_text}'")
+                    
+                        # Convertir saldo a float (formato: "24.500,00" -> 24500.00)
                         try:
-                            saldo_field = locate_element_across_frames(driver, By.ID, "id_sc_field_saldo", timeout=5)
-                            if not saldo_field:
-                                print(f"ERROR_DEBUG:No se encontró campo de saldo para cuenta {idx+1}")
-                                continue
-                            
-                            saldo_text = saldo_field.get_attribute("value") or ""
-                            print(f"ERROR_DEBUG:Saldo leído (raw): '{saldo_text}'")
-                            
-                            # Convertir saldo a float (formato: "24.500,00" -> 24500.00)
-                            try:
-                                saldo_float = float(saldo_text.replace('.', '').replace(',', '.'))
-                            except Exception as e:
-                                print(f"ERROR_DEBUG:Error convirtiendo saldo '{saldo_text}': {e}")
-                                continue
-                            
-                            print(f"ERROR_DEBUG:Saldo: {saldo_float}, Monto: {monto_float}")
-                            
-                            # Verificar si el saldo es suficiente
-                            if saldo_float >= monto_float:
-                                print(f"ERROR_DEBUG:✅ Cuenta con saldo suficiente encontrada: {cuenta_text}")
-                                cuenta_seleccionada = {
-                                    'option': option,
-                                    'text': cuenta_text,
-                                    'value': cuenta_value,
-                                    'saldo': saldo_float
-                                }
-                                break
-                            else:
-                                print(f"ERROR_DEBUG:❌ Saldo insuficiente ({saldo_float} < {monto_float})")
+                            saldo_float = parse_saldo(saldo_text)
                         except Exception as e:
-                            print(f"ERROR_DEBUG:Error verificando saldo: {e}")
+                            print(f"ERROR_DEBUG:Error convirtiendo saldo '{saldo_text}': {e}")
                             continue
-                    except Exception as e:
-                        print(f"ERROR_DEBUG:Error procesando cuenta {idx+1}: {e}")
-                        continue
-                
-                # Verificar si se encontró una cuenta con saldo suficiente
-                if not cuenta_seleccionada:
-                    print("ERROR_DEBUG:❌ Ninguna cuenta tiene saldo suficiente para esta transferencia")
-                    _orig_print("\n" + "="*80)
-                    _orig_print("❌ TRANSFERENCIA FALLIDA: Ninguna de las cuentas tiene saldo suficiente")
-                    _orig_print(f"   Monto requerido: ${monto_float:,.2f}")
-                    _orig_print("="*80 + "\n")
-                    return (False, cbu_origen_selected)
-                
-                # Seleccionar la cuenta encontrada (por si no quedó seleccionada)
-                try:
-                    driver.execute_script("arguments[0].selected = true; arguments[0].dispatchEvent(new Event('change', {bubbles: true}));", cuenta_seleccionada['option'])
-                    time.sleep(0.5)
-                    print(f"ERROR_DEBUG:Cuenta origen seleccionada: {cuenta_seleccionada['text']}")
                     
-                    # Extraer CBU origen del texto (formato: "BPMUP SRL871 (0000155300000000000871) PONDRA.CUARTO.BALDE")
-                    try:
-                        import re as re_module
-                        cbu_match = re_module.search(r'\((\d{22})\)', cuenta_seleccionada['text'])
-                        if cbu_match:
-                            cbu_origen_selected = cbu_match.group(1)
-                            print(f"ERROR_DEBUG:CBU origen extraído: {cbu_origen_selected}")
+                        print(f"ERROR_DEBUG:Saldo: {saldo_float}, Monto: {monto_float}")
+                    
+                        # Verificar si el saldo es suficiente
+                        if saldo_float >= monto_float:
+                            print(f"ERROR_DEBUG:✅ Cuenta con saldo suficiente encontrada: {cuenta_text}")
+                            cuenta_seleccionada = {
+                                'option': option,
+                                'text': cuenta_text,
+                                'value': cuenta_value,
+                                'saldo': saldo_float
+                            }
+                            break
+                        else:
+                            print(f"ERROR_DEBUG:❌ Saldo insuficiente ({saldo_float} < {monto_float})")
                     except Exception as e:
-                        print(f"ERROR_DEBUG:Error extrayendo CBU origen: {e}")
+                        print(f"ERROR_DEBUG:Error verificando saldo: {e}")
+                        continue
                 except Exception as e:
-                    print(f"ERROR_DEBUG:Error en selección final: {e}")
-                
-                # Ahora sí, pegar la cuenta destino
-                print("ERROR_DEBUG:Buscando campo cuenta destino...")
-                cuenta_el = locate_element_across_frames(driver, By.ID, CUENTA_FIELD_ID, timeout=15)
-                if cuenta_el:
-                    try:
-                        cuenta_el.clear()
-                    except Exception:
-                        try:
-                            driver.execute_script("arguments[0].value='';", cuenta_el)
-                        except Exception:
-                            pass
-                    # Esperar 1.5s antes de pegar el CBU destino
-                    time.sleep(1.5)
-                    try:
-                        cuenta_el.send_keys(cbu_destino)
-                        print(f"ERROR_DEBUG:CBU destino pegado: {cbu_destino}")
-                    except Exception:
-                        try:
-                            driver.execute_script("arguments[0].value = arguments[1]; arguments[0].dispatchEvent(new Event('change'));", cuenta_el, cbu_destino)
-                            print(f"ERROR_DEBUG:CBU destino pegado (JS): {cbu_destino}")
-                        except Exception:
-                            pass
-                    # Esperar 1.5s tras pegar el CBU destino
-                    time.sleep(1.5)
-                # primer Próximo
-                prox_el = locate_element_across_frames(driver, By.ID, PRIMERO_BTN_ID, timeout=12)
-                if prox_el:
-                    safe_click_element(driver, prox_el)
-                time.sleep(5)
-                time.sleep(2)
-                prox_el2 = locate_element_across_frames(driver, By.ID, PRIMERO_BTN_ID, timeout=10)
-                if prox_el2:
-                    safe_click_element(driver, prox_el2)
-                time.sleep(2)
-                amount_input = find_first_numeric_input(driver, timeout=12)
-                if amount_input:
-                    set_input_value(driver, amount_input, str(monto))
-                # select2
-                select_select2_option_choose_varios_or_last(driver, SELECT2_COMBO_CSS, timeout=12)
-                # último Próximo - después de esto aparecerá la pantalla del 2do token
-                prox_el3 = locate_element_across_frames(driver, By.ID, PRIMERO_BTN_ID, timeout=12)
-                if prox_el3:
-                    safe_click_element(driver, prox_el3)
-                
-                # Iniciar búsqueda del mail EN PARALELO antes de que aparezca la pantalla del 2do token
-                print("ERROR_DEBUG:Bot empezó a buscar el mail del código de transferencia (búsqueda en paralelo)")
-                transfer_code_result = [None, None]  # [code, exception]
-                
-                def search_mail_thread():
-                    try:
-                        if GMAIL_USER and GMAIL_PASS:
-                            code, uid = get_latest_transfer_code_gmail(user=GMAIL_USER, pwd=GMAIL_PASS, subject_search="Envío de código", timeout_sec=35, poll_every=0)
-                            transfer_code_result[0] = code
-                    except Exception as e:
-                        transfer_code_result[1] = e
-                
-                mail_thread = threading.Thread(target=search_mail_thread, daemon=True)
-                mail_thread.start()
-                
-                # Esperar 3s para que la pantalla del 2do token cargue
-                time.sleep(3)
-            except Exception:
-                # si algo falla aquí, consideramos transferencia fallida
-                return (False, cbu_origen_selected)
-        else:
-            # if confirm not clicked, no podemos avanzar -> fallo
+                    print(f"ERROR_DEBUG:Error procesando cuenta {idx+1}: {e}")
+                    continue
+        
+        # Verificar si se encontró una cuenta con saldo suficiente
+        if not cuenta_seleccionada:
+            print("ERROR_DEBUG:❌ Ninguna cuenta tiene saldo suficiente para esta transferencia")
+            _orig_print("\n" + "="*80)
+            _orig_print("❌ TRANSFERENCIA FALLIDA: Ninguna de las cuentas tiene saldo suficiente")
+            _orig_print(f"   Monto requerido: ${monto_float:,.2f}")
+            _orig_print("="*80 + "\n")
             return (False, cbu_origen_selected)
-
-        # --- AHORA: ya estamos en la pantalla del 2do token ---
-        print("ERROR_DEBUG:Bot llegó a la pantalla del segundo token")
         
-        # Esperar a que la búsqueda del mail termine (máximo 35s desde que empezó)
-        transfer_code = ""
+        # Seleccionar la cuenta encontrada (por si no quedó seleccionada)
         try:
-            if GMAIL_USER and GMAIL_PASS:
-                # Esperar a que el thread termine (ya lleva ~3s corriendo)
-                mail_thread.join(timeout=32)  # 32s adicionales (total ~35s)
-                
-                if transfer_code_result[0]:
-                    transfer_code = transfer_code_result[0]
-                    print(f"ERROR_DEBUG:Código obtenido: {transfer_code}")
-                elif transfer_code_result[1]:
-                    print(f"ERROR_DEBUG:Error buscando código: {transfer_code_result[1]}")
-                    return (False, cbu_origen_selected)
-                else:
-                    print("ERROR_DEBUG:Timeout esperando código de transferencia")
-                    return (False, cbu_origen_selected)
+            driver.execute_script("arguments[0].selected = true; arguments[0].dispatchEvent(new Event('change', {bubbles: true}));", cuenta_seleccionada['option'])
+            esperar_pagina_lista(driver, 0.5)
+            print(f"ERROR_DEBUG:Cuenta origen seleccionada: {cuenta_seleccionada['text']}")
+            
+            # Extraer CBU origen del texto (formato: "BPMUP SRL871 (0000155300000000000871) PONDRA.CUARTO.BALDE")
+            try:
+                import re as re_module
+                cbu_match = re_module.search(r'\((\d{22})\)', cuenta_seleccionada['text'])
+                if cbu_match:
+                    cbu_origen_selected = cbu_match.group(1)
+                    print(f"ERROR_DEBUG:CBU origen extraído: {cbu_origen_selected}")
+            except Exception as e:
+                print(f"ERROR_DEBUG:Error extrayendo CBU origen: {e}")
+        except Exception as e:
+            print(f"ERROR_DEBUG:Error en selección final: {e}")
+        
+        # Ahora sí, pegar la cuenta destino
+        print("ERROR_DEBUG:Buscando campo cuenta destino...")
+        cuenta_el = locate_element_across_frames(driver, By.ID, CUENTA_FIELD_ID, timeout=15, campo="cuenta_destino")
+        if cuenta_el:
+            try:
+                cuenta_el.clear()
+            except Exception:
+                try:
+                    driver.execute_script("arguments[0].value='';", cuenta_el)
+                except Exception:
+                    pass
+            # Esperar (hasta 1.5s) a que el campo esté habilitado antes de pegar el CBU destino
+            esperar_pagina_lista(driver, 1.5, f"#{CUENTA_FIELD_ID}")
+            try:
+                cuenta_el.send_keys(cbu_destino)
+                print(f"ERROR_DEBUG:CBU destino pegado: {cbu_destino}")
+            except Exception:
+                try:
+                    driver.execute_script("arguments[0].value = arguments[1]; arguments[0].dispatchEvent(new Event('change'));", cuenta_el, cbu_destino)
+                    print(f"ERROR_DEBUG:CBU destino pegado (JS): {cbu_destino}")
+                except Exception:
+                    pass
+            # Esperar (hasta 1.5s) la validación del CBU destino
+            esperar_pagina_lista(driver, 1.5)
+        # primer Próximo
+        prox_el = locate_element_across_frames(driver, By.ID, PRIMERO_BTN_ID, timeout=12)
+        if prox_el:
+            safe_click_element(driver, prox_el)
+        esperar_pagina_lista(driver, 7, f"#{PRIMERO_BTN_ID}", quieto=WAIT_QUIET_NAV_SEC)
+        prox_el2 = locate_element_across_frames(driver, By.ID, PRIMERO_BTN_ID, timeout=10)
+        if prox_el2:
+            safe_click_element(driver, prox_el2)
+        esperar_pagina_lista(driver, 2, quieto=WAIT_QUIET_NAV_SEC)
+        amount_input = find_first_numeric_input(driver, timeout=12)
+        if amount_input:
+            set_input_value(driver, amount_input, str(monto))
+        # select2
+        select_select2_option_choose_varios_or_last(driver, SELECT2_COMBO_CSS, timeout=12)
+        # último Próximo - después de esto aparecerá la pantalla del 2do token
+        prox_el3 = locate_element_across_frames(driver, By.ID, PRIMERO_BTN_ID, timeout=12)
+        # Registrar la espera del código antes del click que dispara el mail (un pedido a la vez)
+        TURNO_CODIGO.tomar()
+        code_waiter = registrar_espera_codigo("transfer") if GMAIL_USER and GMAIL_PASS else None
+        if prox_el3:
+            safe_click_element(driver, prox_el3)
+        
+        # Iniciar búsqueda del mail EN PARALELO antes de que aparezca la pantalla del 2do token
+        print("ERROR_DEBUG:Bot empezó a buscar el mail del código de transferencia (búsqueda en paralelo)")
+        transfer_code_result = [None, None]  # [code, exception]
+        
+        def search_mail_thread():
+            try:
+                if code_waiter is not None:
+                    code, uid = esperar_codigo(code_waiter, 35)
+                    transfer_code_result[0] = code
+                elif GMAIL_USER and GMAIL_PASS:
+                    code, uid = get_latest_transfer_code_gmail(user=GMAIL_USER, pwd=GMAIL_PASS, subject_search="Envío de código", timeout_sec=35, poll_every=0)
+                    transfer_code_result[0] = code
+            except Exception as e:
+                transfer_code_result[1] = e
+        
+        mail_thread = threading.Thread(target=search_mail_thread, daemon=True)
+        mail_thread.start()
+        
+        # Esperar (hasta 3s) a que la pantalla del 2do token cargue
+        esperar_pagina_lista(driver, 3, f"#{TOKEN_FIELD_ID}")
+    except Exception:
+        # si algo falla aquí, consideramos transferencia fallida
+        TURNO_CODIGO.soltar()
+        return (False, cbu_origen_selected)
+
+    # --- AHORA: ya estamos en la pantalla del 2do token ---
+    print("ERROR_DEBUG:Bot llegó a la pantalla del segundo token")
+    
+    # Esperar a que la búsqueda del mail termine (máximo 35s desde que empezó)
+    transfer_code = ""
+    try:
+        if GMAIL_USER and GMAIL_PASS:
+            # Esperar a que el thread termine (ya lleva ~3s corriendo)
+            mail_thread.join(timeout=32)  # 32s adicionales (total ~35s)
+            
+            if transfer_code_result[0]:
+                transfer_code = transfer_code_result[0]
+                print(f"ERROR_DEBUG:Código obtenido: {transfer_code}")
+            elif transfer_code_result[1]:
+                print(f"ERROR_DEBUG:Error buscando código: {transfer_code_result[1]}")
+                return (False, cbu_origen_selected)
             else:
+                print("ERROR_DEBUG:Timeout esperando código de transferencia")
                 return (False, cbu_origen_selected)
-        except Exception as e:
-            print(f"ERROR_DEBUG:Excepción obteniendo código: {e}")
+        else:
             return (False, cbu_origen_selected)
+    except Exception as e:
+        print(f"ERROR_DEBUG:Excepción obteniendo código: {e}")
+        return (False, cbu_origen_selected)
+    finally:
+        # la espera que siguió corriendo no puede quedarse con el código del próximo turno
+        cancelar_espera_codigo(code_waiter)
+        TURNO_CODIGO.soltar()
 
-        # Pegar código en input token_cliente
-        try:
-            token_el = locate_element_across_frames(driver, By.ID, TOKEN_FIELD_ID, timeout=75)
-            if token_el:
+    # Pegar código en input token_cliente
+    try:
+        token_el = locate_element_across_frames(driver, By.ID, TOKEN_FIELD_ID, timeout=75, campo="token")
+        if token_el:
+            try:
+                # Click en el input y pegar inmediatamente el código
                 try:
-                    # Click en el input y pegar inmediatamente el código
-                    try:
-                        token_el.click()
-                    except Exception:
-                        safe_click_element(driver, token_el)
-                    set_input_value(driver, token_el, transfer_code)
-                    # Esperar 1s y continuar con confirmar
-                    time.sleep(1)
+                    token_el.click()
                 except Exception:
-                    return (False, cbu_origen_selected)
-            else:
+                    safe_click_element(driver, token_el)
+                set_input_value(driver, token_el, transfer_code)
+                # Esperar (hasta 1s) y continuar con confirmar
+                esperar_pagina_lista(driver, 1)
+            except Exception:
                 return (False, cbu_origen_selected)
-        except Exception:
+        else:
             return (False, cbu_origen_selected)
+    except Exception:
+        return (False, cbu_origen_selected)
 
-        # Presionar Confirmar final
-        try:
-            conf_btn = locate_element_across_frames(driver, By.ID, TOKEN_CONFIRM_BTN_ID, timeout=15)
-            if conf_btn:
-                ok_conf = safe_click_element(driver, conf_btn)
-                if ok_conf:
-                    # continuar sin espera larga
-                    time.sleep(0)
-                    success = True
-                else:
-                    success = False
+    # Presionar Confirmar final
+    try:
+        conf_btn = locate_element_across_frames(driver, By.ID, TOKEN_CONFIRM_BTN_ID, timeout=15, campo="token_confirmar")
+        if conf_btn:
+            ok_conf = safe_click_element(driver, conf_btn)
+            if ok_conf:
+                # continuar sin espera larga
+                time.sleep(0)
+                success = True
             else:
                 success = False
-        except Exception:
+        else:
             success = False
+    except Exception:
+        success = False
 
-        # breve check post-transfer (no es determinante)
+    # breve check post-transfer (no es determinante)
+    try:
+        wait.until(lambda d: "app_control_2fa" not in d.current_url)
+    except Exception:
+        pass
+
+    return (success, cbu_origen_selected)
+
+
+def sesion_expirada(driver: webdriver.Chrome) -> bool:
+    """
+    Detecta si la sesión de Lohas expiró: el sitio nos devolvió al login o al 2FA.
+    """
+    try:
+        url = driver.current_url or ""
+    except Exception:
+        return True
+    if "app_Login" in url or "app_control_2fa" in url:
+        return True
+    try:
+        driver.switch_to.default_content()
+        if driver.find_elements(By.ID, FIELD_LOGIN_ID):
+            return True
+    except Exception:
+        return True
+    return False
+
+
+# ---------------------------
+# SESIÓN PERSISTENTE (cookies entre procesos)
+# ---------------------------
+def guardar_sesion_driver(driver: webdriver.Chrome) -> None:
+    """Guarda las cookies del navegador recién autenticado (y la página de inicio tras el 2FA)."""
+    if SESION_GUARDADA is None:
+        return
+    try:
+        WebDriverWait(driver, 5).until(lambda d: "app_control_2fa" not in d.current_url)
+    except Exception:
+        pass
+    try:
+        url = driver.current_url or ""
+        inicio = None if ("app_Login" in url or "app_control_2fa" in url) else url
+        SESION_GUARDADA.guardar(driver.get_cookies(), inicio)
+    except Exception as e:
+        print(f"ERROR_DEBUG:No se pudo guardar la sesión: {e}")
+
+
+def restaurar_sesion_driver(driver: webdriver.Chrome, destino: Optional[str] = None) -> bool:
+    """
+    Carga en el navegador la sesión guardada por un proceso anterior y abre `destino`
+    (o la página de inicio guardada). True si Lohas la aceptó: no hace falta login ni OTP.
+    """
+    datos = SESION_GUARDADA.reclamar() if SESION_GUARDADA is not None else None
+    if not datos:
+        return False
+    try:
+        # Network.setCookies no necesita estar parado en el dominio (ahorra cargar el login)
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies_cdp(datos["cookies"])})
+        driver.get(destino or datos.get("inicio") or TRANSFER_URL)
+        esperar_pagina_lista(driver, 3, quieto=WAIT_QUIET_NAV_SEC)
+    except Exception as e:
+        print(f"ERROR_DEBUG:No se pudo restaurar la sesión guardada: {e}")
+        return False
+    if sesion_expirada(driver):
+        print("ERROR_DEBUG:Sesión guardada vencida, login completo")
+        SESION_GUARDADA.borrar()
         try:
-            wait.until(lambda d: "app_control_2fa" not in d.current_url)
+            driver.delete_all_cookies()
         except Exception:
             pass
+        return False
+    print("ERROR_DEBUG:Sesión restaurada sin login ni OTP")
+    SESION_GUARDADA.tocar()
+    return True
+
+
+class LohasSession:
+    """
+    Navegador autenticado que se reutiliza entre transferencias de un mismo lote.
+    Hace login (con OTP) una sola vez y para cada transferencia vuelve a TRANSFER_URL;
+    solo se re-autentica si detecta que la sesión expiró o si el navegador murió.
+    """
+
+    def __init__(self):
+        self.driver: Optional[webdriver.Chrome] = None
+        self.logins = 0
+
+    def _login(self) -> bool:
+        self.cerrar()
+        # el navegador queda tomado hasta cerrar(): reponerlo dejaría un Chrome ocioso todo el lote
+        self.driver = obtener_driver(reponer=False)
+        if restaurar_sesion_driver(self.driver):
+            return True
+        self.logins += 1
+        if not login_lohas(self.driver):
+            self.cerrar()
+            return False
+        return True
+
+    def preparar_pantalla_transferencia(self) -> bool:
+        """
+        Deja el navegador en TRANSFER_URL con sesión válida (re-login si hace falta).
+        """
+        if self.driver is None and not self._login():
+            return False
+        try:
+            self.driver.switch_to.default_content()
+            self.driver.get(TRANSFER_URL)
+        except Exception:
+            # navegador caído -> uno nuevo con login
+            if not self._login():
+                return False
+            self.driver.get(TRANSFER_URL)
+        if sesion_expirada(self.driver):
+            print("ERROR_DEBUG:Sesión expirada, re-autenticando")
+            if not self._login():
+                return False
+            self.driver.get(TRANSFER_URL)
+            if sesion_expirada(self.driver):
+                return False
+        if SESION_GUARDADA is not None:
+            SESION_GUARDADA.tocar()
+        return True
+
+    def ejecutar(self, cbu_destino: str, monto: str, cuenta_origen: Optional[str] = None) -> Tuple[bool, str]:
+        if not self.preparar_pantalla_transferencia():
+            return (False, "")
+        try:
+            return completar_transferencia(self.driver, cbu_destino, monto, cuenta_origen)
+        except Exception:
+            # estado del navegador desconocido: descartarlo para la próxima transferencia
+            self.cerrar()
+            raise
+
+    def leer_saldos(self) -> Optional[List[Dict[str, Any]]]:
+        if not self.preparar_pantalla_transferencia():
+            return None
+        return leer_saldos_cuentas(self.driver)
+
+    def cerrar(self):
+        # vuelve al pool de navegadores limpio (o se cierra si el pool está lleno / deshabilitado)
+        liberar_driver(self.driver)
+        self.driver = None
+
 
-        return (success, cbu_origen_selected)
+def opcion_b_selenium(cbu_destino: str = "0000155300000000001362", monto: str = "10000", session: Optional["LohasSession"] = None,
+                      cuenta_origen: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Ejecuta una transferencia completa en una nueva instancia de navegador.
+    Devuelve (success: bool, cbu_origen: str).
+    - success: True si la transferencia se consideró exitosa, False en caso contrario.
+    - cbu_origen: CBU de la cuenta origen seleccionada (vacío si falla antes de seleccionar cuenta).
+    - session: si se pasa una LohasSession, se reutiliza su navegador ya logueado
+      (sin nuevo login ni OTP) en lugar de abrir una instancia nueva.
+    - cuenta_origen: cuenta ya asignada por BalanceLedger (si no, se buscan saldos en la pantalla).
+    IMPORTANTE: no pide inputs manuales. Si OTP o código de transferencia no llegan -> devuelve False.
+    """
+    if session is not None:
+        return session.ejecutar(cbu_destino, monto, cuenta_origen)
+
+    driver = obtener_driver()
+    try:
+        if not (restaurar_sesion_driver(driver) or login_lohas(driver)):
+            # if confirm not clicked, no podemos avanzar -> fallo
+            return (False, "")
+        abrir_transferencias_desde_menu(driver)
+        return completar_transferencia(driver, cbu_destino, monto, cuenta_origen)
     finally:
+        liberar_driver(driver)
+
+
+# ---------------------------
+# BACKEND HTTP (sin navegador) sobre los formularios Scriptcase de Lohas
+# ---------------------------
+# Los formularios de Lohas son páginas Scriptcase: cada botón termina en un POST del form F1
+# con nmgp_opcao (nm_atualiza / nm_move) y los eventos de campo son AJAX "rs=ajax_..."
+# con rsargs[]. Acá se reproduce eso con un cliente HTTP (pool compartido) y cookie jar propia,
+# leyendo nombres de campos, botones y funciones AJAX del mismo HTML en lugar de fijarlos.
+_HTTP_POOL: Optional[urllib3.PoolManager] = None
+_HTTP_POOL_LOCK = threading.Lock()
+
+HTTP_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+)
+
+_RE_ACCION_SC = re.compile(r"""\b(nm_atualiza|nm_move)\s*\(\s*['"]([^'"]*)['"]""")
+_RE_LLAMADA_JS = re.compile(r"\b([A-Za-z_]\w*)\s*\(")
+_RE_REDIR_JS = re.compile(
+    r"""(?:window\.|document\.|self\.|top\.)?location(?:\.href)?\s*(?:=\s*|\.replace\(\s*|\.assign\(\s*)['"]([^'"]+)['"]"""
+)
+_RE_SUBMIT_JS = re.compile(r"""document\.(?:forms\[['"](\w+)['"]\]|(\w+))\.submit\(\)""")
+_RE_ERROR_SC = re.compile(
+    r"""scAjaxShowErrorDisplay\(\s*['"][^'"]*['"]\s*,\s*['"]([^'"]+)['"]|class=["'][^"']*scFormErrorMessage[^"']*["'][^>]*>([^<]+)""",
+    re.I,
+)
+
+
+def pool_http() -> urllib3.PoolManager:
+    """PoolManager compartido por todas las sesiones HTTP (conexiones keep-alive a Lohas)."""
+    global _HTTP_POOL
+    with _HTTP_POOL_LOCK:
+        if _HTTP_POOL is None:
+            _HTTP_POOL = urllib3.PoolManager(
+                maxsize=max(2, TRANSFER_WORKERS),
+                retries=False,
+                timeout=urllib3.Timeout(connect=10.0, read=HTTP_TIMEOUT_SEC),
+                headers={"User-Agent": HTTP_USER_AGENT},
+            )
+        return _HTTP_POOL
+
+
+class _FormulariosParser(HTMLParser):
+    """Junta forms (campos, selects con opciones), atributos de elementos con id y scripts."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms: List[Dict[str, Any]] = []
+        self.por_id: Dict[str, Dict[str, str]] = {}
+        self.clickeables: List[Dict[str, str]] = []
+        self.scripts: List[str] = []
+        self.onload = ""
+        self._form: Optional[Dict[str, Any]] = None
+        self._select: Optional[str] = None
+        self._opcion: Optional[Dict[str, Any]] = None
+        self._textarea: Optional[str] = None
+        self._en_script = False
+
+    def _form_actual(self) -> Dict[str, Any]:
+        if self._form is None:
+            # campos sueltos (fuera de <form>): van a un form anónimo
+            self._form = {"name": "", "action": "", "method": "get", "campos": OrderedDict(),
+                          "selects": {}, "ids": {}}
+            self.forms.append(self._form)
+        return self._form
+
+    def handle_starttag(self, tag, attrs):
+        a = {k: (v if v is not None else "") for k, v in attrs}
+        if a.get("id"):
+            self.por_id[a["id"]] = dict(a, tag=tag)
+        if a.get("onclick"):
+            self.clickeables.append(dict(a, tag=tag))
+        if tag == "body":
+            self.onload = a.get("onload", "")
+        elif tag == "script":
+            self._en_script = True
+            self.scripts.append("")
+        elif tag == "form":
+            self._form = {"name": a.get("name") or a.get("id", ""), "action": a.get("action", ""),
+                          "method": (a.get("method") or "get").lower(), "campos": OrderedDict(),
+                          "selects": {}, "ids": {}}
+            self.forms.append(self._form)
+        elif tag == "input":
+            nombre = a.get("name")
+            if not nombre:
+                return
+            tipo = a.get("type", "text").lower()
+            if tipo in ("button", "submit", "image", "reset", "file"):
+                return
+            if tipo in ("checkbox", "radio") and "checked" not in a:
+                return
+            form = self._form_actual()
+            form["campos"][nombre] = a.get("value", "on" if tipo in ("checkbox", "radio") else "")
+            if a.get("id"):
+                form["ids"][a["id"]] = nombre
+        elif tag == "select" and a.get("name"):
+            form = self._form_actual()
+            self._select = a["name"]
+            form["selects"][self._select] = []
+            form["campos"].setdefault(self._select, "")
+            if a.get("id"):
+                form["ids"][a["id"]] = self._select
+        elif tag == "option" and self._select is not None:
+            self._opcion = {"value": a.get("value"), "text": "", "selected": "selected" in a}
+            self._form_actual()["selects"][self._select].append(self._opcion)
+        elif tag == "textarea" and a.get("name"):
+            form = self._form_actual()
+            self._textarea = a["name"]
+            form["campos"][self._textarea] = ""
+            if a.get("id"):
+                form["ids"][a["id"]] = self._textarea
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self._en_script = False
+        elif tag == "form":
+            self._form = None
+        elif tag == "option":
+            self._cerrar_opcion()
+        elif tag == "select" and self._select is not None:
+            self._cerrar_opcion()
+            opciones = self._form_actual()["selects"][self._select]
+            elegida = next((o for o in opciones if o["selected"]), opciones[0] if opciones else None)
+            self._form_actual()["campos"][self._select] = elegida["value"] if elegida else ""
+            self._select = None
+        elif tag == "textarea":
+            self._textarea = None
+
+    def _cerrar_opcion(self):
+        if self._opcion is not None:
+            self._opcion["text"] = self._opcion["text"].strip()
+            if self._opcion["value"] is None:
+                self._opcion["value"] = self._opcion["text"]
+            self._opcion = None
+
+    def handle_data(self, data):
+        if self._en_script:
+            self.scripts[-1] += data
+        elif self._opcion is not None:
+            self._opcion["text"] += data
+        elif self._textarea is not None and self._form is not None:
+            self._form["campos"][self._textarea] += data
+
+
+class PaginaScriptcase:
+    """Respuesta HTML de Lohas ya parseada: forms, botones (onclick) y scripts."""
+
+    def __init__(self, url: str, status: int, html: str, charset: str = "utf-8"):
+        self.url = url
+        self.status = status
+        self.html = html
+        self.charset = charset
+        p = _FormulariosParser()
         try:
-            driver.quit()
+            p.feed(html)
+            p.close()
+        except Exception as e:
+            print(f"ERROR_DEBUG:HTML no parseable en {url}: {e}")
+        self.forms = p.forms
+        self.por_id = p.por_id
+        self.clickeables = p.clickeables
+        self.script = "\n".join(p.scripts)
+        # lo que se ejecuta al cargar: código fuera de funciones + <body onload>
+        self.script_carga = _sin_funciones(self.script) + "\n" + p.onload
+
+    def form(self, contiene_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Form que contiene el campo `contiene_id` (o F1, o el que más campos tenga)."""
+        if contiene_id:
+            for f in self.forms:
+                if contiene_id in f["ids"]:
+                    return f
+        for f in self.forms:
+            if f["name"] == "F1":
+                return f
+        return max(self.forms, key=lambda f: len(f["campos"]), default=None)
+
+    def nombre_campo(self, elem_id: str) -> Optional[str]:
+        for f in self.forms:
+            if elem_id in f["ids"]:
+                return f["ids"][elem_id]
+        return None
+
+    def tiene(self, elem_id: str) -> bool:
+        return elem_id in self.por_id
+
+    def opciones(self, nombre: str) -> List[Dict[str, Any]]:
+        for f in self.forms:
+            if nombre in f["selects"]:
+                return f["selects"][nombre]
+        return []
+
+    def accion_boton(self, onclick: str) -> Dict[str, str]:
+        """
+        Campos que setea el botón antes del submit. Sigue un nivel de funciones envoltorio
+        (scBtnFn_...) hasta encontrar nm_atualiza('x') / nm_move('x') -> nmgp_opcao=x.
+        """
+        texto = onclick or ""
+        for fn in _RE_LLAMADA_JS.findall(onclick or ""):
+            m = re.search(r"function\s+" + re.escape(fn) + r"\s*\([^)]*\)\s*\{(.*?)\n\s*\}", self.script, re.S)
+            if m:
+                texto += "\n" + m.group(1)
+        m = _RE_ACCION_SC.search(texto)
+        return {"nmgp_opcao": m.group(2)} if m else {}
+
+    def boton(self, elem_id: Optional[str] = None, onclick_contiene: Optional[str] = None) -> Optional[Dict[str, str]]:
+        if elem_id:
+            return self.por_id.get(elem_id)
+        # botones sin id (el de Ingresar): el primero cuyo onclick contenga el texto
+        for attrs in self.clickeables:
+            if onclick_contiene and onclick_contiene in attrs["onclick"]:
+                return attrs
+        return None
+
+    def redireccion(self) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Redirección al cargar: redirInfo de una respuesta AJAX de Scriptcase, location = '...'
+        o document.FORM.submit() fuera de funciones (las de los botones no cuentan).
+        """
+        datos = _json_respuesta(self.html)
+        redir = datos.get("redirInfo") if isinstance(datos, dict) else None
+        if isinstance(redir, dict) and redir.get("action"):
+            campos = OrderedDict((k, str(v)) for k, v in redir.items()
+                                 if k in ("script_case_init", "nmgp_parms", "nmgp_url_saida"))
+            return (urljoin(self.url, redir["action"]),
+                    {"method": str(redir.get("metodo", "post")).lower(), "campos": campos})
+        m = _RE_SUBMIT_JS.search(self.script_carga)
+        if m:
+            nombre = m.group(1) or m.group(2)
+            for f in self.forms:
+                if f["name"] == nombre:
+                    return (urljoin(self.url, f["action"] or self.url), f)
+        m = _RE_REDIR_JS.search(self.script_carga)
+        if m:
+            return (urljoin(self.url, m.group(1)), None)
+        return None
+
+    def errores(self) -> List[str]:
+        return [(a or b).strip() for a, b in _RE_ERROR_SC.findall(self.html) if (a or b).strip()]
+
+    def expirada(self) -> bool:
+        """Lohas nos devolvió al login o al 2FA (misma regla que sesion_expirada)."""
+        return "app_Login" in self.url or "app_control_2fa" in self.url or self.tiene(FIELD_LOGIN_ID)
+
+
+class ClienteLohasHttp:
+    """Cliente HTTP con cookie jar propia sobre el pool compartido. Sigue redirecciones a mano
+    para no perder las cookies que Scriptcase setea en los 302."""
+
+    MAX_REDIRECCIONES = 8
+
+    def __init__(self):
+        self.cookies: Dict[str, str] = {}
+        self.ultima_url = ""
+
+    def _guardar_cookies(self, resp):
+        for linea in resp.headers.getlist("Set-Cookie"):
+            c = SimpleCookie()
+            try:
+                c.load(linea)
+            except Exception:
+                continue
+            for nombre, morsel in c.items():
+                if morsel["max-age"] == "0" or morsel.value in ("", "deleted"):
+                    self.cookies.pop(nombre, None)
+                else:
+                    self.cookies[nombre] = morsel.value
+
+    def request(self, method: str, url: str, campos: Optional[List[Tuple[str, str]]] = None,
+                charset: str = "utf-8", ajax: bool = False) -> PaginaScriptcase:
+        for _ in range(self.MAX_REDIRECCIONES):
+            headers = {"Accept": "text/html,application/xhtml+xml,*/*"}
+            if self.cookies:
+                headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+            if self.ultima_url:
+                headers["Referer"] = self.ultima_url
+            if ajax:
+                headers["X-Requested-With"] = "XMLHttpRequest"
+            body = None
+            if method == "GET" and campos:
+                url = url.split("?", 1)[0] + "?" + urlencode(campos, encoding=charset, errors="replace")
+                campos = None
+            if method == "POST":
+                body = urlencode(campos or [], encoding=charset, errors="replace")
+                headers["Content-Type"] = f"application/x-www-form-urlencoded; charset={charset}"
+            resp = pool_http().request(method, url, body=body, headers=headers, redirect=False)
+            self._guardar_cookies(resp)
+            destino = resp.headers.get("Location")
+            if resp.status in (301, 302, 303, 307, 308) and destino:
+                url = urljoin(url, destino)
+                if resp.status in (301, 302, 303):
+                    method, campos = "GET", None
+                continue
+            ctype = resp.headers.get("Content-Type", "")
+            m = re.search(r"charset=([\w-]+)", ctype, re.I) or re.search(rb"<meta[^>]+charset=['\"]?([\w-]+)", resp.data[:2048], re.I)
+            enc = m.group(1) if m else "utf-8"
+            enc = enc.decode() if isinstance(enc, bytes) else enc
+            try:
+                html = resp.data.decode(enc, errors="replace")
+            except LookupError:
+                enc, html = "utf-8", resp.data.decode("utf-8", errors="replace")
+            if not ajax:
+                self.ultima_url = url
+            return PaginaScriptcase(url, resp.status, html, enc)
+        raise RuntimeError(f"Demasiadas redirecciones desde {url}")
+
+    def get(self, url: str) -> PaginaScriptcase:
+        return self._seguir_js(self.request("GET", url))
+
+    def enviar(self, pagina: PaginaScriptcase, valores: Dict[str, str], boton_id: Optional[str] = None,
+               boton_onclick: Optional[str] = None, form_de: Optional[str] = None) -> PaginaScriptcase:
+        """POST del form de la página como si se hubiera clickeado el botón indicado."""
+        form = pagina.form(form_de)
+        if form is None:
+            raise RuntimeError(f"No hay formulario en {pagina.url}")
+        campos = OrderedDict(form["campos"])
+        btn = pagina.boton(boton_id, boton_onclick)
+        if btn is not None:
+            campos.update(pagina.accion_boton(btn.get("onclick", "")))
+        campos.update(valores)
+        action = urljoin(pagina.url, form["action"] or pagina.url)
+        metodo = "POST" if form["method"] == "post" else "GET"
+        return self._seguir_js(self.request(metodo, action, list(campos.items()), pagina.charset))
+
+    def _seguir_js(self, pagina: PaginaScriptcase) -> PaginaScriptcase:
+        for _ in range(self.MAX_REDIRECCIONES):
+            redir = pagina.redireccion()
+            if redir is None:
+                return pagina
+            url, form = redir
+            if form is not None and form.get("campos") is not None:
+                pagina = self.request("POST" if form["method"] == "post" else "GET", url,
+                                      list(form["campos"].items()), pagina.charset)
+            else:
+                pagina = self.request("GET", url)
+        return pagina
+
+    def evento_ajax(self, pagina: PaginaScriptcase, campo: str, evento: str,
+                    valores: Dict[str, str]) -> Dict[str, str]:
+        """
+        Dispara el evento AJAX de un campo (p. ej. idcuenta onchange) como lo hace el JS de
+        Scriptcase: rs=ajax_..._event_<campo>_<evento> con rsargs[] en el orden de la función
+        do_ajax_... de la página. Devuelve {campo: valor} de la fldList de la respuesta.
+        """
+        m = re.search(r"(ajax_\w+?_event_" + re.escape(campo) + "_" + re.escape(evento) + r")\b", pagina.script)
+        if not m:
+            return {}
+        funcion = m.group(1)
+        cuerpo = re.search(r"function\s+do_" + re.escape(funcion) + r"\s*\(\)\s*\{(.*?)\n\s*\}", pagina.script, re.S)
+        args = re.findall(r"var\s+var_(\w+)\s*=", cuerpo.group(1)) if cuerpo else [campo, "script_case_init"]
+        form = pagina.form() or {"campos": {}, "action": ""}
+        actuales = dict(form["campos"], **valores)
+        datos = [("rs", funcion), ("rst", ""), ("rsrnd", now_ms())]
+        datos += [("rsargs[]", actuales.get(a, "")) for a in args]
+        action = urljoin(pagina.url, form["action"] or pagina.url)
+        resp = self.request("POST", action, datos, pagina.charset, ajax=True)
+        return _campos_respuesta_ajax(resp.html)
+
+
+def _sin_funciones(js: str) -> str:
+    """Quita los cuerpos de `function ... { }` (llaves balanceadas; strings simples respetados)."""
+    salida, i = [], 0
+    for m in re.finditer(r"\bfunction\b[^{;]*\{", js):
+        if m.start() < i:
+            continue
+        salida.append(js[i:m.start()])
+        nivel, j, comilla = 1, m.end(), None
+        while j < len(js) and nivel:
+            c = js[j]
+            if comilla:
+                if c == "\\":
+                    j += 1
+                elif c == comilla:
+                    comilla = None
+            elif c in "'\"`":
+                comilla = c
+            elif c == "{":
+                nivel += 1
+            elif c == "}":
+                nivel -= 1
+            j += 1
+        i = j
+    salida.append(js[i:])
+    return "".join(salida)
+
+
+def _json_respuesta(texto: str) -> Any:
+    """JSON de una respuesta AJAX de Scriptcase ("+:var res = {...}; res;" o JSON pelado)."""
+    texto = texto.strip()
+    if not texto or texto[0] == "<":
+        return {}
+    ini, fin = texto.find("{"), texto.rfind("}")
+    if ini < 0 or fin <= ini:
+        return {}
+    try:
+        return json.loads(texto[ini:fin + 1])
+    except Exception:
+        return {}
+
+
+def _campos_respuesta_ajax(texto: str) -> Dict[str, str]:
+    """fldList de una respuesta AJAX de Scriptcase."""
+    datos = _json_respuesta(texto)
+    if not isinstance(datos, dict):
+        return {}
+    campos: Dict[str, str] = {}
+    for fld in datos.get("fldList", []) or []:
+        vals = fld.get("valList") or []
+        if fld.get("fldName") and vals:
+            v = vals[0]
+            campos[fld["fldName"]] = str(v.get("value", "") if isinstance(v, dict) else v)
+    return campos
+
+
+def _esperar_codigo_mail(kind: str, waiter: Optional[CodeWaiter], timeout: float,
+                         since_uid: Optional[int] = None) -> str:
+    """Código de login/transferencia por el despachador o, sin él, por búsqueda propia."""
+    if waiter is not None:
+        return esperar_codigo(waiter, timeout)[0]
+    if not (GMAIL_USER and GMAIL_PASS):
+        return ""
+    if kind == "login":
+        return get_latest_otp_gmail(user=GMAIL_USER, pwd=GMAIL_PASS, timeout_sec=int(timeout), poll_every=2.0, since_uid=since_uid)[0]
+    return get_latest_transfer_code_gmail(user=GMAIL_USER, pwd=GMAIL_PASS, subject_search="Envío de código",
+                                          timeout_sec=int(timeout), poll_every=0)[0]
+
+
+class LohasHttpSession:
+    """
+    Mismo contrato que LohasSession (ejecutar / leer_saldos / cerrar) pero sin navegador:
+    login + 2FA, formulario de transferencia por pasos y token, todo con POSTs al Scriptcase.
+    """
+
+    def __init__(self):
+        self.cliente: Optional[ClienteLohasHttp] = None
+        self.pagina: Optional[PaginaScriptcase] = None
+        self.logins = 0
+
+    def _restaurar(self) -> bool:
+        """Cookies de la sesión guardada por otro proceso; True si Lohas las sigue aceptando."""
+        datos = SESION_GUARDADA.reclamar() if SESION_GUARDADA is not None else None
+        if not datos:
+            return False
+        self.cliente.cookies = {c["name"]: c["value"] for c in datos["cookies"]}
+        try:
+            pagina = self.cliente.get(TRANSFER_URL)
+        except Exception as e:
+            print(f"ERROR_DEBUG:HTTP: no se pudo restaurar la sesión guardada: {e}")
+            self.cliente = ClienteLohasHttp()
+            return False
+        if pagina.expirada():
+            print("ERROR_DEBUG:Sesión guardada vencida, login completo")
+            SESION_GUARDADA.borrar()
+            self.cliente = ClienteLohasHttp()
+            return False
+        self.pagina = pagina
+        SESION_GUARDADA.tocar()
+        return True
+
+    def _login(self) -> bool:
+        self.cerrar()
+        self.cliente = ClienteLohasHttp()
+        if self._restaurar():
+            return True
+        self.logins += 1
+        try:
+            ok = self._autenticar()
+        except Exception as e:
+            print(f"ERROR_DEBUG:HTTP: error en login: {e}")
+            ok = False
+        if not ok:
+            self.cerrar()
+        return ok
+
+    def _autenticar(self) -> bool:
+        cli = self.cliente
+        pagina = cli.get(URL_B)
+        n_user, n_pass = pagina.nombre_campo(FIELD_LOGIN_ID), pagina.nombre_campo(FIELD_PASS_ID)
+        if not n_user or not n_pass:
+            print("ERROR_DEBUG:HTTP: no se encontraron los campos de login")
+            return False
+
+        otp_waiter = registrar_espera_codigo("login") if GMAIL_USER and GMAIL_PASS else None
+        try:
+            since_uid = None
+            if GMAIL_USER and GMAIL_PASS and otp_waiter is None:
+                try:
+                    with get_imap_pool(GMAIL_USER, GMAIL_PASS).conexion() as Mtmp:
+                        since_uid = imap_uidnext(Mtmp) - 1
+                except Exception:
+                    since_uid = None
+            pagina = cli.enviar(pagina, {n_user: USER_B, n_pass: PASS_B}, boton_onclick="nm_atualiza", form_de=FIELD_LOGIN_ID)
+            n_otp = pagina.nombre_campo(OTP_FIELD_ID) or (OTP_FIELD_NAME if pagina.form() and OTP_FIELD_NAME in pagina.form()["campos"] else None)
+            if not n_otp:
+                print(f"ERROR_DEBUG:HTTP: no apareció el 2FA tras el login ({pagina.url}) {pagina.errores()}")
+                return False
+            try:
+                otp_code = _esperar_codigo_mail("login", otp_waiter, 120, since_uid)
+            except Exception:
+                return False
+            if not otp_code:
+                return False
+            # Aceptar (sc_submit_ajax_bot) y, si la respuesta lo pide, Confirmar (sub_form_b)
+            pagina = cli.enviar(pagina, {n_otp: otp_code}, boton_id=ACCEPT_BTN_ID if pagina.tiene(ACCEPT_BTN_ID) else None,
+                                boton_onclick="nm_atualiza", form_de=OTP_FIELD_ID)
+            if pagina.tiene(CONFIRM_BTN_ID):
+                pagina = cli.enviar(pagina, {}, boton_id=CONFIRM_BTN_ID)
+        finally:
+            cancelar_espera_codigo(otp_waiter)
+
+        pagina = cli.get(TRANSFER_URL)
+        if pagina.expirada():
+            print(f"ERROR_DEBUG:HTTP: login no quedó autenticado {pagina.errores()}")
+            return False
+        self.pagina = pagina
+        if SESION_GUARDADA is not None:
+            SESION_GUARDADA.guardar(cookies_desde_dict(cli.cookies, LOHAS_BASE_URL))
+        return True
+
+    def preparar_pantalla_transferencia(self) -> bool:
+        """Deja cargada la pantalla de transferencias con sesión válida (re-login si hace falta)."""
+        try:
+            if self.cliente is None:
+                return self._login()
+            self.pagina = self.cliente.get(TRANSFER_URL)
+            if self.pagina.expirada():
+                print("ERROR_DEBUG:Sesión HTTP expirada, re-autenticando")
+                return self._login()
+            if SESION_GUARDADA is not None:
+                SESION_GUARDADA.tocar()
+            return True
+        except Exception as e:
+            print(f"ERROR_DEBUG:HTTP: error preparando transferencias: {e}")
+            return self._login()
+
+    def _saldo(self, pagina: PaginaScriptcase, n_cuenta: str, valor: str) -> Optional[float]:
+        campos = self.cliente.evento_ajax(pagina, n_cuenta, "onchange", {n_cuenta: valor})
+        saldo = campos.get(pagina.nombre_campo("id_sc_field_saldo") or "saldo")
+        return parse_saldo(saldo) if saldo else None
+
+    def leer_saldos(self) -> Optional[List[Dict[str, Any]]]:
+        if not self.preparar_pantalla_transferencia():
+            return None
+        pagina = self.pagina
+        n_cuenta = pagina.nombre_campo("id_sc_field_idcuenta")
+        if not n_cuenta:
+            return None
+        cuentas: List[Dict[str, Any]] = []
+        for op in pagina.opciones(n_cuenta):
+            if not op["value"]:
+                continue
+            try:
+                saldo = self._saldo(pagina, n_cuenta, op["value"])
+            except Exception as e:
+                print(f"ERROR_DEBUG:No se pudo leer el saldo de una cuenta origen: {e}")
+                continue
+            if saldo is None:
+                continue
+            cbu_match = re.search(r'\((\d{22})\)', op["text"])
+            cuentas.append({'value': op["value"], 'text': op["text"],
+                            'cbu': cbu_match.group(1) if cbu_match else "", 'saldo': saldo})
+            print(f"ERROR_DEBUG:Saldo cuenta {op['text']}: {saldo}")
+        return cuentas
+
+    def ejecutar(self, cbu_destino: str, monto: str, cuenta_origen: Optional[str] = None) -> Tuple[bool, str]:
+        if not self.preparar_pantalla_transferencia():
+            return (False, "")
+        try:
+            return self._completar(cbu_destino, monto, cuenta_origen)
+        except Exception as e:
+            print(f"ERROR_DEBUG:HTTP: transferencia interrumpida: {e}")
+            # estado del formulario desconocido: la próxima arranca con sesión nueva
+            self.cerrar()
+            return (False, "")
+
+    def _completar(self, cbu_destino: str, monto: str, cuenta_origen: Optional[str]) -> Tuple[bool, str]:
+        cli, pagina = self.cliente, self.pagina
+        n_cuenta = pagina.nombre_campo("id_sc_field_idcuenta")
+        if not n_cuenta:
+            print("ERROR_DEBUG:HTTP: no se encontró el select de cuentas origen")
+            return (False, "")
+        opciones = [o for o in pagina.opciones(n_cuenta) if o["value"]]
+        elegida = None
+        if cuenta_origen is not None:
+            elegida = next((o for o in opciones if o["value"] == cuenta_origen), None)
+        else:
+            monto_float = parse_monto(monto)
+            for op in opciones:
+                saldo = self._saldo(pagina, n_cuenta, op["value"])
+                print(f"ERROR_DEBUG:Saldo: {saldo}, Monto: {monto_float}")
+                if saldo is not None and saldo >= monto_float:
+                    elegida = op
+                    break
+        if elegida is None:
+            print("ERROR_DEBUG:❌ HTTP: sin cuenta origen utilizable para esta transferencia")
+            return (False, "")
+        cbu_match = re.search(r'\((\d{22})\)', elegida["text"])
+        cbu_origen = cbu_match.group(1) if cbu_match else ""
+
+        # paso 1: cuenta origen + CBU destino, dos veces Próximo (como en el navegador)
+        valores = {n_cuenta: elegida["value"]}
+        n_destino = pagina.nombre_campo(CUENTA_FIELD_ID)
+        if n_destino:
+            valores[n_destino] = cbu_destino
+        pagina = cli.enviar(pagina, valores, boton_id=PRIMERO_BTN_ID)
+        if pagina.tiene(PRIMERO_BTN_ID) and not _campo_importe(pagina):
+            pagina = cli.enviar(pagina, {}, boton_id=PRIMERO_BTN_ID)
+        n_importe = _campo_importe(pagina)
+        if not n_importe:
+            print(f"ERROR_DEBUG:HTTP: no apareció el campo de importe {pagina.errores()}")
+            return (False, cbu_origen)
+
+        # paso 2: importe + concepto ("Varios" o el último), último Próximo dispara el mail del token
+        valores = {n_importe: str(monto)}
+        concepto = _campo_concepto(pagina)
+        if concepto:
+            valores[concepto[0]] = concepto[1]
+        with TURNO_CODIGO.turno():
+            code_waiter = registrar_espera_codigo("transfer") if GMAIL_USER and GMAIL_PASS else None
+            try:
+                pagina = cli.enviar(pagina, valores, boton_id=PRIMERO_BTN_ID)
+                n_token = pagina.nombre_campo(TOKEN_FIELD_ID)
+                if not n_token:
+                    print(f"ERROR_DEBUG:HTTP: no apareció la pantalla del token {pagina.errores()}")
+                    return (False, cbu_origen)
+                try:
+                    codigo = _esperar_codigo_mail("transfer", code_waiter, 35)
+                except Exception as e:
+                    print(f"ERROR_DEBUG:Error buscando código: {e}")
+                    return (False, cbu_origen)
+            finally:
+                cancelar_espera_codigo(code_waiter)
+        if not codigo:
+            return (False, cbu_origen)
+
+        # paso 3: token + Confirmar
+        pagina = cli.enviar(pagina, {n_token: codigo}, boton_id=TOKEN_CONFIRM_BTN_ID)
+        errores = pagina.errores()
+        if errores or pagina.expirada() or pagina.status >= 400:
+            print(f"ERROR_DEBUG:HTTP: confirmación rechazada ({pagina.status}) {errores}")
+            return (False, cbu_origen)
+        return (True, cbu_origen)
+
+    def cerrar(self):
+        # sin navegador: alcanza con olvidar cookies (las conexiones quedan en el pool)
+        self.cliente = None
+        self.pagina = None
+
+
+def _campo_importe(pagina: PaginaScriptcase) -> Optional[str]:
+    """Mismo orden de preferencia que find_first_numeric_input."""
+    for elem_id in ("id_sc_field_importe", "id_sc_field_monto", "id_sc_field_valor"):
+        nombre = pagina.nombre_campo(elem_id)
+        if nombre:
+            return nombre
+    form = pagina.form() or {"campos": {}}
+    for nombre in form["campos"]:
+        if any(k in nombre.lower() for k in ("monto", "importe", "valor", "amount", "cantidad")):
+            return nombre
+    return None
+
+
+def _campo_concepto(pagina: PaginaScriptcase) -> Optional[Tuple[str, str]]:
+    """Select del concepto BCRA (el select2 del navegador): 'Varios' o la última opción."""
+    form = pagina.form() or {"selects": {}}
+    nombre = pagina.nombre_campo("id_sc_field_idconcepto_bcra")
+    if not nombre:
+        nombre = next((n for n in form["selects"] if "concepto" in n.lower()), None)
+    opciones = [o for o in pagina.opciones(nombre) if o["value"]] if nombre else []
+    if not opciones:
+        return None
+    elegida = next((o for o in opciones if "varios" in o["text"].lower()), opciones[-1])
+    return (nombre, elegida["value"])
+
+
+def opcion_b_http(cbu_destino: str, monto: str, session: Optional[LohasHttpSession] = None,
+                  cuenta_origen: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Transferencia completa por HTTP, mismo contrato que opcion_b_selenium:
+    devuelve (success, cbu_origen). Sin sesión compartida hace su propio login.
+    """
+    if session is not None:
+        return session.ejecutar(cbu_destino, monto, cuenta_origen)
+    session = LohasHttpSession()
+    try:
+        return session.ejecutar(cbu_destino, monto, cuenta_origen)
+    finally:
+        session.cerrar()
+
+
+# ---------------------------
+# EJECUCIÓN: intento individual + pool de workers en paralelo
+# ---------------------------
+def _intentar_transferencia(idx: int, transfer_status: Dict[int, Dict[str, Any]], log_file: str,
+                            session: Optional[LohasSession], reintento: bool,
+                            ledger: Optional[BalanceLedger] = None) -> bool:
+    """
+    Ejecuta un intento de la transferencia #idx y actualiza transfer_status.
+    Emite TRANSFE_START / TRANSFE_DONE / TRANSFE_FAILED y aplica la pausa entre
+    ventanas (2s en la pasada inicial, 3s entre reintentos).
+    """
+    t_data = transfer_status[idx]
+    cbu_destino = t_data['cbu_destino']
+    monto = t_data['monto']
+
+    cuenta_origen = ledger.cuenta_de(idx) if ledger is not None else None
+
+    print(f"TRANSFE_START:{idx}")
+    # (inicio, fin) de cada intento: la conciliación busca el movimiento dentro de ese lapso
+    intentos = transfer_status[idx].setdefault('intentos', [])
+    inicio = datetime.now()
+    try:
+        ejecutar = opcion_b_http if TRANSFER_BACKEND == "http" else opcion_b_selenium
+        ok, cbu_origen = ejecutar(cbu_destino=cbu_destino, monto=monto, session=session, cuenta_origen=cuenta_origen)
+    except KeyboardInterrupt:
+        print(f"TRANSFE_FAILED:{idx}")
+        transfer_status[idx]['status'] = 'failed'
+        intentos.append((inicio, datetime.now()))
+        raise
+    except Exception as e:
+        donde = "bucle de reintentos" if reintento else "bucle principal"
+        print(f"ERROR_DEBUG:Excepción en {donde}: {str(e)}")
+        ok, cbu_origen = False, ""
+
+    intentos.append((inicio, datetime.now()))
+    inicio_txt = inicio.strftime('%d/%m/%Y %H:%M:%S')
+    if ok:
+        print(f"TRANSFE_DONE:{idx}")
+        transfer_status[idx]['status'] = 'done'
+        transfer_status[idx]['cbu_origen_real'] = cbu_origen  # Guardar CBU origen real
+        if ledger is not None:
+            ledger.confirmar(idx)
+        # Registrar en log
+        log_transfer(log_file, idx, cbu_origen, cbu_destino, monto, "COMPLETADA",
+                     transfer_id=t_data['transfer'].get('ID', ''), inicio=inicio_txt)
+    else:
+        print(f"TRANSFE_FAILED:{idx}")
+        transfer_status[idx]['status'] = 'failed'
+        if ledger is not None:
+            ledger.liberar(idx)
+        # solo en el .jsonl: la conciliación detecta fallidas que igual se ejecutaron
+        log_intento(log_file, idx, cbu_origen, cbu_destino, monto, "FALLIDA",
+                    transfer_id=t_data['transfer'].get('ID', ''), inicio=inicio_txt)
+
+    if reintento:
+        # esperar 3 segundos entre reintentos individuales
+        time.sleep(3)
+    elif session is None:
+        # esperar 2 segundos entre ventanas (pasada inicial)
+        time.sleep(2)
+    return ok
+
+
+# ---------------------------
+# VERIFICACIÓN ANTES DE REINTENTAR: ¿la fallida ya figura en los movimientos de Lohas?
+# ---------------------------
+class SincronizadorMovimientos:
+    """
+    Un solo bot_csv.py en modo CSV_WORKER para toda la corrida: su navegador queda en la grilla
+    de movimientos y cada verificación le pide solo lo nuevo de cada cuenta. Entra con la sesión
+    que guardó este proceso (SESSION_STORE), así que no hay otro login ni OTP por pasada.
+    Se arranca recién al primer pedido y se relanza si murió.
+    """
+
+    def __init__(self, timeout: float = RETRY_CHECK_TIMEOUT_SEC):
+        self.timeout = timeout
+        self.cuentas: List[str] = []   # texto de cada cuenta del dropdown (lo que pide el worker)
+        self._proc: Optional[subprocess.Popen] = None
+        self._lineas: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._pedido = 0
+
+    @staticmethod
+    def _leer(proc: subprocess.Popen, lineas: "queue.Queue[Optional[str]]"):
+        for linea in proc.stdout:
+            lineas.put(linea.rstrip("\n"))
+        lineas.put(None)  # EOF: el worker terminó
+
+    def _esperar(self, prefijo: str) -> Optional[str]:
+        """Próxima línea del worker con `prefijo` (sin él); None si se cerró o venció el timeout."""
+        limite = time.time() + self.timeout
+        while True:
+            try:
+                linea = self._lineas.get(timeout=max(0.0, limite - time.time()))
+            except queue.Empty:
+                return None
+            if linea is None:
+                return None
+            if linea.startswith(prefijo):
+                return linea[len(prefijo):]
+
+    def _arrancar(self) -> bool:
+        if self._proc is not None and self._proc.poll() is None:
+            return True
+        self._matar()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_csv.py")
+        # valores explícitos: load_dotenv de bot_csv no pisa el entorno, pero sí completaría lo que falte
+        env = {**os.environ, "CSV_WORKER": "1", "SYNC": "0", "EXPORT_BATCH": "", "SCAN_ONLY": "0",
+               "PYTHONUNBUFFERED": "1"}
+        try:
+            self._proc = subprocess.Popen([sys.executable, "-u", script], env=env, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                          encoding="utf-8", errors="replace", bufsize=1)
+        except OSError as e:
+            print(f"ERROR_DEBUG:No se pudo iniciar el worker de movimientos: {e}")
+            self._proc = None
+            return False
+        self._lineas = queue.Queue()
+        threading.Thread(target=self._leer, args=(self._proc, self._lineas), daemon=True,
+                         name="movimientos-worker").start()
+        datos = self._esperar("ACCOUNTS_JSON:")
+        if datos is None:
+            print("ERROR_DEBUG:El worker de movimientos no llegó a la grilla (login o cuentas)")
+            self._matar()
+            return False
+        self.cuentas = [c["text"] for c in json.loads(datos).get("accounts", []) if c.get("text")]
+        print(f"DEBUG: Worker de movimientos listo ({len(self.cuentas)} cuentas)")
+        return True
+
+    def exportar(self, cuenta: str, desde: str, hasta: str) -> Optional[str]:
+        """CSV de `cuenta` entre `desde` y `hasta` (como los da rango_pendiente); None si el worker no pudo."""
+        if not self._arrancar():
+            return None
+        self._pedido += 1
+        pedido = {"id": self._pedido, "account": cuenta, "date_from": desde, "date_to": hasta}
+        try:
+            self._proc.stdin.write(json.dumps(pedido, ensure_ascii=True) + "\n")
+            self._proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            print(f"ERROR_DEBUG:No se pudo pedir el export de '{cuenta}' al worker: {e}")
+            self._matar()
+            return None
+        while True:
+            datos = self._esperar("EXPORT_JSON:")
+            if datos is None:
+                # colgado o muerto: la próxima verificación arranca uno nuevo
+                print(f"ERROR_DEBUG:El worker de movimientos no respondió el export de '{cuenta}'")
+                self._matar()
+                return None
+            respuesta = json.loads(datos)
+            if respuesta.get("id") == pedido["id"]:
+                return respuesta.get("file") if respuesta.get("ok") else None
+
+    def sincronizar(self, store: MovimientosStore, cuentas: List[str]) -> bool:
+        """Trae a `store` lo posterior a la marca de cada cuenta. Devuelve si se actualizaron todas."""
+        if not self._arrancar():
+            return False
+        if cuentas == ["*"]:
+            cuentas = self.cuentas
+        completas = bool(cuentas)
+        for cuenta in cuentas:
+            inicio = datetime.now()
+            desde, hasta = store.rango_pendiente(cuenta, inicio)
+            archivo = self.exportar(cuenta, desde, hasta)
+            if not archivo:
+                print(f"ERROR_DEBUG:No se pudieron sincronizar los movimientos de '{cuenta}'")
+                completas = False  # la marca no avanza: la próxima vez se repite el rango
+                continue
+            nuevos, actualizados = store.importar_csv(archivo, cuenta)
+            store.avanzar_marca(cuenta, inicio)
+            print(f"DEBUG: Movimientos de '{cuenta}' ({desde} → {hasta}): {nuevos} nuevos, "
+                  f"{actualizados} ya conocidos")
+        return completas
+
+    def _matar(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.kill()
+            self._proc.wait(timeout=10)
+        except Exception:
+            pass
+        self._proc = None
+
+    def cerrar(self):
+        if self._proc is None:
+            return
+        try:
+            if self._proc.poll() is None:
+                self._proc.stdin.write(json.dumps({"cmd": "quit"}) + "\n")
+                self._proc.stdin.close()
+                self._proc.wait(timeout=30)
         except Exception:
             pass
+        self._matar()
+
+
+def _movimientos_al_dia(store: MovimientosStore, cuentas: List[str], hasta: datetime) -> bool:
+    """El store ya tiene todo lo de `cuentas` hasta `hasta` (lo sincronizó otro proceso o una pasada anterior)."""
+    marcas = store.marcas()
+    if cuentas == ["*"]:
+        cuentas = list(marcas)
+    return bool(cuentas) and all(c in marcas and marcas[c] >= hasta for c in cuentas)
+
+
+def verificar_ejecutadas(fallidas: List[int], transfer_status: Dict[int, Dict[str, Any]], log_file: str,
+                         ledger: Optional[BalanceLedger] = None,
+                         sincronizador: Optional[SincronizadorMovimientos] = None,
+                         store: Optional[MovimientosStore] = None) -> List[int]:
+    """
+    Antes de una pasada de reintento: concilia los intentos de la corrida contra los
+    movimientos de Lohas (actualizados con `sincronizador` si hace falta). Las fallidas
+    cuyo movimiento cae entre el inicio y el fin de alguno de sus intentos (y es el único
+    posible) se dan por completadas en lugar de reenviarse; si el movimiento es ambiguo
+    quedan en 'revisar': ni se reenvían ni se dan por hechas. Devuelve las que quedan para reintentar.
+    """
+    intentadas = {i: t for i, t in transfer_status.items()
+                  if t.get('intentos') and t['status'] in ('done', 'failed', 'revisar')}
+    revisar = [i for i in fallidas if i in intentadas]
+    if not revisar:
+        return fallidas
+
+    # el movimiento de un intento puede figurar hasta `desfase` después de que terminó
+    necesario = max(fin for i in revisar for _, fin in intentadas[i]['intentos']) \
+        + timedelta(seconds=CONCILIACION_DESFASE_SEC)
+    espera = (necesario - datetime.now()).total_seconds()
+    if espera > 0:
+        time.sleep(espera)
+
+    cuentas = [c.strip() for c in RETRY_CHECK_ACCOUNTS.split(",") if c.strip()] or ["*"]
+    desde = (min(ini for t in intentadas.values() for ini, _ in t['intentos'])
+             - timedelta(seconds=CONCILIACION_DESFASE_SEC)).date().isoformat()
+    propio = store is None
+    store = store or MovimientosStore()
+    try:
+        if not _movimientos_al_dia(store, cuentas, necesario) and sincronizador is not None:
+            sincronizador.sincronizar(store, cuentas)
+        if cuentas == ["*"] and sincronizador is not None and sincronizador.cuentas:
+            cuentas = sincronizador.cuentas
+        if not _movimientos_al_dia(store, cuentas, necesario):
+            # lo que se encuentre igual vale, pero la ausencia de un movimiento no prueba nada
+            print(f"ERROR_DEBUG:Movimientos de Lohas sin actualizar hasta {necesario:%d/%m/%Y %H:%M:%S}: "
+                  f"las fallidas que no figuren se reintentan sin verificar")
+        if cuentas == ["*"]:
+            filas = store.movimientos(desde=desde)
+        else:
+            filas = [f for c in cuentas for f in store.movimientos(c, desde=desde)]
+    finally:
+        if propio:
+            store.cerrar()
+
+    # todas las del lote: otra pedida con la misma clave hace ambiguo al movimiento
+    transferencias = [{"n": i, "id": t['transfer'].get('ID', ''), "cbu_destino": t['cbu_destino'],
+                       "monto": t['monto'], "nombre": t['transfer'].get('NOMBRE', '')}
+                      for i, t in sorted(transfer_status.items())]
+    # un registro por intento: los fallidos primero y el que terminó bien (si hubo) al final
+    intentos = [{"n": i,
+                 "estado": "COMPLETADA" if t['status'] == 'done' and k == len(t['intentos']) - 1 else "FALLIDA",
+                 "inicio": ini.strftime('%d/%m/%Y %H:%M:%S'), "fecha": fin.strftime('%d/%m/%Y %H:%M:%S')}
+                for i, t in sorted(intentadas.items()) for k, (ini, fin) in enumerate(t['intentos'])]
+    reporte = conciliar(transferencias, columnas_desde_store(filas), intentos)
+    ejecutadas = {f["n"]: f for f in reporte["detalle"]["ejecutadas_sin_registro"] if f["n"] in revisar}
+    ambiguas = {f["n"]: f for f in reporte["detalle"]["ambiguas"] if f["n"] in revisar}
+
+    for idx, fila in sorted(ambiguas.items()):
+        t_data = transfer_status[idx]
+        print(f"ERROR_DEBUG:Transferencia #{idx}: movimiento ambiguo en Lohas (candidatos "
+              f"{', '.join(str(c) for c in fila['candidatos'])}): no se reintenta, revisar a mano")
+        t_data['status'] = 'revisar'
+        log_intento(log_file, idx, t_data.get('cbu_origen_real') or t_data.get('cbu_origen', ''),
+                    t_data['cbu_destino'], t_data['monto'], "REVISAR", transfer_id=t_data['transfer'].get('ID', ''))
+
+    for idx, fila in sorted(ejecutadas.items()):
+        t_data = transfer_status[idx]
+        print(f"TRANSFE_DONE:{idx}")
+        print(f"DEBUG: Transferencia #{idx} ya figura en Lohas (movimiento {fila['movimiento_id']}, "
+              f"{fila['fecha_mov']}): no se reintenta")
+        t_data['status'] = 'done'
+        if ledger is not None:
+            ledger.confirmar(idx)
+        cbu_origen = t_data.get('cbu_origen_real') or t_data.get('cbu_origen', '')
+        log_transfer(log_file, idx, cbu_origen, t_data['cbu_destino'], t_data['monto'], "COMPLETADA",
+                     transfer_id=t_data['transfer'].get('ID', ''), fecha=fila['fecha_mov'])
+    return [i for i in fallidas if i not in ejecutadas and i not in ambiguas]
+
+
+def reasignar_saldos(pool: "TransferWorkerPool", ledger: BalanceLedger, pendientes: List[int],
+                     transfer_status: Dict[int, Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+    """
+    Antes de una pasada de reintento: relee los saldos (si no se puede, sigue con los locales)
+    y vuelve a asignar cuenta a `pendientes`. Devuelve (a reintentar, sin saldo).
+    """
+    cuentas = pool.leer_saldos()
+    if cuentas:
+        ledger.actualizar_saldos(cuentas)
+    else:
+        print("ERROR_DEBUG:No se pudieron releer los saldos, se reasigna con los saldos locales")
+    sin_saldo = ledger.asignar({i: parse_monto(transfer_status[i]['monto']) for i in pendientes})
+    for i in pendientes:
+        transfer_status[i]['status'] = 'sin_saldo' if i in sin_saldo else 'failed'
+    if sin_saldo:
+        print(f"ERROR_DEBUG:Sin saldo para reintentar: {', '.join(f'#{i}' for i in sin_saldo)}")
+    return [i for i in pendientes if i not in sin_saldo], sin_saldo
+
+
+def nueva_sesion():
+    """Sesión reutilizable del backend configurado (navegador o HTTP)."""
+    return LohasHttpSession() if TRANSFER_BACKEND == "http" else LohasSession()
+
+
+class TransferWorkerPool:
+    """
+    Reparte las transferencias de una pasada entre N workers, cada uno con su
+    propio navegador (y su propia LohasSession si reuse_session). Con workers=1
+    ejecuta en el hilo principal, igual que el flujo secuencial original.
+    """
+
+    def __init__(self, workers: int = 1, reuse_session: bool = True):
+        self.workers = max(1, int(workers or 1))
+        self.reuse_session = reuse_session
+        self._local = threading.local()
+        self._sessions: List[LohasSession] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transfer")
+
+    def _session(self) -> Optional[LohasSession]:
+        if not self.reuse_session:
+            return None
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = nueva_sesion()
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def leer_saldos(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Lee los saldos de todas las cuentas origen con una sola sesión (la del hilo
+        principal si se reutilizan sesiones; si no, una temporal que se cierra al terminar).
+        """
+        session = self._session()
+        temporal = session is None
+        if temporal:
+            session = nueva_sesion()
+        try:
+            return session.leer_saldos()
+        except Exception as e:
+            print(f"ERROR_DEBUG:No se pudieron leer los saldos: {e}")
+            return None
+        finally:
+            # con workers en paralelo la sesión del hilo principal solo sirve para esto
+            if temporal or self._executor is not None:
+                session.cerrar()
+            if not temporal and self._executor is not None:
+                self._local.session = None
+                with self._lock:
+                    self._sessions.remove(session)
+
+    def ejecutar_pasada(self, indices: List[int], intento: Callable[[int, Optional[LohasSession], bool], bool],
+                        reintento: bool) -> Tuple[List[int], List[int]]:
+        """
+        Ejecuta una pasada completa. Devuelve (completadas, fallidas) en orden de índice.
+        """
+        resultados: Dict[int, bool] = {}
+        if self._executor is None:
+            for idx in indices:
+                resultados[idx] = intento(idx, self._session(), reintento)
+        else:
+            futures = {
+                self._executor.submit(lambda i=idx: intento(i, self._session(), reintento)): idx
+                for idx in indices
+            }
+            for fut in as_completed(futures):
+                idx = futures[fut]
+                try:
+                    resultados[idx] = bool(fut.result())
+                except Exception as e:
+                    print(f"ERROR_DEBUG:Worker falló en transferencia {idx}: {e}")
+                    resultados[idx] = False
+        completadas = [i for i in indices if resultados.get(i)]
+        fallidas = [i for i in indices if not resultados.get(i)]
+        return completadas, fallidas
+
+    def cerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions = []
+        for session in sessions:
+            session.cerrar()
 
 
 # ---------------------------
-# MAIN: ejecutar transferencias una por una, cada una en su propia ventana.
+# MAIN: ejecutar transferencias una por una (sesión compartida o ventana propia).
 # Si fallan, reintentar pasadas hasta que se completen (espera 3s entre reintentos).
 # ---------------------------
 def main():
+    # Los navegadores se van lanzando en segundo plano mientras se elige el CSV
+    if TRANSFER_BACKEND != "http":
+        get_browser_pool()
+
     # Primero: abrir diálogo para seleccionar CSV
     _orig_print("Abriendo diálogo para seleccionar CSV...")
     csv_path = select_csv_file()
@@ -1804,100 +4731,91 @@ def main():
             'monto': transfer.get('MONTO', '')
         }
     
-    failed: List[int] = []
-    pass_number = 1
+    # Pool de ejecución: TRANSFER_WORKERS navegadores en paralelo (1 = secuencial).
+    # Con REUSE_SESSION cada worker mantiene su propia sesión logueada.
+    pool = TransferWorkerPool(workers=TRANSFER_WORKERS, reuse_session=REUSE_SESSION)
 
-    # Primera pasada
-    for idx in range(1, len(transfers) + 1):
-        t_data = transfer_status[idx]
-        cbu_destino = t_data['cbu_destino']
-        monto = t_data['monto']
-        
-        print(f"TRANSFE_START:{idx}")
-        try:
-            ok, cbu_origen = opcion_b_selenium(cbu_destino=cbu_destino, monto=monto)
-            if ok:
-                print(f"TRANSFE_DONE:{idx}")
-                transfer_status[idx]['status'] = 'done'
-                transfer_status[idx]['cbu_origen_real'] = cbu_origen  # Guardar CBU origen real
-                # Registrar en log
-                log_transfer(log_file, idx, cbu_origen, cbu_destino, monto, "COMPLETADA")
+    ledger: Optional[BalanceLedger] = None
+    # worker de movimientos para la verificación antes de reintentar (arranca recién si hace falta)
+    sincronizador = SincronizadorMovimientos() if RETRY_CHECK else None
+
+    def intento(idx: int, session: Optional[LohasSession], reintento: bool) -> bool:
+        return _intentar_transferencia(idx, transfer_status, log_file, session, reintento, ledger)
+
+    try:
+        pass_number = 1
+        pendientes = list(range(1, len(transfers) + 1))
+        sin_saldo: List[int] = []
+
+        # Saldos leídos una sola vez y cada fila asignada a su cuenta origen antes de operar
+        if BALANCE_LEDGER:
+            cuentas = pool.leer_saldos()
+            if cuentas:
+                ledger = BalanceLedger(cuentas)
+                sin_saldo = ledger.asignar({i: parse_monto(transfer_status[i]['monto']) for i in pendientes})
+                for i in sin_saldo:
+                    print(f"TRANSFE_FAILED:{i}")
+                    transfer_status[i]['status'] = 'sin_saldo'
+                if sin_saldo:
+                    _orig_print("\n" + "="*80)
+                    _orig_print("❌ Ninguna cuenta tiene saldo suficiente para: " + ", ".join(
+                        f"#{i} (${parse_monto(transfer_status[i]['monto']):,.2f})" for i in sin_saldo))
+                    _orig_print("   Estas transferencias no se intentan ni se reintentan.")
+                    _orig_print("="*80 + "\n")
+                pendientes = [i for i in pendientes if i not in sin_saldo]
             else:
-                print(f"TRANSFE_FAILED:{idx}")
-                transfer_status[idx]['status'] = 'failed'
-                failed.append(idx)
-        except KeyboardInterrupt:
-            print(f"TRANSFE_FAILED:{idx}")
-            transfer_status[idx]['status'] = 'failed'
-            failed.append(idx)
-            raise
-        except Exception as e:
-            print(f"ERROR_DEBUG:Excepción en bucle principal: {str(e)}")
-            print(f"TRANSFE_FAILED:{idx}")
-            transfer_status[idx]['status'] = 'failed'
-            failed.append(idx)
-        # esperar 2 segundos entre ventanas (pasada inicial)
-        time.sleep(2)
+                print("ERROR_DEBUG:No se pudieron leer los saldos, se elige cuenta en cada transferencia")
+
+        # Primera pasada
+        _, failed = pool.ejecutar_pasada(pendientes, intento, reintento=False)
+
+        # Resumen de la primera pasada
+        completed_first = [str(x) for x in pendientes if x not in failed]
+        failed_first = [str(x) for x in failed]
+        comp_str = ",".join(completed_first) if completed_first else "none"
+        fail_str = ",".join(failed_first) if failed_first else "none"
+        # las que no tuvieron saldo no se intentaron, pero el resumen tiene que nombrarlas
+        saldo_str = f" — Sin saldo: {','.join(str(x) for x in sin_saldo)}" if sin_saldo else ""
+        print(f"PASADA_FINALIZADA:Pass {pass_number} — Completadas: {comp_str} — Fallidas: {fail_str}{saldo_str}")
+
+        # Reintentar fallidas por pasadas hasta que no queden
+        while failed:
+            # las que fallaron después de confirmar pueden haber salido igual: no reenviarlas
+            if RETRY_CHECK:
+                try:
+                    failed = verificar_ejecutadas(failed, transfer_status, log_file, ledger, sincronizador)
+                except Exception as e:
+                    print(f"ERROR_DEBUG:No se pudo verificar en movimientos antes de reintentar: {e}")
+                if not failed:
+                    break
+            pass_number += 1
+            if ledger is not None:
+                # las fallidas liberaron su reserva: saldos frescos y nueva cuenta para cada una
+                # (las que antes no entraban en ninguna también vuelven a probar)
+                failed, sin_saldo = reasignar_saldos(pool, ledger, list(failed) + sin_saldo, transfer_status)
+            if failed:
+                succeeded_this_pass, failed_this_pass = pool.ejecutar_pasada(list(failed), intento, reintento=True)
+            else:
+                succeeded_this_pass, failed_this_pass = [], []
 
-    # Resumen de la primera pasada
-    completed_first = [str(x) for x in range(1, len(transfers) + 1) if x not in failed]
-    failed_first = [str(x) for x in failed]
-    comp_str = ",".join(completed_first) if completed_first else "none"
-    fail_str = ",".join(failed_first) if failed_first else "none"
-    print(f"PASADA_FINALIZADA:Pass {pass_number} — Completadas: {comp_str} — Fallidas: {fail_str}")
-
-    # Reintentar fallidas por pasadas hasta que no queden
-    while failed:
-        pass_number += 1
-        current_failed = list(failed)
-        failed = []
-        succeeded_this_pass: List[int] = []
-        failed_this_pass: List[int] = []
-
-        for idx in current_failed:
-            t_data = transfer_status[idx]
-            cbu_destino = t_data['cbu_destino']
-            monto = t_data['monto']
-            
-            print(f"TRANSFE_START:{idx}")
-            try:
-                ok, cbu_origen = opcion_b_selenium(cbu_destino=cbu_destino, monto=monto)
-                if ok:
-                    print(f"TRANSFE_DONE:{idx}")
-                    transfer_status[idx]['status'] = 'done'
-                    transfer_status[idx]['cbu_origen_real'] = cbu_origen
-                    # Registrar en log
-                    log_transfer(log_file, idx, cbu_origen, cbu_destino, monto, "COMPLETADA")
-                    succeeded_this_pass.append(idx)
-                else:
-                    print(f"TRANSFE_FAILED:{idx}")
-                    transfer_status[idx]['status'] = 'failed'
-                    failed_this_pass.append(idx)
-                # esperar 3 segundos entre reintentos individuales
-                time.sleep(3)
-            except KeyboardInterrupt:
-                print(f"TRANSFE_FAILED:{idx}")
-                transfer_status[idx]['status'] = 'failed'
-                failed_this_pass.append(idx)
-                raise
-            except Exception as e:
-                print(f"ERROR_DEBUG:Excepción en bucle de reintentos: {str(e)}")
-                print(f"TRANSFE_FAILED:{idx}")
-                transfer_status[idx]['status'] = 'failed'
-                failed_this_pass.append(idx)
-                time.sleep(3)
-                continue
+            # preparar lista para la siguiente pasada (si quedaron)
+            failed = list(failed_this_pass)
 
-        # preparar lista para la siguiente pasada (si quedaron)
-        failed = list(failed_this_pass)
+            # imprimir resumen de la pasada
+            comp_str = ",".join(str(x) for x in succeeded_this_pass) if succeeded_this_pass else "none"
+            fail_str = ",".join(str(x) for x in failed_this_pass) if failed_this_pass else "none"
+            saldo_str = f" — Sin saldo: {','.join(str(x) for x in sin_saldo)}" if sin_saldo else ""
+            print(f"PASADA_FINALIZADA:Pass {pass_number} — Completadas: {comp_str} — Fallidas: {fail_str}{saldo_str}")
 
-        # imprimir resumen de la pasada
-        comp_str = ",".join(str(x) for x in succeeded_this_pass) if succeeded_this_pass else "none"
-        fail_str = ",".join(str(x) for x in failed_this_pass) if failed_this_pass else "none"
-        print(f"PASADA_FINALIZADA:Pass {pass_number} — Completadas: {comp_str} — Fallidas: {fail_str}")
+        # fin del flujo: todas las transferencias se intentaron y las fallidas se reintentaron hasta completar
+        # si alguna nunca llega a completarse, el proceso quedará reintentando indefinidamente para esa transferencia.
+    finally:
+        pool.cerrar()
+        if sincronizador is not None:
+            sincronizador.cerrar()
+        cerrar_browser_pool()
+        cerrar_servicio_chromedriver()
 
-    # fin del flujo: todas las transferencias se intentaron y las fallidas se reintentaron hasta completar
-    # si alguna nunca llega a completarse, el proceso quedará reintentando indefinidamente para esa transferencia.
 
 if __name__ == "__main__":
     try:
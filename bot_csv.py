@@ -5,12 +5,30 @@ bot_csv.py – Login + 2-FA OTP y filtrado de la grilla de movimientos
 con fechas provistas por el usuario (DATE_FROM / DATE_TO).
 
 Modo SCAN_ONLY=1  → solamente extrae el listado de cuentas (JSON por stdout).
+Modo CSV_WORKER=1 → un solo login: lista las cuentas (ACCOUNTS_JSON:) y queda en la
+                    grilla esperando pedidos JSON por stdin, uno por línea
+                    ({"id", "account", "date_from", "date_to"} o {"cmd": "quit"});
+                    cada export responde EXPORT_JSON:{"id", "ok", "file"}.
+                    Se cierra con EOF o tras CSV_WORKER_IDLE_SEC (default 900) sin pedidos.
+EXPORT_BATCH=ruta → lote de exports en un solo login: archivo JSON con una lista de
+                    {"account", "date_from", "date_to"} ("*" = todas las cuentas).
+                    Cada CSV queda como DOWNLOAD_DIR/<cuenta>_<desde>_<hasta>.csv y lo
+                    terminado se anota en <ruta>.progress.json: relanzar el mismo lote
+                    retoma desde el primer export pendiente.
+EXPORT_CHUNK      → "month" / "week" / N (días): con ACCOUNT_SEL + DATE_FROM/DATE_TO, parte
+                    el rango en tramos que se exportan en paralelo en EXPORT_SESSIONS
+                    (default 3) navegadores, cada uno con su carpeta de descargas, y une los
+                    CSV en DOWNLOAD_DIR/<cuenta>_<desde>_<hasta>.csv (sin repetidos, por fecha).
+SYNC=1            → sincronización incremental con movimientos_store (SQLite): para cada
+                    cuenta de SYNC_ACCOUNTS (separadas por coma, default "*" = todas) exporta
+                    solo desde su marca "sincronizado hasta", carga los movimientos por ID y
+                    avanza la marca.
 HEADLESS          → si está en 0 / false / no ⇒ abre navegador visible;
                     en cualquier otro valor ⇒ headless (default).
 
 Flujo normal (incluye todas las pausas solicitadas)
 ──────────────────────────────────────────────────────────────────────────────
-1.  Abre https://app.lohas.eco/app_Login
+1.  Abre LOHAS_BASE_URL/app_Login (default https://app.lohas.eco, el mismo host que bot.py)
 2.  Completa usuario y contraseña y pulsa “Ingresar”
 3.  Espera la pantalla de 2-FA
 4.  Lee el OTP desde Gmail (IMAP) y lo pega
@@ -25,13 +43,14 @@ Flujo normal (incluye todas las pausas solicitadas)
 from __future__ import annotations
 
 import builtins
-import email, imaplib, os, re, sys, time, json, pathlib, smtplib, ssl
-from typing import Callable, Optional, Tuple
+import csv
+import imaplib, os, re, sys, time, json, pathlib, queue, smtplib, ssl, threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 from email.message import EmailMessage
 
 from selenium import webdriver
 from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
@@ -42,17 +61,24 @@ from selenium.common.exceptions import (
     ElementClickInterceptedException,
     ElementNotInteractableException,
 )
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.keys import Keys
 from dotenv import load_dotenv
-
-from bot import get_latest_otp_gmail  # si no existe, comentar o implementar
+from movimientos_store import MovimientosStore, leer_export, parsear_fecha
+
+from bot import (
+    get_latest_otp_gmail, get_imap_pool, imap_uidnext, imap_search_desde, uid_fetch_textos,
+    BrowserPool, nuevo_chrome, cerrar_navegador, cerrar_servicio_chromedriver, aplicar_perfil_liviano, bloquear_recursos,
+    LOHAS_BASE_URL, restaurar_sesion_driver, guardar_sesion_driver, sesion_expirada,
+    esperar_pagina_lista, actividad_red, habilitar_log_red, WAIT_QUIET_NAV_SEC,
+    localizar_profundo, selector_profundo,
+)
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
 # ───────────────────────── PRINT MÍNIMO ──────────────────────────────────────
-_orig_print = builtins.print
+# bot.py ya reemplazó builtins.print al importarse: partir del print original
+_orig_print = getattr(sys.modules.get("bot"), "_orig_print", builtins.print)
 def _minimal_print(*a, **kw):
     if a and str(a[0]).startswith(("TRANSFE_START:", "TRANSFE_DONE:", "TRANSFE_FAILED:", "DEBUG:", "ACCOUNTS_JSON:")):
         # Para logs DEBUG, usar sys.stdout.write con flush forzado
@@ -66,7 +92,8 @@ builtins.print = _minimal_print
 
 # ─────────────────────────
 #  CONFIG & CONSTANTES WEB ───────────────────────────
-URL_B            = "https://app.lohas.eco/app_Login"
+# mismo host que bot.py (LOHAS_BASE_URL): la sesión guardada es de ese host
+URL_B            = f"{LOHAS_BASE_URL}/app_Login"
 
 # Credenciales Lohas (desde .env - requeridas)
 USER_B           = os.getenv("USER_LOHAS", "")
@@ -79,7 +106,7 @@ OTP_FIELD_ID     = "id_sc_field_code"
 OTP_FIELD_NAME   = "code"
 
 ACCEPT_BTN_ID    = "sc_submit_ajax_bot"
-TRANSFER_URL     = "https://app.lohas.eco/grid_movimientos_cuenta_usuario/"
+TRANSFER_URL     = f"{LOHAS_BASE_URL}/grid_movimientos_cuenta_usuario/"
 
 # IDs de los 6 inputs de fecha
 DIA_DESDE  = "SC_fecha_hora_dia"
@@ -92,6 +119,12 @@ ANO_HASTA  = "SC_fecha_hora_input_2_ano"
 # HEADLESS configurable por entorno  (default: sí es headless)
 HEADLESS = os.getenv("HEADLESS", "0").lower() not in ("0", "false", "no")
 
+# Modo worker: segundos sin pedidos tras los cuales se cierra (la sesión de Lohas vence igual)
+try:
+    CSV_WORKER_IDLE_SEC = max(30.0, float(os.getenv("CSV_WORKER_IDLE_SEC", "900")))
+except ValueError:
+    CSV_WORKER_IDLE_SEC = 900.0
+
 # ───────────────────────── CONSTANTES IMAP / SMTP ───────────────────────────
 GMAIL_IMAP_HOST  = "imap.gmail.com"
 
@@ -101,6 +134,9 @@ GMAIL_PASS       = os.getenv("GMAIL_PASS", "")
 
 KNOWN_SENDER     = "sistema@lohas.eco"
 
+# Cuántos UIDs antes de UIDNEXT se revisan al buscar el último mail de lohas
+OTP_LOOKBACK_UIDS = 50
+
 # Directorio donde se guardarán las descargas (relativo al cwd)
 DOWNLOAD_DIR = os.path.abspath(os.getenv("DOWNLOAD_DIR", os.path.join(os.getcwd(), "descargas")))
 
@@ -115,32 +151,31 @@ ACCOUNTS_SELECTOR = os.getenv(
 
 # Asegurar carpeta de descargas existe
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+# Tope de espera de la descarga del CSV tras pulsar "Descargar" (termina apenas está el archivo)
+try:
+    DOWNLOAD_TIMEOUT_SEC = max(5.0, float(os.getenv("DOWNLOAD_TIMEOUT_SEC", "60")))
+except ValueError:
+    DOWNLOAD_TIMEOUT_SEC = 60.0
+DOWNLOAD_POLL_SEC = 0.25
+
+# Export por tramos: tamaño de cada tramo ("" = un solo export) y navegadores en paralelo
+EXPORT_CHUNK = os.getenv("EXPORT_CHUNK", "").strip().lower()
+try:
+    EXPORT_SESSIONS = max(1, int(os.getenv("EXPORT_SESSIONS", "3")))
+except ValueError:
+    EXPORT_SESSIONS = 3
 
 # ──────────────────────────── IMAP HELPERS ─────────────────────────────────
 def imap_connect() -> imaplib.IMAP4_SSL:
-    m = imaplib.IMAP4_SSL(GMAIL_IMAP_HOST)
-    m.login(GMAIL_USER, GMAIL_PASS)
-    m.select("INBOX")
-    return m
+    # Conexión ya autenticada prestada por el pool compartido (devolver con imap_release)
+    return get_imap_pool(GMAIL_USER, GMAIL_PASS, GMAIL_IMAP_HOST).tomar()
+
+def imap_release(m: imaplib.IMAP4_SSL, descartar: bool = False):
+    get_imap_pool(GMAIL_USER, GMAIL_PASS, GMAIL_IMAP_HOST).devolver(m, descartar)
 
 def uid_fetch_text(m: imaplib.IMAP4_SSL, uid: int) -> Tuple[str, str]:
-    _, data = m.uid("FETCH", str(uid), "(RFC822)")
-    raw = data[0][1]
-    msg = email.message_from_bytes(raw)
-    subj = str(email.header.make_header(email.header.decode_header(msg.get("Subject", ""))))
-    body = ""
-    if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            disp  = (part.get("Content-Disposition") or "").lower()
-            if ctype == "text/plain" and "attachment" not in disp:
-                body = part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", "ignore")
-                break
-            if ctype == "text/html" and not body:
-                html = part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", "ignore")
-                body = re.sub(r"(?s)<[^>]+>", " ", html)
-    else:
-        body = (msg.get_payload(decode=True) or b"").decode(msg.get_content_charset() or "utf-8", "ignore")
+    # FETCH parcial (headers + principio del cuerpo, sin marcar leído) compartido con bot.py
+    subj, body, _ = uid_fetch_textos(m, [uid]).get(int(uid), ("", "", None))
     return subj, body
 
 def extract_otp(subj: str, body: str) -> Optional[str]:
@@ -150,74 +185,51 @@ def extract_otp(subj: str, body: str) -> Optional[str]:
     m = OTP_DIGITS_RE.search(body) or OTP_DIGITS_RE.search(subj)
     return m.group(1) if m else None
 
+# UID del último mail de OTP usado por este proceso: un login posterior (p. ej. otra sesión
+# del export por tramos) espera un mail más nuevo en vez de repegar ese código ya consumido
+_ULTIMO_UID_OTP = 0
+_UID_OTP_LOCK = threading.Lock()
+
+def uid_base_otp() -> int:
+    """Baseline para el OTP del próximo login: tomarla ANTES de pulsar "Ingresar"."""
+    m = imap_connect()
+    try:
+        base = imap_uidnext(m) - 1
+    finally:
+        imap_release(m)
+    with _UID_OTP_LOCK:
+        return max(base, _ULTIMO_UID_OTP)
+
 def wait_for_otp(since_uid: int, timeout: int = 120, poll: float = 2.0) -> str:
+    global _ULTIMO_UID_OTP
     m = imap_connect()
     start = time.time()
     try:
         while time.time() - start < timeout:
-            _, data = m.uid("SEARCH", None, 'UNSEEN', 'FROM', f'"{KNOWN_SENDER}"')
+            _, data = imap_search_desde(m, since_uid, 'UNSEEN', 'FROM', f'"{KNOWN_SENDER}"')
             uids = [int(x) for x in (data[0] or b"").split()][::-1]
             if not uids:
-                _, data = m.uid("SEARCH", None, "ALL")
+                _, data = imap_search_desde(m, since_uid)
                 uids = [int(x) for x in (data[0] or b"").split()][::-1]
+            uids = [u for u in uids if u > since_uid]
+            textos = uid_fetch_textos(m, uids)
             for uid in uids:
-                if uid <= since_uid:
-                    break
-                subj, body = uid_fetch_text(m, uid)
+                subj, body, _ = textos.get(uid, ("", "", None))
                 otp = extract_otp(subj, body)
                 if otp:
+                    with _UID_OTP_LOCK:
+                        _ULTIMO_UID_OTP = max(_ULTIMO_UID_OTP, uid)
                     return otp
             time.sleep(poll)
             m.select("INBOX")
         raise TimeoutError("OTP timeout")
     finally:
-        try: m.logout()
-        except: pass
+        imap_release(m)
 
 # ─────────────────────────── SELENIUM HELPERS ───────────────────────────────
-def _find_in_shadow_dom(drv: Chrome, css: str):
-    js = """
-    const sel = arguments[0];
-    function deep(node){
-      if(node.querySelector && node.querySelector(sel)) return node.querySelector(sel);
-      for(const c of node.children||[]){
-        const r = deep(c.shadowRoot||c) || deep(c);
-        if(r) return r;
-      }
-      return null;
-    }
-    return deep(document);
-    """
-    try:    return drv.execute_script(js, css)
-    except: return None
-
-def _recursive_frames(drv: Chrome, finder: Callable[[], Optional[object]], depth=0, maxd=5):
-    try:
-        el = finder()
-        if el: return el
-    except: pass
-    if depth >= maxd: return None
-    for fr in drv.find_elements(By.TAG_NAME, "iframe"):
-        try:
-            drv.switch_to.frame(fr)
-            el = _recursive_frames(drv, finder, depth+1, maxd)
-            drv.switch_to.parent_frame()
-            if el: return el
-        except:
-            try: drv.switch_to.default_content()
-            except: pass
-    return None
-
 def locate(drv: Chrome, by: By, val: str, timeout=10):
-    limit = time.time() + timeout
-    while time.time() < limit:
-        drv.switch_to.default_content()
-        el = _recursive_frames(drv, lambda: drv.find_element(by, val))
-        if el: return el
-        el = _find_in_shadow_dom(drv, val)
-        if el: return el
-        time.sleep(0.3)
-    return None
+    # frames + shadow DOM en un solo execute_script por intento (ver bot.localizar_profundo)
+    return localizar_profundo(drv, [selector_profundo(by, val)], timeout=timeout, poll=0.3)
 
 def safe_click(drv: Chrome, el):
     try:
@@ -358,6 +370,92 @@ def enable_download_behavior_with_cdp(drv, download_dir: str):
         # no fatal
         return False
 
+class DownloadTracker:
+    """
+    Descarga de *un* export: se arma justo antes del click en "Descargar" y esperar()
+    devuelve el archivo terminado de esa descarga (nunca un CSV viejo ni un .crdownload).
+    - Principal: eventos CDP Page.download* del performance log (guid → completed).
+    - Respaldo (sin log de performance): archivos nuevos en la carpeta con tamaño estable.
+    """
+
+    _PARCIALES = (".crdownload", ".tmp", ".part")
+
+    def __init__(self, drv: Chrome, directory: str, pattern_exts=(".csv",)):
+        self.directory = directory
+        self.pattern_exts = tuple(e.lower() for e in pattern_exts)
+        self.inicio = time.time()
+        self.act = actividad_red(drv)
+        self.act.actualizar()  # lo que ya estaba en el log es de antes del click
+        self.previas = set(self.act.descargas)
+        self.previos = self._listar()
+        self._tamanos: dict = {}
+
+    def _listar(self) -> dict:
+        try:
+            nombres = os.listdir(self.directory)
+        except OSError:
+            return {}
+        salida = {}
+        for n in nombres:
+            try:
+                salida[n] = os.path.getmtime(os.path.join(self.directory, n))
+            except OSError:
+                continue
+        return salida
+
+    def _nuevos(self) -> list:
+        """Archivos finales (extensión pedida) creados o reescritos después de armar el tracker."""
+        nuevos = []
+        for n, mtime in self._listar().items():
+            if not n.lower().endswith(self.pattern_exts) or n.lower().endswith(self._PARCIALES):
+                continue
+            if n not in self.previos or mtime > self.previos[n]:
+                nuevos.append((mtime, n))
+        return [n for _, n in sorted(nuevos, reverse=True)]
+
+    def _por_nombre(self, sugerido: Optional[str]) -> Optional[str]:
+        """Archivo nuevo de un nombre sugerido por Chrome (o su variante "nombre (1).csv")."""
+        if not sugerido:
+            return None
+        base, ext = os.path.splitext(sugerido)
+        for n in self._nuevos():
+            if n == sugerido or (n.startswith(base + " (") and n.endswith(")" + ext)):
+                return os.path.join(self.directory, n)
+        return None
+
+    def _estable(self) -> Optional[str]:
+        for n in self._nuevos():
+            ruta = os.path.join(self.directory, n)
+            try:
+                tam = os.path.getsize(ruta)
+            except OSError:
+                continue
+            if tam > 0 and self._tamanos.get(n) == tam:
+                return ruta
+            self._tamanos[n] = tam
+        return None
+
+    def esperar(self, timeout: float = DOWNLOAD_TIMEOUT_SEC) -> Optional[str]:
+        deadline = time.time() + timeout
+        while True:
+            self.act.actualizar()
+            for guid, d in list(self.act.descargas.items()):
+                if guid in self.previas:
+                    continue
+                if d["estado"] == "canceled":
+                    print(f"DEBUG: ❌ Chrome canceló la descarga de {d.get('archivo')}")
+                    self.previas.add(guid)
+                elif d["estado"] == "completed":
+                    ruta = d.get("ruta") if d.get("ruta") and os.path.exists(d["ruta"]) else self._por_nombre(d.get("archivo"))
+                    if ruta:
+                        return os.path.abspath(ruta)
+            ruta = self._estable()
+            if ruta:
+                return os.path.abspath(ruta)
+            if time.time() >= deadline:
+                return None
+            time.sleep(DOWNLOAD_POLL_SEC)
+
 def find_latest_file(directory: str, pattern_exts=(".csv",), timeout=20):
     """
     Busca el archivo más reciente en directory con una de las extensiones en pattern_exts.
@@ -658,45 +756,75 @@ def click_confirm_button(drv: Chrome, wait, timeout=15.0):
 
     return False
 
-# ───────────────────────────── SCAN_ONLY MODE ───────────────────────────────
-def scan_accounts(timeout=30):
+# ───────────────────────────── NAVEGADOR ────────────────────────────────────
+def crear_driver_csv(download_dir: str = DOWNLOAD_DIR) -> Chrome:
+    """Chrome con prefs de descarga hacia download_dir y log de red para las esperas."""
     opts = webdriver.ChromeOptions()
     opts.add_argument("--start-maximized")
-    _use_headless = os.getenv("HEADLESS", "0").lower() not in ("0", "false", "no")
-    if _use_headless:
+    if HEADLESS:
         opts.add_argument("--headless=new")
     opts.add_argument("--no-sandbox")
     opts.add_argument("--disable-dev-shm-usage")
+    habilitar_log_red(opts, descargas=True)
 
     # Configurar prefs de descarga
-    configure_chrome_options_for_download(opts, DOWNLOAD_DIR)
+    configure_chrome_options_for_download(opts, download_dir)
+    perfil = aplicar_perfil_liviano(opts)
 
-    # Crear driver con Service
-    service = ChromeService(ChromeDriverManager().install())
-    drv = webdriver.Chrome(service=service, options=opts)
+    # Chromedriver resuelto una vez por máquina (cache compartido con bot.py)
+    drv = nuevo_chrome(opts)
+    drv._perfil_temporal = perfil
+    bloquear_recursos(drv)
     drv.set_page_load_timeout(60)
     drv.implicitly_wait(10)
 
     # habilitar CDP para descargas (especialmente en modo headless)
+    try:
+        enable_download_behavior_with_cdp(drv, download_dir)
+    except Exception:
+        pass
+    return drv
+
+
+# Un Chrome pre-lanzado: arranca en segundo plano mientras se parsean args / se abre IMAP
+_CSV_POOL: Optional[BrowserPool] = None
+
+
+def csv_browser_pool() -> BrowserPool:
+    global _CSV_POOL
+    if _CSV_POOL is None:
+        _CSV_POOL = BrowserPool(1, crear_driver_csv, nombre="csv", reponer_al_tomar=False)
+    return _CSV_POOL
+
+
+def tomar_driver_csv() -> Chrome:
+    drv = csv_browser_pool().tomar(timeout=60)
+    # el reset del pool puede haber pisado el destino de descargas
     try:
         enable_download_behavior_with_cdp(drv, DOWNLOAD_DIR)
     except Exception:
         pass
+    return drv
+
+# ───────────────────────────── SCAN_ONLY MODE ───────────────────────────────
+def scan_accounts(timeout=30):
+    drv = tomar_driver_csv()
 
     try:
         wait = WebDriverWait(drv, 30)
-        drv.get(URL_B)
-        # login rápido si aparece
-        try:
-            wait.until(EC.presence_of_element_located((By.ID, FIELD_LOGIN_ID))).send_keys(USER_B)
-            wait.until(EC.presence_of_element_located((By.ID, FIELD_PASS_ID))).send_keys(PASS_B)
-            time.sleep(2)  # Esperar 2 segundos después de pegar user y pass
-            try: drv.find_element(By.CSS_SELECTOR, LOGIN_BTN_CSS).click()
-            except: pass
-            time.sleep(6)  # Esperar 6 segundos después de presionar botón
-            time.sleep(3)
-        except Exception:
-            pass  # posiblemente ya logueado
+        # sesión de un proceso anterior (sin login); si no hay o venció, login rápido
+        if not restaurar_sesion_driver(drv, TRANSFER_URL):
+            drv.get(URL_B)
+            # login rápido si aparece
+            try:
+                wait.until(EC.presence_of_element_located((By.ID, FIELD_LOGIN_ID))).send_keys(USER_B)
+                wait.until(EC.presence_of_element_located((By.ID, FIELD_PASS_ID))).send_keys(PASS_B)
+                esperar_pagina_lista(drv, 2, LOGIN_BTN_CSS)  # hasta 2s después de pegar user y pass
+                try: drv.find_element(By.CSS_SELECTOR, LOGIN_BTN_CSS).click()
+                except: pass
+                esperar_pagina_lista(drv, 9, quieto=WAIT_QUIET_NAV_SEC)  # hasta 9s después de presionar botón
+            except Exception:
+                pass  # posiblemente ya logueado
 
         sel, selectors = None, [s.strip() for s in ACCOUNTS_SELECTOR.split(",") if s.strip()]
         deadline = time.time() + timeout
@@ -726,72 +854,54 @@ def scan_accounts(timeout=30):
         _orig_print(json.dumps({"accounts": accounts}, ensure_ascii=True))
         return 0
     finally:
-        try: drv.quit()
-        except: pass
+        csv_browser_pool().devolver(drv)
 
 # ───────────────────────────── FLUJO PRINCIPAL ──────────────────────────────
-def login_otp() -> bool:
-    # Las fechas son opcionales para el proceso de OTP
-    # Se usarán después para filtrar la grilla de movimientos
-    date_from = os.getenv("DATE_FROM")      # YYYY-MM-DD (opcional)
-    date_to   = os.getenv("DATE_TO")        # YYYY-MM-DD (opcional)
-    
-    # Solo procesar fechas si están disponibles
-    if date_from and date_to:
-        df_y, df_m, df_d = date_from.split("-")
-        dt_y, dt_m, dt_d = date_to.split("-")
-        print(f"DEBUG: Fechas configuradas: {date_from} a {date_to}")
+def _login_hasta_grilla(drv: Chrome, wait: WebDriverWait) -> bool:
+    """
+    Login + OTP (o sesión restaurada) hasta dejar el navegador en la grilla de movimientos.
+    El OTP se espera en un mail con UID posterior al que había antes del click de login
+    (y al último OTP ya usado por este proceso): nunca se repega un código viejo.
+    """
+    # 0) Sesión guardada por un proceso anterior: ir directo a la grilla sin login ni OTP
+    if restaurar_sesion_driver(drv, TRANSFER_URL):
+        print("DEBUG: ✅ Sesión restaurada, se omite login + OTP")
+        esperar_pagina_lista(drv, 3, "span.select2-selection.select2-selection--single")
     else:
-        print("DEBUG: No se configuraron fechas - solo proceso OTP")
-
-    opts = webdriver.ChromeOptions()
-    opts.add_argument("--start-maximized")
-    if HEADLESS:
-        opts.add_argument("--headless=new")
-    opts.add_argument("--no-sandbox")
-    opts.add_argument("--disable-dev-shm-usage")
-
-    # Configurar prefs de descarga
-    configure_chrome_options_for_download(opts, DOWNLOAD_DIR)
-
-    # Crear driver y habilitar CDP para descargas
-    service = ChromeService(ChromeDriverManager().install())
-    drv = webdriver.Chrome(service=service, options=opts)
-    drv.set_page_load_timeout(60)
-    drv.implicitly_wait(10)
-    try:
-        enable_download_behavior_with_cdp(drv, DOWNLOAD_DIR)
-    except Exception:
-        pass
-
-    try:
-        wait = WebDriverWait(drv, 30)
-
         # 1) Login
         print("DEBUG: Iniciando proceso de login...")
         print(f"DEBUG: Navegando a URL: {URL_B}")
         drv.get(URL_B)
         print(f"DEBUG: URL actual después de navegar: {drv.current_url}")
-        
+
         print(f"DEBUG: Buscando campo de usuario: {FIELD_LOGIN_ID}")
         user_field = wait.until(EC.presence_of_element_located((By.ID, FIELD_LOGIN_ID)))
         print(f"DEBUG: Campo de usuario encontrado: {user_field}")
         user_field.send_keys(USER_B)
         print(f"DEBUG: Usuario ingresado: {USER_B}")
-        
+
         print(f"DEBUG: Buscando campo de contraseña: {FIELD_PASS_ID}")
         pass_field = wait.until(EC.presence_of_element_located((By.ID, FIELD_PASS_ID)))
         print(f"DEBUG: Campo de contraseña encontrado: {pass_field}")
         pass_field.send_keys(PASS_B)
         print("DEBUG: Contraseña ingresada")
-        
-        time.sleep(2)  # Esperar 2 segundos después de pegar user y pass
+
+        esperar_pagina_lista(drv, 2, LOGIN_BTN_CSS)  # hasta 2s después de pegar user y pass
         print("DEBUG: Buscando botón de login...")
         login_btn = drv.find_element(By.CSS_SELECTOR, LOGIN_BTN_CSS)
         print(f"DEBUG: Botón de login encontrado: {login_btn}")
+
+        # Baseline del OTP antes del click: el mail de este login tiene que llegar después
+        since_uid = None
+        if GMAIL_USER and GMAIL_PASS:
+            try:
+                since_uid = uid_base_otp()
+                print(f"DEBUG: Baseline UID establecido: {since_uid}")
+            except Exception as e:
+                print(f"DEBUG: Error estableciendo baseline UID: {e}")
         login_btn.click()
         print("DEBUG: Click en botón de login realizado")
-        time.sleep(6)  # Esperar 6 segundos después de presionar botón
+        esperar_pagina_lista(drv, 6, quieto=WAIT_QUIET_NAV_SEC)  # hasta 6s después de presionar botón
         print(f"DEBUG: URL actual después del login: {drv.current_url}")
 
         # 2) Esperar posible redirección al 2FA
@@ -804,7 +914,7 @@ def login_otp() -> bool:
             print(f"DEBUG: ❌ No se detectó redirección a 2FA: {e}")
             # no necesariamente fatal, seguir intentando encontrar OTP
             pass
-        
+
         print(f"DEBUG: URL actual después de esperar 2FA: {drv.current_url}")
 
         # 3) Buscar campo OTP (si no hay -> fallo)
@@ -823,21 +933,22 @@ def login_otp() -> bool:
             print(f"DEBUG: Credenciales Gmail disponibles: {GMAIL_USER}")
             try:
                 m = imap_connect()
-                
+                ventana_uid = max(0, imap_uidnext(m) - 1 - OTP_LOOKBACK_UIDS)
+
                 # Buscar emails de lohas en la última hora
                 import datetime
                 now = datetime.datetime.now()
                 one_hour_ago = now - datetime.timedelta(hours=1)
                 date_str = one_hour_ago.strftime("%d-%b-%Y")
-                
+
                 print(f"DEBUG: Buscando emails desde: {date_str}")
-                
+
                 # Buscar emails de lohas desde hace 1 hora
-                typ, data = m.uid("SEARCH", None, 'SINCE', date_str, 'FROM', f'"{KNOWN_SENDER}"')
+                typ, data = imap_search_desde(m, ventana_uid, 'SINCE', date_str, 'FROM', f'"{KNOWN_SENDER}"')
                 if typ == 'OK' and data and data[0]:
                     uids = [int(x) for x in data[0].split()]
                     print(f"DEBUG: Encontrados {len(uids)} emails de {KNOWN_SENDER} en la última hora")
-                    
+
                     # Procesar cada email encontrado
                     for i, uid in enumerate(uids[-5:]):  # Solo los últimos 5
                         try:
@@ -845,7 +956,7 @@ def login_otp() -> bool:
                             print(f"DEBUG: Email {i+1} (UID {uid}):")
                             print(f"DEBUG:   Asunto: {subj}")
                             print(f"DEBUG:   Cuerpo (primeros 200 chars): {body[:200]}...")
-                            
+
                             # Intentar extraer OTP
                             otp = extract_otp(subj, body)
                             if otp:
@@ -856,14 +967,14 @@ def login_otp() -> bool:
                             print(f"DEBUG:   ❌ Error procesando email {uid}: {e}")
                 else:
                     print(f"DEBUG: ❌ No se encontraron emails de {KNOWN_SENDER} en la última hora")
-                
+
                 # También buscar emails recientes sin filtro de fecha
                 print("DEBUG: Buscando emails recientes de lohas (sin filtro de fecha)...")
-                typ, data = m.uid("SEARCH", None, 'FROM', f'"{KNOWN_SENDER}"')
+                typ, data = imap_search_desde(m, ventana_uid, 'FROM', f'"{KNOWN_SENDER}"')
                 if typ == 'OK' and data and data[0]:
                     all_uids = [int(x) for x in data[0].split()]
                     print(f"DEBUG: Total de emails de {KNOWN_SENDER} encontrados: {len(all_uids)}")
-                    
+
                     # Mostrar los últimos 3 emails
                     for i, uid in enumerate(all_uids[-3:]):
                         try:
@@ -871,7 +982,7 @@ def login_otp() -> bool:
                             print(f"DEBUG: Email reciente {i+1} (UID {uid}):")
                             print(f"DEBUG:   Asunto: {subj}")
                             print(f"DEBUG:   Cuerpo (primeros 200 chars): {body[:200]}...")
-                            
+
                             # Intentar extraer OTP
                             otp = extract_otp(subj, body)
                             if otp:
@@ -882,75 +993,22 @@ def login_otp() -> bool:
                             print(f"DEBUG:   ❌ Error procesando email {uid}: {e}")
                 else:
                     print(f"DEBUG: ❌ No se encontraron emails de {KNOWN_SENDER}")
-                
-                m.logout()
-                
+
+                imap_release(m)
+
             except Exception as e:
                 print(f"DEBUG: ❌ Error buscando emails de lohas: {e}")
         else:
             print("DEBUG: ❌ No hay credenciales Gmail disponibles")
-        
-        # 5) Preparar búsqueda de OTP con baseline UID del último email
-        print("DEBUG: Preparando búsqueda de OTP con baseline UID...")
-        since_uid = None
-        if GMAIL_USER and GMAIL_PASS:
-            try:
-                m = imap_connect()
-                typ, data = m.uid("SEARCH", None, "ALL")
-                if typ == 'OK' and data and data[0]:
-                    all_uids = [int(x) for x in data[0].split()]
-                    since_uid = max(all_uids) if all_uids else 0
-                    print(f"DEBUG: Baseline UID establecido: {since_uid}")
-                else:
-                    since_uid = 0
-                    print("DEBUG: No se encontraron emails, baseline UID = 0")
-            except Exception as e:
-                print(f"DEBUG: Error estableciendo baseline UID: {e}")
-                since_uid = None
-            finally:
-                try: 
-                    m.logout()
-                except: 
-                    pass
 
-        # 5) Usar el último OTP encontrado directamente
-        print("DEBUG: Usando el último OTP encontrado...")
-        otp_code = ""
+        # 5) Esperar el OTP de este login (mail con UID mayor a la baseline)
+        if since_uid is None:
+            print("DEBUG: ❌ Sin baseline UID no se puede distinguir un OTP nuevo")
+            return False
+        print(f"DEBUG: Esperando OTP con UID > {since_uid}...")
         try:
-            if GMAIL_USER and GMAIL_PASS:
-                # Buscar el último OTP de lohas
-                m = imap_connect()
-                typ, data = m.uid("SEARCH", None, 'FROM', f'"{KNOWN_SENDER}"')
-                if typ == 'OK' and data and data[0]:
-                    all_uids = [int(x) for x in data[0].split()]
-                    if all_uids:
-                        # Tomar el UID más alto (más reciente)
-                        latest_uid = max(all_uids)
-                        print(f"DEBUG: Último UID encontrado: {latest_uid}")
-                        
-                        # Obtener el contenido del último email
-                        subj, body = uid_fetch_text(m, latest_uid)
-                        print(f"DEBUG: Último email (UID {latest_uid}):")
-                        print(f"DEBUG:   Asunto: {subj}")
-                        print(f"DEBUG:   Cuerpo (primeros 200 chars): {body[:200]}...")
-                        
-                        # Extraer OTP
-                        otp_code = extract_otp(subj, body)
-                        if otp_code:
-                            print(f"DEBUG: ✅ Código OTP obtenido del último email: {otp_code}")
-                        else:
-                            print("DEBUG: ❌ No se pudo extraer OTP del último email")
-                    else:
-                        print("DEBUG: ❌ No se encontraron emails de lohas")
-                else:
-                    print("DEBUG: ❌ No se encontraron emails de lohas")
-                
-                if GMAIL_USER and GMAIL_PASS:
-                    m.logout()
-            
-            if not otp_code:
-                print("DEBUG: ❌ No se obtuvo código OTP")
-                return False
+            otp_code = wait_for_otp(since_uid, timeout=120)
+            print(f"DEBUG: ✅ Código OTP obtenido: {otp_code}")
         except Exception as e:
             print(f"DEBUG: ❌ Error obteniendo OTP: {e}")
             return False
@@ -993,16 +1051,16 @@ def login_otp() -> bool:
                 except Exception as e3:
                     print(f"DEBUG: ❌ Error con clear + send_keys: {e3}")
                     return False
-        
+
         # Verificar que se pegó correctamente
         try:
             field_value = otp_input.get_attribute("value")
             print(f"DEBUG: Valor actual del campo: '{field_value}'")
-            
+
             # Verificar si el código se pegó correctamente (con o sin hyphens)
             field_digits = field_value.replace("-", "").replace(" ", "")
             otp_digits = otp_code.replace("-", "").replace(" ", "")
-            
+
             if field_digits == otp_digits:
                 print("DEBUG: ✅ Verificación: código pegado correctamente (con formato automático)")
             elif field_value == otp_code:
@@ -1015,11 +1073,11 @@ def login_otp() -> bool:
                 print(f"DEBUG:   Dígitos obtenidos: '{field_digits}'")
         except Exception as e:
             print(f"DEBUG: ❌ Error verificando valor del campo: {e}")
-        
+
         # 6.1) Pausa antes de confirmar
         try:
-            print("DEBUG: Esperando 4s antes de confirmar/aceptar...")
-            time.sleep(4.0)
+            print("DEBUG: Esperando (hasta 4s) antes de confirmar/aceptar...")
+            esperar_pagina_lista(drv, 4.0, f"#{ACCEPT_BTN_ID}")
         except Exception:
             pass
 
@@ -1037,7 +1095,7 @@ def login_otp() -> bool:
             return False
 
         try:
-            time.sleep(1.0)
+            esperar_pagina_lista(drv, 1.0, "#sub_form_b")
         except Exception:
             pass
 
@@ -1060,291 +1118,332 @@ def login_otp() -> bool:
             print(f"DEBUG: URL tras aceptar: {drv.current_url}")
         except Exception as e:
             print(f"DEBUG: Aviso: no se pudo confirmar salida de 2FA: {e}")
+        guardar_sesion_driver(drv)
 
         # Esperar 4s y navegar a la grilla
         try:
-            print("DEBUG: Esperando 4s antes de ir a la grilla...")
-            time.sleep(4)
+            print("DEBUG: Esperando (hasta 4s) antes de ir a la grilla...")
+            esperar_pagina_lista(drv, 4, quieto=WAIT_QUIET_NAV_SEC)
         except Exception:
             pass
-        
+
         try:
             print(f"DEBUG: Navegando a grilla: {TRANSFER_URL}")
             drv.get(TRANSFER_URL)
-            print("DEBUG: Esperando 3s para que cargue la grilla...")
-            time.sleep(3)
+            print("DEBUG: Esperando (hasta 3s) para que cargue la grilla...")
+            esperar_pagina_lista(drv, 3, "span.select2-selection.select2-selection--single")
         except Exception as e:
             print(f"DEBUG: Error navegando a la grilla: {e}")
-        
-        # Si venimos en el segundo flujo con cuenta y fechas, seleccionarlas y completar filtros
-        account_sel = os.getenv("ACCOUNT_SEL")
-        if account_sel and date_from and date_to:
-            print(f"DEBUG: ▶︎ Modo filtros: seleccionar cuenta y fechas — account='{account_sel}', {date_from} → {date_to}")
-            try:
-                # Abrir select2
-                dropdown = drv.find_element(By.CSS_SELECTOR, "span.select2-selection.select2-selection--single")
-                dropdown.click(); time.sleep(0.8)
-                # Buscar opción por texto
-                opts = drv.find_elements(By.CSS_SELECTOR, "li.select2-results__option")
-                print(f"DEBUG: Opciones en select2: {len(opts)}")
-                matched = None
-                for el in opts:
-                    t = (el.text or "").strip()
-                    if not t: continue
-                    # Igualdad exacta o contains
-                    if t == account_sel or account_sel in t:
-                        matched = el; break
-                if matched:
-                    try:
-                        drv.execute_script("arguments[0].scrollIntoView({block:'center'});", matched)
-                    except Exception:
-                        pass
-                    try:
-                        matched.click()
-                    except Exception:
-                        drv.execute_script("arguments[0].click();", matched)
-                    print("DEBUG: ✅ Cuenta seleccionada en dropdown")
-                else:
-                    print("DEBUG: ❌ No se encontró la cuenta solicitada en el dropdown")
 
-                # Completar fechas (6 inputs) en orden izquierda→derecha
-                try:
-                    df_y, df_m, df_d = date_from.split("-")
-                    dt_y, dt_m, dt_d = date_to.split("-")
-                except Exception:
-                    print("DEBUG: ❌ Formato de fechas inválido, esperado YYYY-MM-DD")
-                    return False
+    return True
 
-                pad2 = lambda s: str(s).zfill(2)
-                pad4 = lambda s: str(s).zfill(4)
-                vals = [
-                    (DIA_DESDE,  pad2(df_d)),
-                    (MES_DESDE,  pad2(df_m)),
-                    (ANO_DESDE,  pad4(df_y)),
-                    (DIA_HASTA,  pad2(dt_d)),
-                    (MES_HASTA,  pad2(dt_m)),
-                    (ANO_HASTA,  pad4(dt_y)),
-                ]
-
-                for fid, v in vals:
-                    try:
-                        el = locate(drv, By.ID, fid, 8) or drv.find_element(By.ID, fid)
-                    except Exception:
-                        el = None
-                    if not el:
-                        print(f"DEBUG: ❌ No se encontró input fecha id={fid}")
-                        continue
-                    try:
-                        drv.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
-                    except Exception:
-                        pass
-                    try:
-                        el.click(); time.sleep(0.05)
-                    except Exception:
-                        pass
-                    # Limpieza robusta y tipeo
-                    try:
-                        el.send_keys(Keys.CONTROL, 'a'); el.send_keys(Keys.DELETE)
-                    except Exception:
-                        try:
-                            drv.execute_script("arguments[0].value='';", el)
-                        except Exception:
-                            pass
-                    ok_set = False
-                    try:
-                        el.send_keys(v); ok_set = True
-                    except Exception:
-                        try:
-                            drv.execute_script("arguments[0].value = arguments[1]; arguments[0].dispatchEvent(new Event('input',{bubbles:true})); arguments[0].dispatchEvent(new Event('change',{bubbles:true}));", el, v)
-                            ok_set = True
-                        except Exception:
-                            pass
-                    curr = None
-                    try:
-                        curr = el.get_attribute("value")
-                    except Exception:
-                        curr = None
-                    print(f"DEBUG: Fecha id={fid} seteada='{v}' leida='{curr}' ok={ok_set}")
 
-                print("DEBUG: ✅ Filtros aplicados (cuenta y fechas). Esperando 4s...")
-                try: time.sleep(4)
-                except Exception: pass
+def _filtrar_y_exportar(drv: Chrome, wait: WebDriverWait, account_sel: str, date_from: str,
+                        date_to: str, download_dir: str = DOWNLOAD_DIR) -> Tuple[Optional[bool], Optional[str]]:
+    """
+    Con la grilla abierta: elige la cuenta, completa el rango de fechas y exporta el CSV.
+    Devuelve (ok, CSV descargado por este export); ok es None si falló algo antes
+    (filtros no aplicados).
+    """
+    print(f"DEBUG: ▶︎ Modo filtros: seleccionar cuenta y fechas — account='{account_sel}', {date_from} → {date_to}")
+    try:
+        # Abrir select2
+        dropdown = drv.find_element(By.CSS_SELECTOR, "span.select2-selection.select2-selection--single")
+        dropdown.click(); esperar_pagina_lista(drv, 0.8, "li.select2-results__option")
+        # Buscar opción por texto
+        opts = drv.find_elements(By.CSS_SELECTOR, "li.select2-results__option")
+        print(f"DEBUG: Opciones en select2: {len(opts)}")
+        matched = None
+        for el in opts:
+            t = (el.text or "").strip()
+            if not t: continue
+            # Igualdad exacta o contains
+            if t == account_sel or account_sel in t:
+                matched = el; break
+        if matched:
+            try:
+                drv.execute_script("arguments[0].scrollIntoView({block:'center'});", matched)
+            except Exception:
+                pass
+            try:
+                matched.click()
+            except Exception:
+                drv.execute_script("arguments[0].click();", matched)
+            print("DEBUG: ✅ Cuenta seleccionada en dropdown")
+        else:
+            print("DEBUG: ❌ No se encontró la cuenta solicitada en el dropdown")
 
-                # Click en botón "Búsqueda" y esperar 3s
+        # Completar fechas (6 inputs) en orden izquierda→derecha
+        try:
+            df_y, df_m, df_d = date_from.split("-")
+            dt_y, dt_m, dt_d = date_to.split("-")
+        except Exception:
+            print("DEBUG: ❌ Formato de fechas inválido, esperado YYYY-MM-DD")
+            return False, None
+
+        pad2 = lambda s: str(s).zfill(2)
+        pad4 = lambda s: str(s).zfill(4)
+        vals = [
+            (DIA_DESDE,  pad2(df_d)),
+            (MES_DESDE,  pad2(df_m)),
+            (ANO_DESDE,  pad4(df_y)),
+            (DIA_HASTA,  pad2(dt_d)),
+            (MES_HASTA,  pad2(dt_m)),
+            (ANO_HASTA,  pad4(dt_y)),
+        ]
+
+        for fid, v in vals:
+            try:
+                el = locate(drv, By.ID, fid, 8) or drv.find_element(By.ID, fid)
+            except Exception:
+                el = None
+            if not el:
+                print(f"DEBUG: ❌ No se encontró input fecha id={fid}")
+                continue
+            try:
+                drv.execute_script("arguments[0].scrollIntoView({block:'center'});", el)
+            except Exception:
+                pass
+            try:
+                el.click(); time.sleep(0.05)
+            except Exception:
+                pass
+            # Limpieza robusta y tipeo
+            try:
+                el.send_keys(Keys.CONTROL, 'a'); el.send_keys(Keys.DELETE)
+            except Exception:
                 try:
-                    btn = WebDriverWait(drv, 10).until(EC.element_to_be_clickable((By.ID, "sc_b_pesq_bot")))
-                    try:
-                        btn.click()
-                    except Exception:
-                        drv.execute_script("arguments[0].click();", btn)
-                    print("DEBUG: ✅ Click en botón Búsqueda realizado")
-                except Exception as e:
-                    print(f"DEBUG: ❌ No se pudo hacer click en botón Búsqueda: {e}")
-
+                    drv.execute_script("arguments[0].value='';", el)
+                except Exception:
+                    pass
+            ok_set = False
+            try:
+                el.send_keys(v); ok_set = True
+            except Exception:
                 try:
-                    print("DEBUG: Esperando 3s tras Búsqueda para cargar resultados...")
-                    time.sleep(3)
+                    drv.execute_script("arguments[0].value = arguments[1]; arguments[0].dispatchEvent(new Event('input',{bubbles:true})); arguments[0].dispatchEvent(new Event('change',{bubbles:true}));", el, v)
+                    ok_set = True
                 except Exception:
                     pass
+            curr = None
+            try:
+                curr = el.get_attribute("value")
+            except Exception:
+                curr = None
+            print(f"DEBUG: Fecha id={fid} seteada='{v}' leida='{curr}' ok={ok_set}")
 
-                # ─── BLOQUE: exportar CSV ──────────────────────────────────
-                try:
-                    # ➊ Click en el botón «Exportar»
-                    export_btn = WebDriverWait(drv, 10).until(
-                        EC.element_to_be_clickable((By.ID, "sc_btgp_btn_group_1_top"))
-                    )
-                    try:
-                        export_btn.click()
-                    except Exception:
-                        drv.execute_script("arguments[0].click();", export_btn)
-                    print("DEBUG: ✅ Click en botón Exportar realizado")
-                except Exception as e:
-                    print(f"DEBUG: ❌ No se pudo hacer click en botón Exportar: {e}")
+        print("DEBUG: ✅ Filtros aplicados (cuenta y fechas). Esperando (hasta 4s)...")
+        try: esperar_pagina_lista(drv, 4, "#sc_b_pesq_bot")
+        except Exception: pass
 
-                # ➋ Esperar 1 s antes de elegir el formato
-                try: time.sleep(1)
-                except Exception: pass
+        # Click en botón "Búsqueda" y esperar 3s
+        try:
+            btn = WebDriverWait(drv, 10).until(EC.element_to_be_clickable((By.ID, "sc_b_pesq_bot")))
+            try:
+                btn.click()
+            except Exception:
+                drv.execute_script("arguments[0].click();", btn)
+            print("DEBUG: ✅ Click en botón Búsqueda realizado")
+        except Exception as e:
+            print(f"DEBUG: ❌ No se pudo hacer click en botón Búsqueda: {e}")
 
-                try:
-                    # ➌ Click en la opción «CSV» del menú desplegable
-                    csv_opt = WebDriverWait(drv, 10).until(
-                        EC.element_to_be_clickable((By.XPATH, "//a[normalize-space()='CSV']"))
-                    )
-                    try:
-                        csv_opt.click()
-                    except Exception:
-                        drv.execute_script("arguments[0].click();", csv_opt)
-                    print("DEBUG: ✅ Click en opción CSV realizado")
-                except Exception as e:
-                    print(f"DEBUG: ❌ No se pudo hacer click en opción CSV: {e}")
-                # ────────────────────────────────────────────────────────────────
+        try:
+            print("DEBUG: Esperando (hasta 3s) tras Búsqueda para cargar resultados...")
+            esperar_pagina_lista(drv, 3, "#sc_btgp_btn_group_1_top", quieto=WAIT_QUIET_NAV_SEC)
+        except Exception:
+            pass
 
-                # ── NUEVOS PASOS ROBUSTOS: esperar 2s, click Aceptar (id=bok), esperar 10s, click idBtnDown ──
-                try:
-                    print("DEBUG: Esperando 2s antes de intentar Aceptar (bok)...")
-                    time.sleep(2)
-                except Exception:
-                    pass
+        # ─── BLOQUE: exportar CSV ──────────────────────────────────
+        try:
+            # ➊ Click en el botón «Exportar»
+            export_btn = WebDriverWait(drv, 10).until(
+                EC.element_to_be_clickable((By.ID, "sc_btgp_btn_group_1_top"))
+            )
+            try:
+                export_btn.click()
+            except Exception:
+                drv.execute_script("arguments[0].click();", export_btn)
+            print("DEBUG: ✅ Click en botón Exportar realizado")
+        except Exception as e:
+            print(f"DEBUG: ❌ No se pudo hacer click en botón Exportar: {e}")
 
-                # Intentar click robusto en 'bok' (Aceptar / Confirmar)
-                ok, msg = click_with_fallback(drv, wait, By.ID, "bok", timeout=12, check_iframe=True, js_last_resort=True)
-                if ok:
-                    print(f"DEBUG: ✅ Click en botón Aceptar (bok) exitoso - método: {msg}")
-                else:
-                    # Si falló con ID, intentar por XPath de texto como último intento antes de continuar
-                    try:
-                        print(f"DEBUG: Intentando fallback por texto para Aceptar (bok)...")
-                        ok2, msg2 = click_with_fallback(drv, wait, By.XPATH, "//a[normalize-space()='Aceptar' or contains(.,'Aceptar')]", timeout=8, check_iframe=True, js_last_resort=True)
-                        if ok2:
-                            print(f"DEBUG: ✅ Click en Aceptar por texto exitoso - método: {msg2}")
-                            ok = True
-                        else:
-                            print(f"DEBUG: ❌ Fallback por texto también falló: {msg2}")
-                    except Exception as e:
-                        print(f"DEBUG: ❌ Error en fallback por texto para Aceptar: {e}")
-
-                if not ok:
-                    print("DEBUG: ❗ Continuamos a intentar descarga de todas formas (si procede)")
-
-                # Esperar 10s para que el proceso de exportación genere el dialogo/archivo
-                try:
-                    print("DEBUG: Esperando 10s antes de intentar Descargar (idBtnDown)...")
-                    time.sleep(10)
-                except Exception:
-                    pass
+        # ➋ Esperar (hasta 1 s) antes de elegir el formato
+        try: esperar_pagina_lista(drv, 1)
+        except Exception: pass
+
+        try:
+            # ➌ Click en la opción «CSV» del menú desplegable
+            csv_opt = WebDriverWait(drv, 10).until(
+                EC.element_to_be_clickable((By.XPATH, "//a[normalize-space()='CSV']"))
+            )
+            try:
+                csv_opt.click()
+            except Exception:
+                drv.execute_script("arguments[0].click();", csv_opt)
+            print("DEBUG: ✅ Click en opción CSV realizado")
+        except Exception as e:
+            print(f"DEBUG: ❌ No se pudo hacer click en opción CSV: {e}")
+        # ────────────────────────────────────────────────────────────────
 
-                # Intentar click robusto en botón Descargar (idBtnDown)
-                okd, msgd = click_with_fallback(drv, wait, By.ID, "idBtnDown", timeout=18, check_iframe=True, js_last_resort=False)
-                if okd:
-                    print(f"DEBUG: ✅ Click en botón Descargar (idBtnDown) exitoso - método: {msgd}")
+        # ── NUEVOS PASOS ROBUSTOS: esperar 2s, click Aceptar (id=bok), esperar 10s, click idBtnDown ──
+        try:
+            print("DEBUG: Esperando (hasta 2s) antes de intentar Aceptar (bok)...")
+            esperar_pagina_lista(drv, 2, "#bok")
+        except Exception:
+            pass
+
+        # Intentar click robusto en 'bok' (Aceptar / Confirmar)
+        ok, msg = click_with_fallback(drv, wait, By.ID, "bok", timeout=12, check_iframe=True, js_last_resort=True)
+        if ok:
+            print(f"DEBUG: ✅ Click en botón Aceptar (bok) exitoso - método: {msg}")
+        else:
+            # Si falló con ID, intentar por XPath de texto como último intento antes de continuar
+            try:
+                print(f"DEBUG: Intentando fallback por texto para Aceptar (bok)...")
+                ok2, msg2 = click_with_fallback(drv, wait, By.XPATH, "//a[normalize-space()='Aceptar' or contains(.,'Aceptar')]", timeout=8, check_iframe=True, js_last_resort=True)
+                if ok2:
+                    print(f"DEBUG: ✅ Click en Aceptar por texto exitoso - método: {msg2}")
+                    ok = True
                 else:
-                    # fallback por XPath / texto
-                    try:
-                        okd2, msgd2 = click_with_fallback(drv, wait, By.XPATH, "//a[normalize-space()='Descargar' or contains(.,'Descargar')]", timeout=8, check_iframe=True, js_last_resort=False)
-                        if okd2:
-                            print(f"DEBUG: ✅ Click en Descargar por texto exitoso - método: {msgd2}")
-                            okd = True
-                        else:
-                            print(f"DEBUG: ❌ No se pudo clicar Descargar (idBtnDown): {msgd2}")
-                    except Exception as e:
-                        print(f"DEBUG: ❌ Error en fallback por texto para Descargar: {e}")
-
-                if not okd:
-                    # como último recurso intentar invocar JS downloadClick() si existe
-                    try:
-                        drv.execute_script("if(typeof downloadClick === 'function'){ downloadClick(); }")
-                        print("DEBUG: ✅ Ejecutado downloadClick() por JS como último recurso")
-                        okd = True
-                    except Exception as e:
-                        print(f"DEBUG: ❌ No se pudo invocar downloadClick() por JS: {e}")
+                    print(f"DEBUG: ❌ Fallback por texto también falló: {msg2}")
+            except Exception as e:
+                print(f"DEBUG: ❌ Error en fallback por texto para Aceptar: {e}")
 
-                # Esperar 10s adicionales para que el archivo termine de descargarse
-                try:
-                    print("DEBUG: Esperando 10s para que termine la descarga del CSV...")
-                    time.sleep(10)
-                except Exception:
-                    pass
+        if not ok:
+            print("DEBUG: ❗ Continuamos a intentar descarga de todas formas (si procede)")
 
-                # Buscar el CSV más reciente en DOWNLOAD_DIR y reportar ruta
-                latest = find_latest_file(DOWNLOAD_DIR, pattern_exts=(".csv",))
-                if latest:
-                    print(f"DEBUG: ✅ Archivo CSV descargado en: {latest}")
+        # Esperar 10s para que el proceso de exportación genere el dialogo/archivo
+        try:
+            print("DEBUG: Esperando (hasta 10s) antes de intentar Descargar (idBtnDown)...")
+            esperar_pagina_lista(drv, 10, "#idBtnDown")
+        except Exception:
+            pass
+
+        # Armar el seguimiento de la descarga antes del click (solo cuenta lo que venga después)
+        descarga = DownloadTracker(drv, download_dir, pattern_exts=(".csv",))
+
+        # Intentar click robusto en botón Descargar (idBtnDown)
+        okd, msgd = click_with_fallback(drv, wait, By.ID, "idBtnDown", timeout=18, check_iframe=True, js_last_resort=False)
+        if okd:
+            print(f"DEBUG: ✅ Click en botón Descargar (idBtnDown) exitoso - método: {msgd}")
+        else:
+            # fallback por XPath / texto
+            try:
+                okd2, msgd2 = click_with_fallback(drv, wait, By.XPATH, "//a[normalize-space()='Descargar' or contains(.,'Descargar')]", timeout=8, check_iframe=True, js_last_resort=False)
+                if okd2:
+                    print(f"DEBUG: ✅ Click en Descargar por texto exitoso - método: {msgd2}")
+                    okd = True
                 else:
-                    print("DEBUG: ❌ No se detectó ningún CSV en la carpeta de descargas")
+                    print(f"DEBUG: ❌ No se pudo clicar Descargar (idBtnDown): {msgd2}")
+            except Exception as e:
+                print(f"DEBUG: ❌ Error en fallback por texto para Descargar: {e}")
 
-                try:
-                    print("DEBUG: Esperando 3s tras exportar/descargar para asegurarnos...")
-                    time.sleep(3)
-                except Exception:
-                    pass
+        if not okd:
+            # como último recurso intentar invocar JS downloadClick() si existe
+            try:
+                drv.execute_script("if(typeof downloadClick === 'function'){ downloadClick(); }")
+                print("DEBUG: ✅ Ejecutado downloadClick() por JS como último recurso")
+                okd = True
+            except Exception as e:
+                print(f"DEBUG: ❌ No se pudo invocar downloadClick() por JS: {e}")
 
-                return True
+        # Esperar a que termine *esta* descarga (hasta DOWNLOAD_TIMEOUT_SEC)
+        print(f"DEBUG: Esperando (hasta {DOWNLOAD_TIMEOUT_SEC:.0f}s) a que termine la descarga del CSV...")
+        latest = descarga.esperar()
+        if latest:
+            print(f"DEBUG: ✅ Archivo CSV descargado en: {latest}")
+        else:
+            print("DEBUG: ❌ No se detectó ningún CSV nuevo en la carpeta de descargas")
+
+        return True, latest
+    except Exception as e:
+        print(f"DEBUG: ❌ Error aplicando filtros: {e}")
+        return None, None  # login_otp sigue con la lectura de cuentas como fallback
+
+
+def _leer_cuentas(drv: Chrome) -> List[dict]:
+    """Cuentas del dropdown (select2) de la grilla, para mostrarlas en el diálogo."""
+    accounts: List[dict] = []
+    print("DEBUG: Buscando dropdown de cuentas...")
+    try:
+        # Intentar abrir el dropdown haciendo click
+        dropdown = drv.find_element(By.CSS_SELECTOR, "span.select2-selection.select2-selection--single")
+        print(f"DEBUG: Dropdown encontrado: {dropdown}")
+        dropdown.click()
+        esperar_pagina_lista(drv, 1, "li.select2-results__option")
+
+        # Leer todas las opciones disponibles
+        options = drv.find_elements(By.CSS_SELECTOR, "li.select2-results__option")
+        print(f"DEBUG: Encontradas {len(options)} opciones en el dropdown")
+
+        for i, option in enumerate(options):
+            try:
+                text = option.text
+                value = option.get_attribute("data-select2-id") or text
+                if text and text.strip():
+                    accounts.append({"value": value, "text": text.strip()})
+                    print(f"DEBUG: Cuenta {i+1}: {text.strip()}")
             except Exception as e:
-                print(f"DEBUG: ❌ Error aplicando filtros: {e}")
-                # Continuar con lectura de cuentas como fallback
-        
-        # Primer flujo: leer cuentas para mostrarlas en el diálogo
-        print("DEBUG: Buscando dropdown de cuentas...")
-        try:
-            # Intentar abrir el dropdown haciendo click
-            dropdown = drv.find_element(By.CSS_SELECTOR, "span.select2-selection.select2-selection--single")
-            print(f"DEBUG: Dropdown encontrado: {dropdown}")
-            dropdown.click()
-            time.sleep(1)
-
-            # Leer todas las opciones disponibles
-            options = drv.find_elements(By.CSS_SELECTOR, "li.select2-results__option")
-            accounts = []
-            print(f"DEBUG: Encontradas {len(options)} opciones en el dropdown")
-
-            for i, option in enumerate(options):
-                try:
-                    text = option.text
-                    value = option.get_attribute("data-select2-id") or text
-                    if text and text.strip():
-                        accounts.append({"value": value, "text": text.strip()})
-                        print(f"DEBUG: Cuenta {i+1}: {text.strip()}")
-                except Exception as e:
-                    print(f"DEBUG: Error leyendo opción {i+1}: {e}")
-                    continue
+                print(f"DEBUG: Error leyendo opción {i+1}: {e}")
+                continue
 
-            print(f"DEBUG: Total de cuentas leídas: {len(accounts)}")
+        print(f"DEBUG: Total de cuentas leídas: {len(accounts)}")
 
-            # Guardar las cuentas para retornarlas
-            if accounts:
-                print("DEBUG: ✅ Cuentas leídas exitosamente")
-                # Emite una línea marcadora fácil de parsear por Flask
-                try:
-                    payload = json.dumps({"accounts": accounts}, ensure_ascii=True)
-                    _orig_print("ACCOUNTS_JSON:" + payload)
-                except Exception as _e:
-                    # Fallback: imprime JSON simple (por compatibilidad)
-                    _orig_print(json.dumps({"accounts": accounts}, ensure_ascii=True))
-            else:
-                print("DEBUG: ❌ No se encontraron cuentas en el dropdown")
+    except Exception as e:
+        print(f"DEBUG: ❌ Error leyendo dropdown de cuentas: {e}")
+    return accounts
 
-        except Exception as e:
-            print(f"DEBUG: ❌ Error leyendo dropdown de cuentas: {e}")
+
+def emitir_cuentas(accounts: List[dict]):
+    """Emite una línea marcadora fácil de parsear por Flask."""
+    try:
+        payload = json.dumps({"accounts": accounts}, ensure_ascii=True)
+        _orig_print("ACCOUNTS_JSON:" + payload)
+    except Exception as _e:
+        # Fallback: imprime JSON simple (por compatibilidad)
+        _orig_print(json.dumps({"accounts": accounts}, ensure_ascii=True))
+
+
+def login_otp() -> bool:
+    # Las fechas son opcionales para el proceso de OTP
+    # Se usarán después para filtrar la grilla de movimientos
+    date_from = os.getenv("DATE_FROM")      # YYYY-MM-DD (opcional)
+    date_to   = os.getenv("DATE_TO")        # YYYY-MM-DD (opcional)
+    
+    # Solo procesar fechas si están disponibles
+    if date_from and date_to:
+        df_y, df_m, df_d = date_from.split("-")
+        dt_y, dt_m, dt_d = date_to.split("-")
+        print(f"DEBUG: Fechas configuradas: {date_from} a {date_to}")
+    else:
+        print("DEBUG: No se configuraron fechas - solo proceso OTP")
+
+    drv = tomar_driver_csv()
+
+    try:
+        wait = WebDriverWait(drv, 30)
+
+        if not _login_hasta_grilla(drv, wait):
+            return False
+
+        # Si venimos en el segundo flujo con cuenta y fechas, seleccionarlas y completar filtros
+        account_sel = os.getenv("ACCOUNT_SEL")
+        if account_sel and date_from and date_to and EXPORT_CHUNK:
+            rangos = planear_rangos(date_from, date_to, EXPORT_CHUNK)
+            if len(rangos) > 1:
+                return exportar_por_tramos(account_sel, date_from, date_to, rangos, drv, wait) is not None
+        if account_sel and date_from and date_to:
+            exportado, _ = _filtrar_y_exportar(drv, wait, account_sel, date_from, date_to)
+            if exportado is not None:
+                return exportado
+
+        # Primer flujo: leer cuentas para mostrarlas en el diálogo
+        accounts = _leer_cuentas(drv)
+        if accounts:
+            print("DEBUG: ✅ Cuentas leídas exitosamente")
+            emitir_cuentas(accounts)
+        else:
+            print("DEBUG: ❌ No se encontraron cuentas en el dropdown")
 
         print("DEBUG: Retornando True - flujo post-OTP completado")
         return True
@@ -1354,19 +1453,461 @@ def login_otp() -> bool:
         return False
 
     finally:
-        try: drv.quit()
-        except: pass
+        csv_browser_pool().devolver(drv)
+
+# ───────────────────────────── MODO WORKER ──────────────────────────────────
+def _leer_pedidos(cola: "queue.Queue[Optional[str]]"):
+    """Hilo: líneas de stdin → cola; None al llegar EOF (flask cerró el canal)."""
+    try:
+        for linea in sys.stdin:
+            if linea.strip():
+                cola.put(linea)
+    except Exception as e:
+        print(f"DEBUG: ❌ Error leyendo pedidos: {e}")
+    cola.put(None)
+
+
+def _exportar_pedido(drv: Chrome, wait: WebDriverWait, pedido: dict, grilla_lista: bool,
+                     download_dir: str = DOWNLOAD_DIR) -> Tuple[bool, Optional[str]]:
+    """Un export sobre el navegador ya logueado. Devuelve (ok, ruta del CSV nuevo)."""
+    account_sel = (pedido.get("account") or "").strip()
+    date_from, date_to = pedido.get("date_from"), pedido.get("date_to")
+    if not (account_sel and date_from and date_to):
+        print("DEBUG: ❌ Pedido incompleto (account, date_from y date_to son requeridos)")
+        return False, None
+
+    if not grilla_lista:
+        # el export anterior deja diálogos abiertos: volver a la grilla limpia
+        drv.get(TRANSFER_URL)
+        esperar_pagina_lista(drv, 3, "span.select2-selection.select2-selection--single")
+    if sesion_expirada(drv):
+        print("DEBUG: Sesión vencida en el worker, login nuevamente...")
+        if not _login_hasta_grilla(drv, wait):
+            return False, None
+
+    ok, latest = _filtrar_y_exportar(drv, wait, account_sel, date_from, date_to, download_dir)
+    return bool(ok), latest
+
+
+def csv_worker() -> int:
+    """
+    CSV_WORKER=1: el mismo navegador que listó las cuentas queda estacionado en la grilla
+    y exporta cada pedido que llega por stdin, sin repetir login + OTP ni abrir otro Chrome.
+    """
+    drv = tomar_driver_csv()
+
+    try:
+        wait = WebDriverWait(drv, 30)
+        if not _login_hasta_grilla(drv, wait):
+            _orig_print(json.dumps({"error": "login"}))
+            return 1
+
+        accounts = _leer_cuentas(drv)
+        if not accounts:
+            print("DEBUG: ❌ No se encontraron cuentas en el dropdown")
+            _orig_print(json.dumps({"error": "accounts"}))
+            return 1
+        # cerrar el dropdown que dejó abierto la lectura (el export lo vuelve a abrir)
+        try:
+            drv.find_element(By.CSS_SELECTOR, "span.select2-selection.select2-selection--single").click()
+        except Exception:
+            pass
+        emitir_cuentas(accounts)
+
+        pedidos: "queue.Queue[Optional[str]]" = queue.Queue()
+        threading.Thread(target=_leer_pedidos, args=(pedidos,), daemon=True, name="csv-pedidos").start()
+        grilla_lista = True
+        while True:
+            try:
+                linea = pedidos.get(timeout=CSV_WORKER_IDLE_SEC)
+            except queue.Empty:
+                print(f"DEBUG: Worker sin pedidos hace {CSV_WORKER_IDLE_SEC:.0f}s, cerrando")
+                break
+            if linea is None:
+                break
+            try:
+                pedido = json.loads(linea)
+            except ValueError:
+                print(f"DEBUG: ❌ Pedido inválido: {linea.strip()!r}")
+                continue
+            if pedido.get("cmd") == "quit":
+                break
+
+            print("TRANSFE_START:1")
+            try:
+                ok, archivo = _exportar_pedido(drv, wait, pedido, grilla_lista)
+            except Exception as e:
+                print(f"DEBUG: ❌ Error en export del worker: {e}")
+                ok, archivo = False, None
+            grilla_lista = False
+            print("TRANSFE_DONE:1" if ok else "TRANSFE_FAILED:1")
+            _orig_print("EXPORT_JSON:" + json.dumps({"id": pedido.get("id"), "ok": ok, "file": archivo}))
+        return 0
+    finally:
+        csv_browser_pool().devolver(drv)
+
+# ───────────────────────────── MODO LOTE ────────────────────────────────────
+def nombre_export(account: str, date_from: str, date_to: str) -> str:
+    """Nombre predecible del CSV de un export: <cuenta>_<desde>_<hasta>.csv"""
+    cuenta = re.sub(r"[^A-Za-z0-9]+", "_", account).strip("_")[:60] or "cuenta"
+    return f"{cuenta}_{date_from}_{date_to}.csv"
+
+
+def cargar_lote(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        datos = json.load(f)
+    if isinstance(datos, dict):
+        datos = datos.get("jobs", [])
+    jobs = []
+    for i, job in enumerate(datos, 1):
+        if not all((job or {}).get(k) for k in ("account", "date_from", "date_to")):
+            raise ValueError(f"export #{i} del lote sin account/date_from/date_to: {job!r}")
+        jobs.append({k: str(job[k]).strip() for k in ("account", "date_from", "date_to")})
+    return jobs
+
+
+class ProgresoLote:
+    """
+    Exports terminados de un lote (clave -> CSV), en disco tras cada uno para que un
+    lote caído se retome donde quedó. Un export cuenta como hecho si su CSV sigue ahí.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            datos = {}
+        self.hechos: dict = datos.get("hechos", {})
+        self.cuentas: Optional[List[str]] = datos.get("cuentas")  # las que expandió "*"
+
+    @staticmethod
+    def clave(job: dict) -> str:
+        return f"{job['account']}|{job['date_from']}|{job['date_to']}"
+
+    def hecho(self, job: dict) -> Optional[str]:
+        archivo = self.hechos.get(self.clave(job))
+        return archivo if archivo and os.path.exists(archivo) else None
+
+    def pendientes(self, jobs: List[dict], cuentas: Optional[List[str]] = None) -> List[dict]:
+        """Exports sin hacer; "*" se expande con `cuentas` (o queda tal cual si no se conocen)."""
+        salida = []
+        for j in jobs:
+            if j["account"] == "*" and cuentas is None:
+                salida.append(j)
+                continue
+            for cuenta in (cuentas if j["account"] == "*" else [j["account"]]):
+                job = {**j, "account": cuenta}
+                if not self.hecho(job):
+                    salida.append(job)
+        return salida
+
+    def marcar(self, job: dict, archivo: str):
+        self.hechos[self.clave(job)] = archivo
+        self._escribir()
+
+    def marcar_cuentas(self, cuentas: List[str]):
+        self.cuentas = cuentas
+        self._escribir()
+
+    def _escribir(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"hechos": self.hechos, "cuentas": self.cuentas, "actualizado": time.time()},
+                      f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+def exportar_lote(path: str) -> int:
+    """EXPORT_BATCH: todos los exports del lote, uno tras otro, con un solo login + OTP."""
+    jobs = cargar_lote(path)
+    progreso = ProgresoLote(path + ".progress.json")
+    pendientes = progreso.pendientes(jobs, progreso.cuentas)
+    print(f"DEBUG: Lote {path}: {len(jobs)} exports, {len(pendientes)} pendientes")
+    if not pendientes:
+        return 0
+
+    drv = tomar_driver_csv()
+
+    try:
+        wait = WebDriverWait(drv, 30)
+        if not _login_hasta_grilla(drv, wait):
+            return 1
+
+        grilla_lista = True
+        if any(j["account"] == "*" for j in pendientes):
+            cuentas = [c["text"] for c in _leer_cuentas(drv)]
+            grilla_lista = False  # el dropdown quedó abierto
+            if cuentas:
+                progreso.marcar_cuentas(cuentas)
+            pendientes = progreso.pendientes(pendientes, cuentas)
+
+        fallidos = 0
+        for n, job in enumerate(pendientes, 1):
+            print(f"TRANSFE_START:{n}")
+            try:
+                ok, archivo = _exportar_pedido(drv, wait, job, grilla_lista)
+            except Exception as e:
+                print(f"DEBUG: ❌ Error en export del lote: {e}")
+                ok, archivo = False, None
+            grilla_lista = False
+            destino = None
+            if ok and archivo:
+                destino = os.path.join(DOWNLOAD_DIR, nombre_export(job["account"], job["date_from"], job["date_to"]))
+                try:
+                    os.replace(archivo, destino)
+                    progreso.marcar(job, destino)
+                except OSError as e:
+                    print(f"DEBUG: ❌ No se pudo guardar {destino}: {e}")
+                    destino = None
+            if not destino:
+                fallidos += 1
+            print(f"TRANSFE_DONE:{n}" if destino else f"TRANSFE_FAILED:{n}")
+            _orig_print("BATCH_JSON:" + json.dumps({**job, "ok": bool(destino), "file": destino}, ensure_ascii=True))
+
+        print(f"DEBUG: Lote terminado: {len(pendientes) - fallidos}/{len(pendientes)} exports")
+        return 1 if fallidos else 0
+    finally:
+        csv_browser_pool().devolver(drv)
+
+# ───────────────────────────── EXPORT POR TRAMOS ────────────────────────────
+# Un login + OTP a la vez: cada sesión toma su baseline después de que la anterior consumió
+# su código (uid_base_otp), así espera un mail nuevo en lugar de repegar el ya usado
+_LOGIN_LOCK = threading.Lock()
+
+
+def planear_rangos(date_from: str, date_to: str, tramo: str = "month") -> List[Tuple[str, str]]:
+    """
+    Parte [date_from, date_to] (YYYY-MM-DD, ambos inclusive) en tramos contiguos:
+    "month" (meses calendario), "week" (lunes a domingo) o N días.
+    """
+    desde = datetime.strptime(date_from, "%Y-%m-%d").date()
+    hasta = datetime.strptime(date_to, "%Y-%m-%d").date()
+    if hasta < desde:
+        raise ValueError(f"rango invertido: {date_from} > {date_to}")
+    rangos = []
+    inicio = desde
+    while inicio <= hasta:
+        if tramo in ("month", "mes"):
+            siguiente = (inicio.replace(day=1) + timedelta(days=32)).replace(day=1)
+        elif tramo in ("week", "semana"):
+            siguiente = inicio + timedelta(days=7 - inicio.weekday())
+        else:
+            siguiente = inicio + timedelta(days=max(1, int(tramo)))
+        fin = min(siguiente - timedelta(days=1), hasta)
+        rangos.append((inicio.isoformat(), fin.isoformat()))
+        inicio = fin + timedelta(days=1)
+    return rangos
+
+
+def _fecha_movimiento(fila: List[str]) -> Optional[datetime]:
+    return parsear_fecha(fila[1]) if len(fila) > 1 else None
+
+
+def unir_exports(archivos: List[str], destino: str) -> int:
+    """
+    Une CSVs de grid_movimientos_cuenta_usuario en uno: sin repetidos (clave = ID del
+    movimiento, primera columna) y del más nuevo al más viejo, como los exporta Lohas.
+    Si traen encabezado se conserva uno. Devuelve la cantidad de movimientos.
+    """
+    encabezado, filas, vistos, encoding = None, [], set(), None
+    for path in archivos:
+        datos, enc = leer_export(path)
+        encoding = encoding or ("utf-8" if enc == "utf-8-sig" else enc)
+        for fila in datos:
+            if _fecha_movimiento(fila) is None and encabezado is None and not filas:
+                encabezado = fila
+                continue
+            clave = fila[0].strip() if fila and fila[0].strip() else tuple(fila)
+            if clave in vistos or fila == encabezado:
+                continue
+            vistos.add(clave)
+            filas.append(fila)
+    filas.sort(key=lambda f: _fecha_movimiento(f) or datetime.min, reverse=True)
+    tmp = destino + ".tmp"
+    with open(tmp, "w", newline="", encoding=encoding or "utf-8") as f:
+        w = csv.writer(f, delimiter=";", quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        if encabezado:
+            w.writerow(encabezado)
+        w.writerows(filas)
+    os.replace(tmp, destino)
+    return len(filas)
+
+
+def exportar_por_tramos(account_sel: str, date_from: str, date_to: str,
+                        rangos: Optional[List[Tuple[str, str]]] = None,
+                        drv: Optional[Chrome] = None, wait: Optional[WebDriverWait] = None) -> Optional[str]:
+    """
+    Exporta cada tramo del rango en paralelo (EXPORT_SESSIONS navegadores con su propia
+    carpeta de descargas) y une los CSV. Los tramos ya bajados (p. ej. de una corrida que
+    se cortó) no se repiten. `drv` ya logueado en la grilla se usa como primera sesión.
+    Devuelve la ruta del CSV unido, o None si faltó algún tramo.
+    """
+    rangos = rangos or planear_rangos(date_from, date_to, EXPORT_CHUNK or "month")
+    base = os.path.join(DOWNLOAD_DIR, "tramos", os.path.splitext(nombre_export(account_sel, date_from, date_to))[0])
+    os.makedirs(base, exist_ok=True)
+    archivos = {i: os.path.join(base, f"{desde}_{hasta}.csv") for i, (desde, hasta) in enumerate(rangos)}
+    pendientes: "queue.Queue[int]" = queue.Queue()
+    for i in archivos:
+        if not os.path.exists(archivos[i]):
+            pendientes.put(i)
+    faltan = pendientes.qsize()
+    intentos: Dict[int, int] = {}
+    sesiones = min(EXPORT_SESSIONS, faltan)
+    print(f"DEBUG: ▶︎ Export por tramos: {len(rangos)} tramos ({faltan} pendientes) en {sesiones} sesiones")
+
+    def _sesion(n: int, drv_propio: Optional[Chrome]):
+        carpeta = os.path.join(base, f"sesion{n}")
+        os.makedirs(carpeta, exist_ok=True)
+        d = drv_propio
+        try:
+            if d is None:
+                d = crear_driver_csv(carpeta)
+                w = WebDriverWait(d, 30)
+                with _LOGIN_LOCK:
+                    if not _login_hasta_grilla(d, w):
+                        print(f"DEBUG: ❌ Sesión {n}: login fallido, sus tramos quedan para las demás")
+                        return
+                grilla_lista = True
+            else:
+                w = wait or WebDriverWait(d, 30)
+                enable_download_behavior_with_cdp(d, carpeta)
+                grilla_lista = False
+            while True:
+                try:
+                    i = pendientes.get_nowait()
+                except queue.Empty:
+                    return
+                desde, hasta = rangos[i]
+                pedido = {"account": account_sel, "date_from": desde, "date_to": hasta}
+                try:
+                    ok, archivo = _exportar_pedido(d, w, pedido, grilla_lista, carpeta)
+                except Exception as e:
+                    print(f"DEBUG: ❌ Sesión {n}: error exportando {desde} → {hasta}: {e}")
+                    ok, archivo = False, None
+                grilla_lista = False
+                if ok and archivo:
+                    os.replace(archivo, archivos[i])
+                    print(f"DEBUG: ✅ Sesión {n}: tramo {desde} → {hasta} listo")
+                else:
+                    print(f"DEBUG: ❌ Sesión {n}: falló el tramo {desde} → {hasta}")
+                    intentos[i] = intentos.get(i, 0) + 1
+                    if intentos[i] < 2:
+                        pendientes.put(i)  # un reintento, en esta u otra sesión
+        finally:
+            if drv_propio is not None:
+                enable_download_behavior_with_cdp(drv_propio, DOWNLOAD_DIR)
+            elif d is not None:
+                cerrar_navegador(d)
+
+    hilos = [threading.Thread(target=_sesion, args=(n, drv if n == 0 else None), daemon=True, name=f"tramos-{n}")
+             for n in range(sesiones)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    faltantes = [rangos[i] for i in archivos if not os.path.exists(archivos[i])]
+    if faltantes:
+        print(f"DEBUG: ❌ Export por tramos incompleto, faltan: {faltantes} (relanzar retoma desde ahí)")
+        return None
+    destino = os.path.join(DOWNLOAD_DIR, nombre_export(account_sel, date_from, date_to))
+    total = unir_exports([archivos[i] for i in sorted(archivos)], destino)
+    print(f"DEBUG: ✅ {total} movimientos unidos en: {destino}")
+    return destino
+
+# ───────────────────────────── SINCRONIZACIÓN ───────────────────────────────
+def sincronizar(cuentas_sel: str = "*") -> int:
+    """SYNC=1: cada cuenta pide a Lohas solo lo posterior a su marca y lo carga en el store."""
+    store = MovimientosStore()
+    drv = tomar_driver_csv()
+
+    try:
+        wait = WebDriverWait(drv, 30)
+        if not _login_hasta_grilla(drv, wait):
+            return 1
+
+        grilla_lista = True
+        cuentas = [c.strip() for c in (cuentas_sel or "*").split(",") if c.strip()]
+        if cuentas == ["*"]:
+            cuentas = [c["text"] for c in _leer_cuentas(drv)]
+            grilla_lista = False  # el dropdown quedó abierto
+        print(f"DEBUG: ▶︎ Sincronizando {len(cuentas)} cuentas en {store.path}")
+
+        fallidos = 0
+        for n, cuenta in enumerate(cuentas, 1):
+            inicio = datetime.now()
+            desde, hasta = store.rango_pendiente(cuenta, inicio)
+            print(f"TRANSFE_START:{n}")
+            print(f"DEBUG: Cuenta '{cuenta}': pidiendo {desde} → {hasta}")
+            try:
+                ok, archivo = _exportar_pedido(drv, wait, {"account": cuenta, "date_from": desde, "date_to": hasta},
+                                               grilla_lista)
+            except Exception as e:
+                print(f"DEBUG: ❌ Error sincronizando '{cuenta}': {e}")
+                ok, archivo = False, None
+            grilla_lista = False
+            nuevos = actualizados = 0
+            if ok and archivo:
+                destino = os.path.join(DOWNLOAD_DIR, nombre_export(cuenta, desde, hasta))
+                os.replace(archivo, destino)
+                nuevos, actualizados = store.importar_csv(destino, cuenta)
+                store.avanzar_marca(cuenta, inicio)
+                archivo = destino
+                print(f"DEBUG: ✅ '{cuenta}': {nuevos} movimientos nuevos, {actualizados} ya conocidos")
+            else:
+                fallidos += 1  # la marca no avanza: la próxima sincronización repite el rango
+            print(f"TRANSFE_DONE:{n}" if ok and archivo else f"TRANSFE_FAILED:{n}")
+            _orig_print("SYNC_JSON:" + json.dumps({"account": cuenta, "date_from": desde, "date_to": hasta,
+                                                   "ok": bool(ok and archivo), "nuevos": nuevos,
+                                                   "actualizados": actualizados, "file": archivo}, ensure_ascii=True))
+        return 1 if fallidos else 0
+    finally:
+        csv_browser_pool().devolver(drv)
+        store.cerrar()
 
 # ───────────────────────────── CLI ENTRYPOINT ───────────────────────────────
 def main():
+    # Chrome arranca en segundo plano mientras se preparan el resto de las cosas
+    csv_browser_pool()
+    try:
+        _main()
+    finally:
+        csv_browser_pool().cerrar()
+        cerrar_servicio_chromedriver()
+
+
+def _main():
     print("DEBUG: ===== INICIANDO FUNCIÓN main =====")
     print("DEBUG: SCAN_ONLY =", os.getenv("SCAN_ONLY"))
+    print("DEBUG: CSV_WORKER =", os.getenv("CSV_WORKER"))
+    print("DEBUG: EXPORT_BATCH =", os.getenv("EXPORT_BATCH"))
+    print("DEBUG: SYNC =", os.getenv("SYNC"))
     print("DEBUG: DATE_FROM =", os.getenv("DATE_FROM"))
     print("DEBUG: DATE_TO =", os.getenv("DATE_TO"))
     print("DEBUG: HEADLESS =", os.getenv("HEADLESS"))
     print("DEBUG: ACCOUNT_SEL =", os.getenv("ACCOUNT_SEL"))
     print("DEBUG: PYTHONUNBUFFERED =", os.getenv("PYTHONUNBUFFERED"))
     
+    if os.getenv("CSV_WORKER") == "1":     # login único: cuentas + exports por stdin
+        print("DEBUG: Modo CSV_WORKER activado")
+        try: sys.exit(csv_worker())
+        except Exception as e:
+            print(json.dumps({"error": str(e)})); sys.exit(1)
+
+    if os.getenv("SYNC") == "1":           # solo lo nuevo desde la última sincronización
+        print("DEBUG: Modo SYNC activado")
+        try: sys.exit(sincronizar(os.getenv("SYNC_ACCOUNTS", "*")))
+        except Exception as e:
+            print(json.dumps({"error": str(e)})); sys.exit(1)
+
+    if os.getenv("EXPORT_BATCH"):          # lote de exports en un solo login
+        print("DEBUG: Modo EXPORT_BATCH activado")
+        try: sys.exit(exportar_lote(os.getenv("EXPORT_BATCH")))
+        except Exception as e:
+            print(json.dumps({"error": str(e)})); sys.exit(1)
+
     if os.getenv("SCAN_ONLY") == "1":      # sólo listar cuentas
         print("DEBUG: Modo SCAN_ONLY activado")
         try: sys.exit(scan_accounts())
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+conciliacion.py - Cruza las transferencias pedidas (CSV de entrada de bot.py: ID,
+CBU_DESTINO, MONTO) y sus intentos (transfer_logs/*.jsonl o .txt) contra los movimientos
+exportados de la grilla, y dice cuáles se confirmaron, cuáles faltan y cuáles salieron
+repetidas.
+
+El export no trae el CBU destino completo: la contraparte termina en sus 3 últimos
+dígitos ("CLEANPOWER SOLUTIONS SRL362"). La clave de cruce es entonces
+(importe en centavos, 3 últimos dígitos del CBU) en un índice hash, y entre los
+candidatos de una clave gana el más cercano en el tiempo dentro de la ventana.
+Si la contraparte trae el CBU completo, o el CSV de entrada la columna NOMBRE, un
+candidato que no coincide se descarta. Una fallida cuyo movimiento no es el único
+posible (otro candidato libre en su intento, u otra transferencia pedida con la misma
+clave y distinto CBU) va a `ambiguas` para revisarla a mano en lugar de darla por hecha.
+
+Variables de entorno:
+CONCILIACION_VENTANA_SEC (default 900) -> distancia máxima entre el intento registrado en
+                                          el log y el movimiento (misma hora local).
+CONCILIACION_DESFASE_SEC (default 60)   -> intentos con hora de inicio (bot.py los registra):
+                                          el movimiento tiene que caer entre el inicio y el
+                                          fin del intento, con este margen de reloj a cada lado.
+
+Uso: python conciliacion.py transferencias.csv export.csv [export2.csv ...]
+                            [--log transfer_logs/transferencias_X.txt] [--json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from movimientos_columnas import MovimientosColumnas, leer_columnas
+from movimientos_store import parsear_fecha
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+try:
+    CONCILIACION_VENTANA_SEC = max(60, int(os.getenv("CONCILIACION_VENTANA_SEC", "900")))
+except ValueError:
+    CONCILIACION_VENTANA_SEC = 900
+try:
+    CONCILIACION_DESFASE_SEC = max(0, int(os.getenv("CONCILIACION_DESFASE_SEC", "60")))
+except ValueError:
+    CONCILIACION_DESFASE_SEC = 60
+
+# Estados de la grilla que no cuentan como transferencia hecha
+_ESTADOS_RECHAZO = ("rechaz", "anulad", "cancel", "revert")
+_EPOCA = datetime(1970, 1, 1)
+
+
+# ─────────────────────────────── ENTRADAS ────────────────────────────────────
+def centavos(monto: Any) -> Optional[int]:
+    """"20000.00", "$ 1.234,50", 1500 -> centavos. None si no es un número."""
+    t = str(monto).replace("$", "").replace(" ", "").strip()
+    if "," in t:  # formato argentino: punto de miles, coma decimal
+        t = t.replace(".", "").replace(",", ".")
+    try:
+        return int((Decimal(t) * 100).to_integral_value())
+    except InvalidOperation:
+        return None
+
+
+def ultimos3(texto: str) -> str:
+    """3 últimos dígitos de un CBU, o de la contraparte de la grilla ("...SRL362")."""
+    m = re.search(r"(\d{3})\D*$", texto or "")
+    return m.group(1) if m else ""
+
+
+def palabras(texto: str) -> List[str]:
+    """Nombre normalizado para comparar: mayúsculas, sin acentos ni puntos ("S.R.L." = "SRL")."""
+    t = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode("ascii")
+    return re.findall(r"[A-Z0-9]+", t.upper().replace(".", ""))
+
+
+def mismo_nombre(a: List[str], b: List[str]) -> bool:
+    """Mismas palabras en cualquier orden, o una es el comienzo de la otra (la grilla recorta nombres largos)."""
+    ta, tb = " ".join(a), " ".join(b)
+    return set(a) <= set(b) or set(b) <= set(a) or ta.startswith(tb) or tb.startswith(ta)
+
+
+def segundos(fecha: Optional[str]) -> Optional[int]:
+    """"dd/mm/YYYY HH:MM:SS" a segundos desde 1970, en la misma base que MovimientosColumnas."""
+    dt = parsear_fecha(fecha) if fecha else None
+    return int((dt - _EPOCA).total_seconds()) if dt else None
+
+
+def leer_transferencias(path: str) -> List[Dict[str, Any]]:
+    """Filas del CSV de entrada de bot.py; `n` es el número con que bot.py las registra en el log."""
+    salida = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for n, fila in enumerate(csv.DictReader(f), start=1):
+            if not fila.get("CBU_DESTINO") or not fila.get("MONTO"):
+                continue
+            salida.append({"n": n, "id": (fila.get("ID") or "").strip(), "cbu_destino": fila["CBU_DESTINO"].strip(),
+                           "monto": fila["MONTO"].strip(), "nombre": (fila.get("NOMBRE") or "").strip()})
+    return salida
+
+
+_BLOQUE_TXT = re.compile(
+    r"Transferencia #(?P<n>\d+): (?P<estado>\S+)\s*\n"
+    r"(?:\s*ID:\s*(?P<id>.*)\n)?"
+    r"\s*CBU de ORIGEN:\s*(?P<cbu_origen>.*)\n"
+    r"\s*CBU de DESTINO:\s*(?P<cbu_destino>.*)\n"
+    r"\s*MONTO:\s*\$?(?P<monto>.*)\n"
+    r"\s*Fecha/Hora:\s*(?P<fecha>.*)\n")
+
+
+def leer_log(path: str) -> List[Dict[str, Any]]:
+    """
+    Intentos registrados por bot.py. Usa el .jsonl (trae también los fallidos) si existe;
+    si no, interpreta el .txt de log_transfer (solo completadas).
+    """
+    jsonl = os.path.splitext(path)[0] + ".jsonl"
+    if os.path.exists(jsonl):
+        with open(jsonl, encoding="utf-8") as f:
+            return [json.loads(linea) for linea in f if linea.strip()]
+    with open(path, encoding="utf-8") as f:
+        texto = f.read()
+    return [{**{k: (v or "").strip() for k, v in m.groupdict().items()}, "n": int(m.group("n"))}
+            for m in _BLOQUE_TXT.finditer(texto)]
+
+
+def esperadas(transferencias: List[Dict[str, Any]], intentos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Una entrada por transferencia a verificar, con su último intento registrado (estado y
+    hora) y las ventanas [inicio, fin] de los intentos que traen hora de inicio.
+    Sin CSV de entrada se verifican las que el log da por completadas.
+    """
+    ultimo: Dict[int, Dict[str, Any]] = {}
+    completado: Dict[int, Dict[str, Any]] = {}
+    ventanas: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for it in intentos:
+        ultimo[int(it["n"])] = it
+        if it.get("estado") == "COMPLETADA":
+            completado[int(it["n"])] = it
+        inicio, fin = segundos(it.get("inicio")), segundos(it.get("fecha"))
+        if inicio is not None and fin is not None:
+            ventanas[int(it["n"])].append((inicio, fin))
+    base = transferencias or [{"n": int(it["n"]), "id": it.get("id", ""), "cbu_destino": it["cbu_destino"],
+                               "monto": it["monto"]} for it in completado.values()]
+    salida = []
+    for t in base:
+        it = completado.get(t["n"]) or ultimo.get(t["n"]) or {}
+        salida.append({**t, "nombre": t.get("nombre", ""),
+                       "monto_cent": centavos(t["monto"]), "clave3": ultimos3(t["cbu_destino"]),
+                       "estado_log": it.get("estado"), "ts": segundos(it.get("fecha")),
+                       "ventanas": ventanas.get(t["n"], [])})
+    return salida
+
+
+# ─────────────────────────────── CRUCE ───────────────────────────────────────
+class IndiceMovimientos:
+    """
+    Movimientos salientes indexados por (centavos, 3 últimos dígitos de la contraparte);
+    de cada contraparte distinta se guarda además el CBU completo (si lo trae) y el nombre.
+    """
+
+    def __init__(self, cols: MovimientosColumnas):
+        self.cols = cols
+        self.ids = cols.ids.tolist()  # ints de Python (ndarray o array.array)
+        self.segundos = cols.segundos.tolist()
+        self.estados = [cols.valores["estado"][k] for k in cols.codigos["estado"]]
+        self.contraparte = cols.codigos["contraparte"].tolist()
+        contrapartes = cols.valores["contraparte"]
+        clave3 = [ultimos3(c) for c in contrapartes]  # una vez por contraparte distinta
+        self.cbus = [(re.findall(r"\d{22}", c or "") or [""])[-1] for c in contrapartes]
+        self.nombres = [palabras(re.sub(r"\d+\W*$", "", re.sub(r"\d{22}", " ", c or ""))) for c in contrapartes]
+        self.indice: Dict[Tuple[int, str], List[int]] = defaultdict(list)
+        for i, (imp, k) in enumerate(zip(cols.importes.tolist(), self.contraparte)):
+            if imp < 0:
+                self.indice[(-imp, clave3[k])].append(i)
+        for filas in self.indice.values():
+            filas.sort(key=self.segundos.__getitem__)
+
+    def candidatos(self, cent: Optional[int], clave3: str) -> List[int]:
+        return self.indice.get((cent, clave3), []) if cent is not None and clave3 else []
+
+    def identidad(self, i: int, cbu: str, nombre: str) -> Optional[bool]:
+        """
+        ¿El movimiento `i` fue a ese CBU/titular? True/False según el CBU completo o, si el
+        export no lo trae, el nombre; None si no hay con qué comparar (solo la clave).
+        """
+        k = self.contraparte[i]
+        if self.cbus[k] and len(cbu) == 22:
+            return self.cbus[k] == cbu
+        if self.nombres[k] and nombre:
+            return mismo_nombre(self.nombres[k], palabras(nombre))
+        return None
+
+    def movimiento(self, i: int) -> Dict[str, Any]:
+        return {"movimiento_id": self.ids[i], "estado_mov": self.estados[i],
+                "fecha_mov": (_EPOCA + timedelta(seconds=self.segundos[i])).strftime("%d/%m/%Y %H:%M:%S")}
+
+
+def _rechazado(estado: str) -> bool:
+    e = (estado or "").lower()
+    return any(r in e for r in _ESTADOS_RECHAZO)
+
+
+def conciliar(transferencias: List[Dict[str, Any]], movimientos: MovimientosColumnas,
+              intentos: Optional[List[Dict[str, Any]]] = None,
+              ventana: int = CONCILIACION_VENTANA_SEC,
+              desfase: int = CONCILIACION_DESFASE_SEC) -> Dict[str, Any]:
+    """
+    Reporte:
+    - confirmadas: con su movimiento (las que el log daba por fallidas van además en
+      `ejecutadas_sin_registro`: se hicieron aunque bot.py no lo supo).
+    - faltantes: sin movimiento (`estado_log` dice si bot.py las dio por completadas).
+    - rechazadas: el único movimiento que coincide está rechazado/anulado en Lohas.
+    - duplicadas: además del movimiento asignado hay otro igual dentro de la ventana.
+    - ambiguas: el log no las da por completadas y su movimiento no es el único posible
+      (otro candidato libre, u otra transferencia pedida con la misma clave a otro CBU que
+      el export no permite distinguir). No se confirman: van con sus `candidatos`.
+    Si los intentos traen "inicio", el movimiento tiene que caer dentro de alguno de ellos
+    (± desfase); si no, a ± ventana de la hora registrada. Un movimiento cuyo CBU completo
+    o nombre no coincide con el de la transferencia no es candidato.
+    """
+    idx = IndiceMovimientos(movimientos)
+    pendientes = esperadas(transferencias, intentos or [])
+    usados: Dict[int, int] = {}  # fila del export -> n de la transferencia
+    asignado: Dict[int, int] = {}
+    dudosos: Dict[int, List[int]] = {}  # n -> candidatos, si el asignado no es el único posible
+    cbus_por_clave: Dict[Tuple[Optional[int], str], set] = defaultdict(set)
+    for e in pendientes:
+        cbus_por_clave[(e["monto_cent"], e["clave3"])].add(e["cbu_destino"])
+
+    def coincide(i: int, e: Dict[str, Any]) -> bool:
+        return idx.identidad(i, e["cbu_destino"], e["nombre"]) is not False
+
+    # primero las que tienen hora (más restringidas) y, entre ellas, las que el log da por
+    # completadas: un intento fallido anterior no les gana su movimiento; después cronológico
+    orden = sorted(pendientes, key=lambda e: (e["ts"] is None, e["estado_log"] != "COMPLETADA", e["ts"] or 0, e["n"]))
+    for e in orden:
+        libres = [i for i in idx.candidatos(e["monto_cent"], e["clave3"]) if i not in usados and coincide(i, e)]
+        if e["ventanas"]:
+            libres = [i for i in libres
+                      if any(ini - desfase <= idx.segundos[i] <= fin + desfase for ini, fin in e["ventanas"])]
+        elif e["ts"] is not None:
+            libres = [i for i in libres if abs(idx.segundos[i] - e["ts"]) <= ventana]
+        # un movimiento ejecutado antes que uno rechazado; después el más cercano en el tiempo
+        mejor = min(libres, default=None, key=lambda i: (_rechazado(idx.estados[i]),
+                                                         abs(idx.segundos[i] - (e["ts"] or idx.segundos[i]))))
+        if mejor is not None:
+            usados[mejor] = e["n"]
+            asignado[e["n"]] = mejor
+            validos = [i for i in libres if not _rechazado(idx.estados[i])]
+            otro_cbu = len(cbus_por_clave[(e["monto_cent"], e["clave3"])]) > 1 \
+                and idx.identidad(mejor, e["cbu_destino"], e["nombre"]) is None
+            if len(validos) > 1 or otro_cbu:
+                dudosos[e["n"]] = validos or [mejor]
+
+    reporte: Dict[str, List[Dict[str, Any]]] = {k: [] for k in
+                                                 ("confirmadas", "faltantes", "rechazadas", "duplicadas",
+                                                  "ejecutadas_sin_registro", "ambiguas")}
+    for e in sorted(pendientes, key=lambda e: e["n"]):
+        fila = {k: e[k] for k in ("n", "id", "cbu_destino", "monto", "estado_log")}
+        i = asignado.get(e["n"])
+        if i is None:
+            reporte["faltantes"].append(fila)
+            continue
+        fila.update(idx.movimiento(i))
+        if _rechazado(idx.estados[i]):
+            reporte["rechazadas"].append(fila)
+            continue
+        if e["estado_log"] not in (None, "COMPLETADA") or (intentos and e["estado_log"] is None):
+            if e["n"] in dudosos:
+                reporte["ambiguas"].append({**fila, "candidatos": [idx.ids[j] for j in dudosos[e["n"]]]})
+                continue
+            reporte["ejecutadas_sin_registro"].append(fila)
+        reporte["confirmadas"].append(fila)
+        extras = [j for j in idx.candidatos(e["monto_cent"], e["clave3"])
+                  if j not in usados and not _rechazado(idx.estados[j]) and coincide(j, e)
+                  and abs(idx.segundos[j] - idx.segundos[i]) <= ventana]
+        if extras:
+            for j in extras:
+                usados[j] = e["n"]
+            reporte["duplicadas"].append({**fila, "repetidos": [idx.ids[j] for j in extras]})
+
+    return {"total": len(pendientes), **{k: len(v) for k, v in reporte.items()}, "detalle": reporte}
+
+
+def _imprimir(reporte: Dict[str, Any]):
+    print(f"Transferencias: {reporte['total']} — confirmadas {reporte['confirmadas']}, "
+          f"faltantes {reporte['faltantes']}, rechazadas {reporte['rechazadas']}, "
+          f"duplicadas {reporte['duplicadas']}, ejecutadas sin registro {reporte['ejecutadas_sin_registro']}, "
+          f"ambiguas {reporte['ambiguas']}")
+    for clave in ("faltantes", "rechazadas", "duplicadas", "ejecutadas_sin_registro", "ambiguas"):
+        for fila in reporte["detalle"][clave]:
+            extra = f" mov {fila.get('movimiento_id')}" if fila.get("movimiento_id") else ""
+            if fila.get("repetidos"):
+                extra += f" repetidos {fila['repetidos']}"
+            if fila.get("candidatos"):
+                extra += f" candidatos {fila['candidatos']}"
+            print(f"  [{clave}] #{fila['n']} ID {fila['id'] or '-'} → {fila['cbu_destino']} ${fila['monto']}"
+                  f" (log: {fila['estado_log'] or 'sin registro'}){extra}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Concilia transferencias de bot.py contra exports de la grilla.")
+    ap.add_argument("transferencias", help="CSV de entrada de bot.py (ID, CBU_DESTINO, MONTO[, NOMBRE])")
+    ap.add_argument("exports", nargs="+", help="CSV exportados de grid_movimientos_cuenta_usuario")
+    ap.add_argument("--log", help="log de transfer_logs (.txt o .jsonl) de la corrida")
+    ap.add_argument("--json", action="store_true", help="reporte completo en JSON")
+    args = ap.parse_args()
+
+    reporte = conciliar(leer_transferencias(args.transferencias), leer_columnas(args.exports),
+                        leer_log(args.log) if args.log else None)
+    if args.json:
+        print(json.dumps(reporte, ensure_ascii=False, indent=1))
+    else:
+        _imprimir(reporte)
+    sys.exit(1 if reporte["faltantes"] or reporte["duplicadas"] or reporte["ambiguas"] else 0)
@@ -5,6 +5,13 @@ flask_server.py - Lanza "Bot Transferencias" (sin fechas) o "Bot CSV" (con
 dialogo de fechas). Las fechas elegidas se envian al bot CSV mediante
 DATE_FROM / DATE_TO. Incluye visor de logs, seguimiento de jobs y un
 "mini-scan" de cuentas (SCAN_ONLY).
+
+Con CSV_WORKER_MODE=1 (default) el scan de cuentas arranca bot_csv.py como worker:
+el mismo navegador logueado que listo las cuentas recibe por stdin la cuenta
+y fechas elegidas y exporta sin un segundo login + OTP. Si el worker no esta
+disponible (se cerro por inactividad, esta ocupado, etc.) se lanza bot_csv.py
+como antes (con CSV_WORKER=0 explicito, para que un CSV_WORKER=1 en .env no lo
+deje esperando pedidos por stdin).
 """
 
 import os, sys, uuid, time, subprocess, threading, json
@@ -12,6 +19,7 @@ from pathlib import Path
 from threading import Thread
 from flask import Flask, request, jsonify, render_template_string
 from dotenv import load_dotenv, set_key, find_dotenv
+from session_store import iniciar_keepalive
 
 APP = Flask(__name__)
 
@@ -33,6 +41,11 @@ LOGS_DIR = Path("run_logs"); LOGS_DIR.mkdir(exist_ok=True)
 JOBS: dict[str, dict] = {}
 FILE_HANDLES: dict[str, object] = {}
 
+CSV_WORKER_MODE = os.getenv("CSV_WORKER_MODE", "1").lower() not in ("0", "false", "no")
+# Worker bot_csv vivo: proceso, cuentas que listo y job al que van sus lineas de salida
+CSV_WORKER: dict = {"proc": None, "accounts": None, "job_id": None}
+CSV_WORKER_LOCK = threading.Lock()
+
 # ───────────────────────────────  HTML UI  ───────────────────────────────────
 SETUP_HTML = """<!doctype html>
 <html><head>
@@ -460,8 +473,12 @@ def run_job():
     fh = open(LOGS_DIR/f"{job_id}.log", "a", buffering=1, encoding="utf-8")
     FILE_HANDLES[job_id]=fh
 
+    if job_type=="csv" and send_to_csv_worker(job_id, fh, data):
+        return jsonify({"job_id": job_id})
+
     env = {**os.environ, "PYTHONUNBUFFERED":"1", "PYTHONIOENCODING":"utf-8"}
     if job_type=="csv":
+        env["CSV_WORKER"]="0"  # export de una vez, no worker por stdin
         if data.get("date_from") and data.get("date_to"):
             env["DATE_FROM"]=data["date_from"]; env["DATE_TO"]=data["date_to"]
         if data.get("account"): env["ACCOUNT_SEL"]=data["account"]
@@ -482,6 +499,85 @@ def logs(job_id):
     if not lp.exists(): return ("log?",404)
     return (lp.read_text(errors="ignore")[-20000:],200,{"Content-Type":"text/plain"})
 
+# ───────────────────── WORKER CSV (login unico scan + export) ─────────────────
+def _close_job_log(job_id):
+    fh = FILE_HANDLES.pop(job_id, None)
+    if fh:
+        try: fh.close()
+        except: pass
+
+def _csv_worker_reader(proc: subprocess.Popen):
+    """Reparte la salida del worker: log del job en curso, cuentas y fin de cada export."""
+    for line in proc.stdout:
+        with CSV_WORKER_LOCK:
+            job_id = CSV_WORKER["job_id"] if CSV_WORKER["proc"] is proc else None
+        fh = FILE_HANDLES.get(job_id) if job_id else None
+        if fh:
+            try: fh.write(line)
+            except: pass
+        if not job_id: continue
+        if line.startswith("ACCOUNTS_JSON:"):
+            try: accounts = json.loads(line[len("ACCOUNTS_JSON:"):]).get("accounts", [])
+            except Exception as e:
+                if fh: fh.write(f"\n[parse error] {e}")
+                continue
+            with CSV_WORKER_LOCK:
+                CSV_WORKER.update(accounts=accounts, job_id=None)
+            write_job_update(job_id, status="ready", accounts=accounts)
+            _close_job_log(job_id)
+        elif line.startswith("EXPORT_JSON:"):
+            try: res = json.loads(line[len("EXPORT_JSON:"):])
+            except Exception: res = {}
+            with CSV_WORKER_LOCK:
+                CSV_WORKER["job_id"] = None
+            write_job_update(job_id, status="finished" if res.get("ok") else "failed",
+                             finished_at=time.time(), returncode=0 if res.get("ok") else 1,
+                             file=res.get("file"))
+            _close_job_log(job_id)
+    rc = proc.wait()
+    with CSV_WORKER_LOCK:
+        job_id = CSV_WORKER["job_id"] if CSV_WORKER["proc"] is proc else None
+        if CSV_WORKER["proc"] is proc:
+            CSV_WORKER.update(proc=None, accounts=None, job_id=None)
+    if job_id:  # murio con un scan o export a medio camino
+        write_job_update(job_id, status="failed", error="csv worker exited",
+                         finished_at=time.time(), returncode=rc)
+        _close_job_log(job_id)
+
+def start_csv_worker(job_id: str) -> bool:
+    """Lanza bot_csv.py en modo worker; sus cuentas resuelven el scan `job_id`."""
+    env = {**os.environ, "PYTHONUNBUFFERED":"1", "PYTHONIOENCODING":"utf-8", "CSV_WORKER":"1"}
+    try:
+        proc = subprocess.Popen([sys.executable,"-u","bot_csv.py"], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, bufsize=1, encoding="utf-8", errors="replace", env=env)
+    except Exception as e:
+        write_job_update(job_id, status="failed", error=f"csv worker: {e}"); return False
+    with CSV_WORKER_LOCK:
+        CSV_WORKER.update(proc=proc, accounts=None, job_id=job_id)
+    write_job_update(job_id, pid=proc.pid)
+    Thread(target=_csv_worker_reader, args=(proc,), daemon=True).start()
+    return True
+
+def send_to_csv_worker(job_id: str, fh, data: dict) -> bool:
+    """Pasa el export al worker si esta vivo y libre; False -> lanzar bot_csv.py como antes."""
+    if not (CSV_WORKER_MODE and data.get("account") and data.get("date_from") and data.get("date_to")):
+        return False
+    with CSV_WORKER_LOCK:
+        proc = CSV_WORKER["proc"]
+        if proc is None or proc.poll() is not None or CSV_WORKER["accounts"] is None or CSV_WORKER["job_id"]:
+            return False
+        pedido = {"id": job_id, "account": data["account"],
+                  "date_from": data["date_from"], "date_to": data["date_to"]}
+        try:
+            proc.stdin.write(json.dumps(pedido) + "\n"); proc.stdin.flush()
+        except (OSError, ValueError):
+            return False
+        CSV_WORKER["job_id"] = job_id
+    write_job_update(job_id, status="running", pid=proc.pid, started_at=time.time(),
+                     logfile=str(fh.name), worker=True)
+    return True
+
 # ─────────────────────── SCAN DE CUENTAS (SCAN_ONLY) ────────────────────────
 def start_account_scan_job():
     job_id = uuid.uuid4().hex
@@ -489,9 +585,20 @@ def start_account_scan_job():
     fh = open(LOGS_DIR/f"{job_id}.scan.log", "a", buffering=1, encoding="utf-8")
     FILE_HANDLES[job_id]=fh
 
+    if CSV_WORKER_MODE:
+        with CSV_WORKER_LOCK:
+            proc, accounts, busy = CSV_WORKER["proc"], CSV_WORKER["accounts"], CSV_WORKER["job_id"]
+        if proc is not None and proc.poll() is None and accounts is not None and not busy:
+            # worker ya logueado y libre: mismas cuentas, sin otro login
+            JOBS[job_id].update(status="ready", accounts=accounts); _close_job_log(job_id)
+            return job_id
+        if proc is None or proc.poll() is not None:
+            if start_csv_worker(job_id): return job_id
+            _close_job_log(job_id); return job_id
+
     def _run():
         try:
-            env = {**os.environ,"PYTHONUNBUFFERED":"1","SCAN_ONLY":"1"}  # no forzamos HEADLESS
+            env = {**os.environ,"PYTHONUNBUFFERED":"1","SCAN_ONLY":"1","CSV_WORKER":"0"}  # no forzamos HEADLESS
             proc = subprocess.Popen([sys.executable,"-u","bot_csv.py"],
                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                                     text=True, env=env)
@@ -583,6 +690,9 @@ def stop_all():
             subprocess.run(["killall", "-9", "chromedriver"], capture_output=True)
             subprocess.run(["pkill", "-9", "-f", "chromedriver"], capture_output=True)
         
+        with CSV_WORKER_LOCK:
+            CSV_WORKER.update(proc=None, accounts=None, job_id=None)
+
         # Limpiar todos los jobs
         for job_id in list(JOBS.keys()):
             fh = FILE_HANDLES.pop(job_id, None)
@@ -599,4 +709,6 @@ def stop_all():
 
 # ───────────────────────────────  MAIN  ──────────────────────────────────────
 if __name__ == "__main__":
+    # Mantener viva entre jobs la sesión de Lohas guardada por los bots (SESSION_KEEPALIVE_SEC)
+    iniciar_keepalive(os.getenv("LOHAS_BASE_URL", "https://app.lohas.eco").rstrip("/") + "/form_transferencias/")
     APP.run(host="0.0.0.0", port=int(os.environ.get("PORT",5001)), debug=False)
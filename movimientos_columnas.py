@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+movimientos_columnas.py - Lectura por columnas de los CSV de grid_movimientos_cuenta_usuario
+y totales agrupados (por contraparte, día, estado, cuenta origen...) para conciliar
+exports de cientos de miles de movimientos en segundos.
+
+El archivo se lee en bloques (no se carga entero) y cada bloque se normaliza de una vez:
+- ID "63.709" -> 63709, importe "-1.234,50 " -> -123450 centavos (enteros, sin floats).
+- "dd/mm/YYYY HH:MM:SS" -> segundos desde 1970 (hora local de Lohas, sin zona).
+- Textos repetidos (contraparte, estado, cuenta...) -> códigos enteros + lista de valores.
+
+Con NumPy (opcional, pip install numpy) las columnas son ndarrays y fechas / agrupaciones se calculan
+vectorizadas; sin NumPy se usan array.array y el mismo resultado sale en Python puro.
+
+Uso: python movimientos_columnas.py export1.csv [export2.csv ...]  -> resumen JSON
+"""
+
+from __future__ import annotations
+
+import codecs
+import csv
+import json
+import sys
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+try:
+    import numpy as np
+except ImportError:  # dependencia opcional
+    np = None
+
+from movimientos_store import parsear_fecha
+
+# Columnas del export (sin encabezado) y cuáles son texto categórico
+COLUMNAS = ("id", "fecha", "titular", "contraparte", "moneda", "importe", "tipo", "estado", "cuenta")
+CATEGORICAS = ("titular", "contraparte", "moneda", "tipo", "estado", "cuenta")
+AGRUPABLES = CATEGORICAS + ("dia",)
+
+BLOQUE_FILAS = 65536
+_EPOCA = date(1970, 1, 1).toordinal()
+
+
+def _encoding(path: str) -> str:
+    """UTF-8 si el primer MB decodifica como tal, si no latin-1 (exports viejos de Scriptcase)."""
+    with open(path, "rb") as f:
+        crudo = f.read(1 << 20)
+    try:
+        codecs.getincrementaldecoder("utf-8-sig")().decode(crudo, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def _bloques(path: str, filas: int = BLOQUE_FILAS) -> Iterator[List[List[str]]]:
+    with open(path, newline="", encoding=_encoding(path)) as f:
+        bloque = []
+        for fila in csv.reader(f, delimiter=";"):
+            if len(fila) < len(COLUMNAS) or not fila[0].strip()[:1].isdigit():
+                continue  # línea vacía o encabezado
+            bloque.append(fila)
+            if len(bloque) >= filas:
+                yield bloque
+                bloque = []
+        if bloque:
+            yield bloque
+
+
+# ─────────────────────────── NORMALIZACIÓN POR BLOQUE ────────────────────────
+def _centavos(texto: str) -> int:
+    t = texto.replace(".", "").strip()
+    negativo = t[:1] == "-"
+    entero, _, decimales = t.lstrip("+-").partition(",")
+    try:
+        valor = int(entero or 0) * 100 + int((decimales + "00")[:2])
+    except ValueError:
+        return 0
+    return -valor if negativo else valor
+
+
+def _segundos_py(textos: List[str]) -> List[int]:
+    dias: Dict[str, int] = {}
+    salida = []
+    for t in textos:
+        t = t.strip()
+        if len(t) == 19 and t[2] == "/" and t[5] == "/" and t[13] == ":":
+            d = dias.get(t[:10])
+            if d is None:
+                d = dias[t[:10]] = date(int(t[6:10]), int(t[3:5]), int(t[:2])).toordinal() - _EPOCA
+            salida.append(d * 86400 + int(t[11:13]) * 3600 + int(t[14:16]) * 60 + int(t[17:19]))
+        else:
+            fecha = parsear_fecha(t)
+            salida.append(int((fecha - datetime(1970, 1, 1)).total_seconds()) if fecha else 0)
+    return salida
+
+
+def _segundos_np(textos: List[str]):
+    """"dd/mm/YYYY HH:MM:SS" en bloque: bytes -> dígitos -> días civiles (Hinnant) sin loops."""
+    limpios = [t.strip() for t in textos]
+    try:
+        crudos = np.array(limpios, dtype="S19")
+    except UnicodeEncodeError:
+        return np.array(_segundos_py(limpios), dtype=np.int64)
+    largos = np.fromiter((len(t) for t in limpios), dtype=np.int64, count=len(limpios))
+    b = crudos.view(np.uint8).reshape(-1, 19).astype(np.int64) - 48
+
+    def num(desde, hasta):
+        v = np.zeros(len(crudos), dtype=np.int64)
+        for i in range(desde, hasta):
+            v = v * 10 + b[:, i]
+        return v
+
+    d, m, y = num(0, 2), num(3, 5), num(6, 10)
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + np.where(m > 2, -3, 9)) + 2) // 5 + d - 1
+    dias = era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+    segundos = dias * 86400 + num(11, 13) * 3600 + num(14, 16) * 60 + num(17, 19)
+    raros = np.nonzero((largos != 19) | (b[:, 2] != ord("/") - 48) | (b[:, 13] != ord(":") - 48))[0]
+    if len(raros):
+        segundos[raros] = _segundos_py([limpios[i] for i in raros])
+    return segundos
+
+
+# ─────────────────────────────── COLUMNAS ────────────────────────────────────
+class MovimientosColumnas:
+    """
+    Movimientos en columnas: ids, segundos, importes (centavos) y, por cada columna de
+    CATEGORICAS, códigos enteros en `codigos[col]` con sus textos en `valores[col]`.
+    """
+
+    def __init__(self):
+        self.valores: Dict[str, List[str]] = {c: [] for c in CATEGORICAS}
+        self._indices: Dict[str, Dict[str, int]] = {c: {} for c in CATEGORICAS}
+        self._partes: Dict[str, list] = {c: [] for c in ("id", "segundos", "importe") + CATEGORICAS}
+        self.ids = self.segundos = self.importes = None
+        self.codigos: Dict[str, object] = {}
+
+    def agregar_bloque(self, filas: List[List[str]]):
+        cols = list(zip(*filas))
+        ids = [int(t.replace(".", "") or 0) for t in cols[0]]
+        if np is not None:
+            try:
+                # "-1.234,50 " -> "-1234.50": float64 es exacto hasta ~15 dígitos, rint a centavos
+                importes = np.rint(np.array([t.replace(".", "").replace(",", ".").strip() or "0" for t in cols[5]],
+                                            dtype=np.float64) * 100).astype(np.int64)
+            except ValueError:
+                importes = np.fromiter((_centavos(t) for t in cols[5]), dtype=np.int64, count=len(filas))
+            self._partes["id"].append(np.array(ids, dtype=np.int64))
+            self._partes["segundos"].append(_segundos_np(list(cols[1])))
+            self._partes["importe"].append(importes)
+        else:
+            self._partes["id"].append(array("q", ids))
+            self._partes["segundos"].append(array("q", _segundos_py(list(cols[1]))))
+            self._partes["importe"].append(array("q", (_centavos(t) for t in cols[5])))
+        for c in CATEGORICAS:
+            indice = self._indices[c]
+            codigos = [indice.setdefault(t, len(indice)) for t in map(str.strip, cols[COLUMNAS.index(c)])]
+            self._partes[c].append(np.array(codigos, dtype=np.int32) if np is not None else array("i", codigos))
+
+    def cerrar(self) -> "MovimientosColumnas":
+        """Une los bloques en una columna contigua por campo."""
+        def unir(partes, tipo: str):
+            if np is not None:
+                return np.concatenate(partes) if partes else np.zeros(0, dtype=np.int64 if tipo == "q" else np.int32)
+            salida = array(tipo)
+            for p in partes:
+                salida.extend(p)
+            return salida
+
+        self.ids = unir(self._partes["id"], "q")
+        self.segundos = unir(self._partes["segundos"], "q")
+        self.importes = unir(self._partes["importe"], "q")
+        self.codigos = {c: unir(self._partes[c], "i") for c in CATEGORICAS}
+        self.valores = {c: list(self._indices[c]) for c in CATEGORICAS}  # código = orden de aparición
+        self._partes = {c: [] for c in self._partes}
+        return self
+
+    def __len__(self) -> int:
+        return len(self.ids) if self.ids is not None else 0
+
+    def _claves(self, por: str):
+        """(códigos por fila, etiqueta de cada código) para agrupar por `por`."""
+        if por == "dia":
+            if np is not None:
+                dias = self.segundos // 86400
+                unicos, codigos = np.unique(dias, return_inverse=True)
+                etiquetas = [(date.fromordinal(_EPOCA) + timedelta(days=int(d))).isoformat() for d in unicos]
+                return codigos, etiquetas
+            indice: Dict[int, int] = {}
+            codigos = array("i", (indice.setdefault(s // 86400, len(indice)) for s in self.segundos))
+            etiquetas = [(date.fromordinal(_EPOCA) + timedelta(days=d)).isoformat() for d in indice]
+            return codigos, etiquetas
+        if por not in CATEGORICAS:
+            raise ValueError(f"no se puede agrupar por {por!r} (opciones: {', '.join(AGRUPABLES)})")
+        return self.codigos[por], self.valores[por]
+
+    def totales(self, por: str) -> List[Dict[str, object]]:
+        """
+        Por cada valor de `por`: cantidad de movimientos, total, ingresos y egresos en
+        centavos. Ordenado por total absoluto descendente (por fecha si `por` es "dia").
+        """
+        codigos, etiquetas = self._claves(por)
+        n = len(etiquetas)
+        if np is not None:
+            cantidad = np.bincount(codigos, minlength=n)
+            positivos = np.where(self.importes > 0, self.importes, 0)
+            negativos = self.importes - positivos
+            # sumas enteras exactas (bincount con pesos pasaría por float64)
+            ingresos = np.zeros(n, dtype=np.int64)
+            egresos = np.zeros(n, dtype=np.int64)
+            np.add.at(ingresos, codigos, positivos)
+            np.add.at(egresos, codigos, negativos)
+            filas = zip(etiquetas, cantidad.tolist(), ingresos.tolist(), egresos.tolist())
+        else:
+            cantidad, ingresos, egresos = [0] * n, [0] * n, [0] * n
+            for k, v in zip(codigos, self.importes):
+                cantidad[k] += 1
+                if v > 0:
+                    ingresos[k] += v
+                else:
+                    egresos[k] += v
+            filas = zip(etiquetas, cantidad, ingresos, egresos)
+        salida = [{por: e, "cantidad": c, "total_cent": i + g, "ingresos_cent": i, "egresos_cent": g}
+                  for e, c, i, g in filas]
+        if por == "dia":
+            return sorted(salida, key=lambda r: r["dia"])
+        return sorted(salida, key=lambda r: (-abs(r["total_cent"]), str(r[por])))
+
+    def resumen(self, por: Iterable[str] = ("contraparte", "dia", "estado", "cuenta")) -> Dict[str, object]:
+        return {"movimientos": len(self), "total_cent": int(sum(self.importes)) if len(self) else 0,
+                **{p: self.totales(p) for p in por}}
+
+
+def leer_columnas(paths: Union[str, Iterable[str]], filas_por_bloque: int = BLOQUE_FILAS) -> MovimientosColumnas:
+    """Uno o varios exports de la grilla -> MovimientosColumnas (leídos en bloques)."""
+    cols = MovimientosColumnas()
+    for path in ([paths] if isinstance(paths, str) else paths):
+        for bloque in _bloques(path, filas_por_bloque):
+            cols.agregar_bloque(bloque)
+    return cols.cerrar()
+
+
+def _importe_texto(cent: Optional[int]) -> str:
+    cent = cent or 0
+    return f"{'-' if cent < 0 else ''}{abs(cent) // 100},{abs(cent) % 100:02d}"
+
+
+def columnas_desde_store(filas: Iterable[Mapping[str, Any]], filas_por_bloque: int = BLOQUE_FILAS) -> MovimientosColumnas:
+    """Filas de MovimientosStore.movimientos() -> MovimientosColumnas, como si vinieran del export."""
+    cols = MovimientosColumnas()
+    bloque = []
+    for f in filas:
+        bloque.append([str(f["id"]), datetime.fromisoformat(f["fecha"]).strftime("%d/%m/%Y %H:%M:%S"),
+                       f["titular"] or "", f["contraparte"] or "", f["moneda"] or "", _importe_texto(f["importe_cent"]),
+                       f["tipo"] or "", f["estado"] or "", f["cuenta"] or ""])
+        if len(bloque) >= filas_por_bloque:
+            cols.agregar_bloque(bloque)
+            bloque = []
+    if bloque:
+        cols.agregar_bloque(bloque)
+    return cols.cerrar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("uso: python movimientos_columnas.py export.csv [export2.csv ...]")
+        sys.exit(2)
+    print(json.dumps(leer_columnas(sys.argv[1:]).resumen(), ensure_ascii=False, indent=1))
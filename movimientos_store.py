@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+movimientos_store.py - Movimientos de Lohas en SQLite, alimentados desde los CSV de
+grid_movimientos_cuenta_usuario, con una marca de "sincronizado hasta" por cuenta para
+que bot_csv (SYNC=1) solo pida a Lohas lo nuevo.
+
+Variables de entorno:
+MOVIMIENTOS_DB (default ./movimientos.sqlite3) -> archivo SQLite.
+SYNC_DIAS_INICIALES (default 30)               -> cuenta sin marca: días hacia atrás que
+                                                  baja la primera sincronización.
+
+Formato del CSV (sin encabezado, ";" y todo entre comillas):
+"63.709";"02/10/2025 12:12:58";"BPMUP SRL";"CLEANPOWER SOLUTIONS SRL362";"PES";"-100,00 ";
+"Transferencia saliente";"Ejecutado";"BPMUP SRL871 - 0000155300000000000871"
+"""
+
+from __future__ import annotations
+
+import csv
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+MOVIMIENTOS_DB = os.getenv("MOVIMIENTOS_DB", os.path.join(os.getcwd(), "movimientos.sqlite3"))
+try:
+    SYNC_DIAS_INICIALES = max(1, int(os.getenv("SYNC_DIAS_INICIALES", "30")))
+except ValueError:
+    SYNC_DIAS_INICIALES = 30
+
+COLUMNAS = ("id", "fecha", "titular", "contraparte", "moneda", "importe", "tipo", "estado", "cuenta")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS movimientos (
+    id              INTEGER PRIMARY KEY,   -- "63.709" -> 63709
+    fecha           TEXT NOT NULL,         -- ISO, ordena como texto
+    titular         TEXT,
+    contraparte     TEXT,
+    moneda          TEXT,
+    importe_cent    INTEGER,               -- "-100,00 " -> -10000
+    tipo            TEXT,
+    estado          TEXT,
+    cuenta          TEXT,                  -- última columna del CSV (nombre + CBU)
+    cuenta_sel      TEXT NOT NULL,         -- cuenta del dropdown con la que se exportó
+    importado       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_movimientos_cuenta_fecha ON movimientos (cuenta_sel, fecha);
+CREATE TABLE IF NOT EXISTS sincronizacion (
+    cuenta_sel      TEXT PRIMARY KEY,
+    hasta           TEXT NOT NULL,         -- datos completos hasta este instante (ISO)
+    actualizado     REAL NOT NULL
+);
+"""
+
+
+# ─────────────────────────── PARSEO DE CAMPOS ────────────────────────────────
+def parsear_id(texto: str) -> Optional[int]:
+    """ID de movimiento con separador de miles ("63.709") -> 63709."""
+    limpio = texto.strip().replace(".", "")
+    return int(limpio) if limpio.isdigit() else None
+
+
+def parsear_importe(texto: str) -> Optional[int]:
+    """Importe con formato argentino ("-1.234,50 ") -> centavos (-123450)."""
+    limpio = texto.strip().replace(".", "").replace(",", ".")
+    try:
+        return int((Decimal(limpio) * 100).to_integral_value())
+    except InvalidOperation:
+        return None
+
+
+def parsear_fecha(texto: str) -> Optional[datetime]:
+    for formato in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(texto.strip(), formato)
+        except ValueError:
+            continue
+    return None
+
+
+def leer_export(path: str) -> Tuple[List[List[str]], str]:
+    """Filas de un CSV de la grilla (";" y comillas) y el encoding con que se leyó."""
+    for encoding in ("utf-8-sig", "latin-1"):
+        try:
+            with open(path, newline="", encoding=encoding) as f:
+                return [fila for fila in csv.reader(f, delimiter=";") if any(c.strip() for c in fila)], encoding
+        except UnicodeDecodeError:
+            continue
+    return [], "latin-1"
+
+
+# ─────────────────────────────── STORE ───────────────────────────────────────
+class MovimientosStore:
+    """
+    Movimientos por ID (un re-export del mismo rango no duplica: actualiza estado/importe)
+    y marca de sincronización por cuenta del dropdown.
+    - importar_csv(path, cuenta): carga un export; devuelve (nuevos, actualizados).
+    - rango_pendiente(cuenta): (desde, hasta) YYYY-MM-DD que falta pedir a Lohas.
+    - avanzar_marca(cuenta, hasta): tras importar el rango completo.
+    """
+
+    def __init__(self, path: str = MOVIMIENTOS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_ESQUEMA)
+
+    def importar_filas(self, filas: Iterable[List[str]], cuenta_sel: str) -> Tuple[int, int]:
+        ahora = time.time()
+        registros = []
+        for fila in filas:
+            if len(fila) < len(COLUMNAS):
+                continue
+            mid, fecha = parsear_id(fila[0]), parsear_fecha(fila[1])
+            if mid is None or fecha is None:
+                continue  # encabezado u otra basura
+            registros.append((mid, fecha.isoformat(sep=" "), fila[2].strip(), fila[3].strip(), fila[4].strip(),
+                              parsear_importe(fila[5]), fila[6].strip(), fila[7].strip(), fila[8].strip(),
+                              cuenta_sel, ahora))
+        if not registros:
+            return 0, 0
+        with self._lock, self._db:
+            antes = self._db.execute("SELECT COUNT(*) FROM movimientos").fetchone()[0]
+            self._db.executemany(
+                """INSERT INTO movimientos (id, fecha, titular, contraparte, moneda, importe_cent, tipo,
+                                            estado, cuenta, cuenta_sel, importado)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET estado = excluded.estado,
+                                                 importe_cent = excluded.importe_cent,
+                                                 importado = excluded.importado""",
+                registros)
+            despues = self._db.execute("SELECT COUNT(*) FROM movimientos").fetchone()[0]
+        nuevos = despues - antes
+        return nuevos, len(registros) - nuevos
+
+    def importar_csv(self, path: str, cuenta_sel: str) -> Tuple[int, int]:
+        filas, _ = leer_export(path)
+        return self.importar_filas(filas, cuenta_sel)
+
+    def marca(self, cuenta_sel: str) -> Optional[datetime]:
+        with self._lock:
+            fila = self._db.execute("SELECT hasta FROM sincronizacion WHERE cuenta_sel = ?", (cuenta_sel,)).fetchone()
+        return datetime.fromisoformat(fila["hasta"]) if fila else None
+
+    def marcas(self) -> Dict[str, datetime]:
+        """Marca de cada cuenta sincronizada alguna vez."""
+        with self._lock:
+            filas = self._db.execute("SELECT cuenta_sel, hasta FROM sincronizacion").fetchall()
+        return {f["cuenta_sel"]: datetime.fromisoformat(f["hasta"]) for f in filas}
+
+    def avanzar_marca(self, cuenta_sel: str, hasta: datetime):
+        """La marca solo avanza (una sincronización vieja que termina tarde no la retrocede)."""
+        with self._lock, self._db:
+            self._db.execute(
+                """INSERT INTO sincronizacion (cuenta_sel, hasta, actualizado) VALUES (?, ?, ?)
+                   ON CONFLICT(cuenta_sel) DO UPDATE SET hasta = MAX(hasta, excluded.hasta),
+                                                         actualizado = excluded.actualizado""",
+                (cuenta_sel, hasta.isoformat(sep=" ", timespec="seconds"), time.time()))
+
+    def rango_pendiente(self, cuenta_sel: str, hoy: Optional[datetime] = None,
+                        dias_iniciales: int = SYNC_DIAS_INICIALES) -> Tuple[str, str]:
+        """
+        La grilla filtra por día: se pide desde el día de la marca (los movimientos de ese
+        día posteriores a la marca son nuevos; los anteriores se pisan por ID) hasta hoy.
+        """
+        hoy = hoy or datetime.now()
+        marca = self.marca(cuenta_sel)
+        desde = marca.date() if marca else (hoy - timedelta(days=dias_iniciales)).date()
+        return desde.isoformat(), hoy.date().isoformat()
+
+    def movimientos(self, cuenta_sel: Optional[str] = None, desde: Optional[str] = None,
+                    hasta: Optional[str] = None) -> List[sqlite3.Row]:
+        """Movimientos guardados, del más nuevo al más viejo (desde/hasta: YYYY-MM-DD inclusive)."""
+        sql, args = "SELECT * FROM movimientos WHERE 1 = 1", []
+        if cuenta_sel:
+            sql += " AND cuenta_sel = ?"; args.append(cuenta_sel)
+        if desde:
+            sql += " AND fecha >= ?"; args.append(desde)
+        if hasta:
+            sql += " AND fecha < ?"; args.append((datetime.fromisoformat(hasta) + timedelta(days=1)).date().isoformat())
+        with self._lock:
+            return self._db.execute(sql + " ORDER BY fecha DESC, id DESC", args).fetchall()
+
+    def cerrar(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+session_store.py - Sesión de Lohas (cookies) persistida en disco y cifrada, para que
+procesos consecutivos (scan, export CSV, transferencias) reutilicen un mismo login + OTP.
+
+Variables de entorno:
+SESSION_STORE (default 1)        -> 0 desactiva guardar/restaurar la sesión.
+SESSION_STORE_PATH               -> archivo cifrado (default: fuera del directorio de trabajo,
+                                    %LOCALAPPDATA%\\lohas\\session en Windows o
+                                    $XDG_STATE_HOME/lohas/session, ~/.local/state/lohas/session;
+                                    carpeta 0700 y archivo 0600).
+SESSION_STORE_KEY                -> secreto propio para el cifrado (default: derivado de
+                                    USER_LOHAS + PASS_LOHAS).
+SESSION_TTL_SEC (default 1200)   -> inactividad tras la cual se da la sesión por vencida
+                                    (el gc de sesiones PHP por defecto es 1440 s).
+SESSION_KEEPALIVE_SEC (default 0)-> cada cuántos segundos flask_server hace un GET con las
+                                    cookies guardadas para que la sesión no venza (0 = no).
+
+El cifrado usa Fernet (paquete `cryptography`); si no está instalado la sesión no se guarda
+y cada proceso hace su login completo como antes.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # dependencia opcional
+    Fernet = None
+    InvalidToken = Exception
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+SESSION_STORE = os.getenv("SESSION_STORE", "1").lower() not in ("0", "false", "no")
+
+
+def _dir_privado() -> str:
+    """Carpeta del usuario para la sesión (cookies vivas): nunca el cwd, que suele ser el repo."""
+    base = os.getenv("LOCALAPPDATA") if os.name == "nt" else os.getenv("XDG_STATE_HOME")
+    return os.path.join(base or os.path.join(os.path.expanduser("~"), ".local", "state"), "lohas")
+
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") or os.path.join(_dir_privado(), "session")
+try:
+    SESSION_TTL_SEC = max(60.0, float(os.getenv("SESSION_TTL_SEC", "1200")))
+except ValueError:
+    SESSION_TTL_SEC = 1200.0
+try:
+    SESSION_KEEPALIVE_SEC = max(0.0, float(os.getenv("SESSION_KEEPALIVE_SEC", "0")))
+except ValueError:
+    SESSION_KEEPALIVE_SEC = 0.0
+
+# Marcas de que Lohas nos devolvió al login / 2FA (sesión vencida)
+_MARCAS_VENCIDA = ("app_Login", "app_control_2fa", "id_sc_field_login")
+
+
+def _clave_fernet(secreto: str) -> bytes:
+    crudo = hashlib.pbkdf2_hmac("sha256", secreto.encode("utf-8"), b"lohas-session-store", 200_000, 32)
+    return base64.urlsafe_b64encode(crudo)
+
+
+class SessionStore:
+    """
+    Cookies de una sesión autenticada de Lohas, cifradas en disco.
+    - guardar(cookies, inicio): tras un 2FA exitoso (cookies en formato Selenium).
+    - cargar(): datos si la sesión sigue vigente (misma cuenta/host, sin vencer por TTL).
+    - reclamar(): como cargar(), pero una sola vez por proceso (el resto de los workers
+      en paralelo hace su propio login en lugar de compartir la misma sesión PHP).
+    - tocar(): la sesión se usó con éxito, corre de nuevo el TTL.
+    """
+
+    def __init__(self, path: str, cuenta: str, base_url: str, secreto: str, ttl: float = SESSION_TTL_SEC):
+        self.path = path
+        self.cuenta = cuenta
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self._fernet = Fernet(_clave_fernet(secreto)) if Fernet is not None and secreto else None
+        self._lock = threading.Lock()
+        self._reclamada = False
+
+    @property
+    def disponible(self) -> bool:
+        return self._fernet is not None
+
+    def _leer(self) -> Optional[Dict[str, Any]]:
+        if self._fernet is None:
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                datos = json.loads(self._fernet.decrypt(f.read()).decode("utf-8"))
+        except (OSError, InvalidToken, ValueError):
+            return None
+        if datos.get("cuenta") != self.cuenta or datos.get("base") != self.base_url:
+            return None
+        return datos
+
+    def _escribir(self, datos: Dict[str, Any]):
+        if self._fernet is None:
+            return
+        try:
+            carpeta = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(carpeta, mode=0o700, exist_ok=True)
+            tmp = self.path + ".tmp"
+            # 0600 desde que se crea (no después de escribir las cookies)
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                f.write(self._fernet.encrypt(json.dumps(datos).encode("utf-8")))
+            try:
+                os.chmod(tmp, 0o600)  # por si quedó un .tmp viejo con otros permisos
+            except OSError:
+                pass
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"ERROR_DEBUG:No se pudo guardar la sesión: {e}")
+
+    @staticmethod
+    def _vence(datos: Dict[str, Any], ttl: float) -> float:
+        vence = datos.get("ultimo_uso", 0) + ttl
+        expiries = [c["expiry"] for c in datos.get("cookies", []) if c.get("expiry")]
+        return min([vence] + expiries)
+
+    def cargar(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            datos = self._leer()
+            if not datos or not datos.get("cookies"):
+                return None
+            if time.time() >= self._vence(datos, self.ttl):
+                return None
+            return datos
+
+    def reclamar(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._reclamada:
+                return None
+            self._reclamada = True
+        return self.cargar()
+
+    def guardar(self, cookies: List[Dict[str, Any]], inicio: Optional[str] = None):
+        if not cookies:
+            return
+        ahora = time.time()
+        with self._lock:
+            self._escribir({
+                "cuenta": self.cuenta,
+                "base": self.base_url,
+                "cookies": cookies,
+                "inicio": inicio,
+                "guardado": ahora,
+                "ultimo_uso": ahora,
+            })
+
+    def tocar(self):
+        with self._lock:
+            datos = self._leer()
+            if datos:
+                datos["ultimo_uso"] = time.time()
+                self._escribir(datos)
+
+    def borrar(self):
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def cookies_desde_dict(cookies: Dict[str, str], base_url: str) -> List[Dict[str, Any]]:
+    """Cookies nombre->valor (cliente HTTP) al formato Selenium que guarda el store."""
+    host = urlsplit(base_url).hostname or ""
+    seguro = base_url.startswith("https")
+    return [{"name": k, "value": v, "domain": host, "path": "/", "secure": seguro, "httpOnly": True}
+            for k, v in cookies.items()]
+
+
+def cookies_cdp(cookies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cookies guardadas al formato de Network.setCookies (no hace falta estar en el dominio)."""
+    salida = []
+    for c in cookies:
+        cdp = {"name": c["name"], "value": c["value"], "domain": c.get("domain", ""),
+               "path": c.get("path", "/"), "secure": bool(c.get("secure")), "httpOnly": bool(c.get("httpOnly"))}
+        if c.get("expiry"):
+            cdp["expires"] = c["expiry"]
+        salida.append(cdp)
+    return salida
+
+
+def sesion_vencida_en(url: str, html: str = "") -> bool:
+    return any(m in url for m in _MARCAS_VENCIDA[:2]) or _MARCAS_VENCIDA[2] in html
+
+
+def store_por_defecto() -> Optional[SessionStore]:
+    """Store configurado por entorno (None si está desactivado o falta `cryptography`)."""
+    if not SESSION_STORE:
+        return None
+    cuenta = os.getenv("USER_LOHAS", "")
+    secreto = os.getenv("SESSION_STORE_KEY") or (cuenta + ":" + os.getenv("PASS_LOHAS", ""))
+    base = os.getenv("LOHAS_BASE_URL", "https://app.lohas.eco")
+    store = SessionStore(SESSION_STORE_PATH, cuenta, base, secreto)
+    if not store.disponible:
+        print("ERROR_DEBUG:Sesión persistente desactivada (falta el paquete cryptography)")
+        return None
+    return store
+
+
+def ping_sesion(store: SessionStore, url: str) -> bool:
+    """
+    GET a `url` con las cookies guardadas. Si Lohas sigue autenticado corre el TTL;
+    si nos manda al login la sesión guardada se borra. Devuelve si sigue viva.
+    """
+    import urllib3
+
+    datos = store.cargar()
+    if not datos:
+        return False
+    cookie = "; ".join(f"{c['name']}={c['value']}" for c in datos["cookies"])
+    try:
+        resp = urllib3.PoolManager().request("GET", url, headers={"Cookie": cookie}, redirect=False, timeout=20.0)
+    except Exception as e:
+        print(f"ERROR_DEBUG:Keepalive de sesión falló: {e}")
+        return True  # error de red: no se sabe, no borrar
+    destino = resp.headers.get("Location", "")
+    if sesion_vencida_en(destino) or resp.status >= 400 or sesion_vencida_en("", resp.data.decode("utf-8", "replace")):
+        store.borrar()
+        return False
+    store.tocar()
+    return True
+
+
+def iniciar_keepalive(url: str, intervalo: float = SESSION_KEEPALIVE_SEC) -> Optional[threading.Thread]:
+    """Hilo daemon que mantiene viva la sesión guardada entre jobs (lo usa flask_server)."""
+    store = store_por_defecto()
+    if store is None or intervalo <= 0:
+        return None
+
+    def _loop():
+        while True:
+            time.sleep(intervalo)
+            try:
+                ping_sesion(store, url)
+            except Exception as e:
+                print(f"ERROR_DEBUG:Keepalive de sesión: {e}")
+
+    hilo = threading.Thread(target=_loop, daemon=True, name="session-keepalive")
+    hilo.start()
+    return hilo
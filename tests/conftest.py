@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración común de los tests: raíz del repo en sys.path y, antes de que cualquier test
+importe bot.py, el entorno apuntado al Lohas de prueba (tests/lohas_stub.py) sin Gmail ni
+sesión guardada en disco.
+"""
+
+import os
+import sys
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(AQUI))
+sys.path.insert(0, AQUI)
+
+import lohas_stub  # noqa: E402
+
+LOHAS = lohas_stub.ServidorLohas().iniciar()
+
+os.environ.update({
+    "LOHAS_BASE_URL": LOHAS.url,
+    "USER_LOHAS": lohas_stub.USUARIO,
+    "PASS_LOHAS": lohas_stub.CLAVE,
+    "GMAIL_USER": "",
+    "GMAIL_PASS": "",
+    "SESSION_STORE": "0",
+    "TRANSFER_BACKEND": "http",
+})
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+lohas_stub.py - Servidor local que imita las pantallas Scriptcase de Lohas que usa el
+backend HTTP de bot.py (TRANSFER_BACKEND=http), para probarlo sin tocar el banco.
+
+Reproduce las convenciones que el backend lee del HTML:
+- app_Login: form F1 con login/pswd y botón "Ingresar" -> nm_atualiza('alterar').
+- app_control_2fa: campo code, Aceptar (scBtnFn_... -> nm_atualiza) y Confirmar
+  (sub_form_b); al confirmar redirige por JS (location.href) o, con redir_ajax, con
+  redirInfo como una respuesta AJAX de Scriptcase.
+- form_transferencias: select idcuenta con evento AJAX onchange (rs=ajax_..., rsargs[] en
+  el orden de do_ajax_...) que devuelve el saldo en fldList; pasos con "Próximo"
+  (sc_b_stepavc_b -> nm_atualiza('avanca')): destino, importe + concepto BCRA, token y
+  Confirmar (sc_confirmar_bot).
+
+Los códigos de login y de transferencia no se mandan por mail: quedan en `buzon`
+(lo que en producción lee el watcher IMAP). Las transferencias confirmadas quedan en
+`transferencias`.
+
+Uso manual: python tests/lohas_stub.py [puerto]  y  LOHAS_BASE_URL=http://127.0.0.1:<puerto>
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import sys
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+USUARIO = "usuario@test"
+CLAVE = "clave-test"
+SCRIPT_CASE_INIT = "77"
+
+# value del select -> (texto de la opción, saldo con formato de Lohas)
+CUENTAS = {
+    "10": ("BPMUP SRL871 (0000155300000000000871) PES", "24.500,00"),
+    "11": ("BPMUP SRL999 (0000155300000000000999) PES", "1.000,00"),
+}
+CONCEPTOS = (("1", "Alquileres"), ("7", "Varios"), ("9", "Otros"))
+
+
+def _pagina(cuerpo: str, script: str = "", onload: str = "") -> str:
+    return (f"<html><head><meta charset='utf-8'><script>{script}</script></head>"
+            f"<body onload=\"{onload}\">{cuerpo}</body></html>")
+
+
+_JS_ATUALIZA = "function nm_atualiza(x) {\n  document.F1.nmgp_opcao.value = x;\n  document.F1.submit();\n}\n"
+
+
+class EstadoLohas:
+    """Sesiones PHP, códigos emitidos y transferencias hechas; reiniciable entre tests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self, redir_ajax: bool = False, rechazar_token: bool = False):
+        with self.lock:
+            self.sesiones: Dict[str, Dict[str, Any]] = {}
+            self.buzon: List[Tuple[str, str]] = []  # (tipo, código) en orden de llegada
+            self.transferencias: List[Dict[str, str]] = []
+            self.pedidos: List[Tuple[str, str, Dict[str, Any]]] = []
+            self.redir_ajax = redir_ajax
+            self.rechazar_token = rechazar_token
+
+    def emitir_codigo(self, tipo: str) -> str:
+        codigo = f"{random.randint(0, 999999):06d}"
+        with self.lock:
+            self.buzon.append((tipo, codigo))
+        return codigo
+
+    def ultimo_codigo(self, tipo: str) -> str:
+        with self.lock:
+            return next((c for t, c in reversed(self.buzon) if t == tipo), "")
+
+    def vencer_sesiones(self):
+        with self.lock:
+            self.sesiones.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    estado: EstadoLohas
+
+    def log_message(self, *args):
+        pass
+
+    # ─────────────────────────── utilidades ────────────────────────────
+    def _sesion(self) -> Optional[Dict[str, Any]]:
+        for parte in self.headers.get("Cookie", "").split(";"):
+            nombre, _, valor = parte.strip().partition("=")
+            if nombre == "PHPSESSID":
+                return self.estado.sesiones.get(valor)
+        return None
+
+    def _enviar(self, html: str, status: int = 200, headers: Tuple[Tuple[str, str], ...] = ()):
+        datos = html.encode("utf-8")
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _redirigir(self, destino: str, sid: Optional[str] = None):
+        headers = [("Location", destino)]
+        if sid:
+            headers.append(("Set-Cookie", f"PHPSESSID={sid}; path=/; HttpOnly"))
+        self._enviar("", 302, tuple(headers))
+
+    def _error(self, mensaje: str):
+        self._enviar(_pagina("", f"scAjaxShowErrorDisplay('table', '{mensaje}');"))
+
+    def _campos(self) -> Dict[str, Any]:
+        crudo = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        return {k: v if len(v) > 1 else v[0] for k, v in parse_qs(crudo, keep_blank_values=True).items()}
+
+    # ─────────────────────────────── GET ───────────────────────────────
+    def do_GET(self):
+        ruta = self.path.split("?", 1)[0]
+        self.estado.pedidos.append(("GET", ruta, {}))
+        sesion = self._sesion()
+        if ruta in ("/app_Login", "/app_control_2fa", "/form_transferencias", "/menu"):
+            return self._redirigir(ruta + "/")
+        if ruta == "/app_Login/":
+            return self._enviar(_pagina(
+                '<form name="F1" method="post" action="./">'
+                f'<input type="hidden" name="script_case_init" value="{SCRIPT_CASE_INIT}">'
+                '<input type="hidden" name="nmgp_opcao" value="">'
+                '<input id="id_sc_field_login" name="login" type="text">'
+                '<input id="id_sc_field_pswd" name="pswd" type="password">'
+                '<input type="button" class="button" onclick="nm_atualiza(\'alterar\');" value="Ingresar">'
+                '</form>', _JS_ATUALIZA))
+        if ruta == "/app_control_2fa/":
+            if not sesion:
+                return self._redirigir("/app_Login/")
+            return self._enviar(self._pantalla_2fa())
+        if ruta == "/menu/":
+            if not sesion or not sesion["auth"]:
+                return self._redirigir("/app_Login/")
+            # el location.href de la función no se ejecuta al cargar: no es una redirección
+            return self._enviar(_pagina("<ul id='nav_list'></ul>",
+                                        "function salir() {\n  location.href = '/app_Login/';\n}\n"))
+        if ruta == "/form_transferencias/":
+            if not sesion or not sesion["auth"]:
+                return self._redirigir("/app_Login/")
+            sesion["paso"] = 1
+            return self._enviar(self._pantalla_origen())
+        self._enviar("no encontrado", 404)
+
+    def _pantalla_2fa(self) -> str:
+        return _pagina(
+            '<form name="F1" method="post" action="./">'
+            '<input type="hidden" name="nmgp_opcao" value="">'
+            '<input id="id_sc_field_code" name="code" type="text">'
+            '<input type="button" id="sc_submit_ajax_bot" onclick="scBtnFn_sc_submit_ajax_bot()" value="Aceptar">'
+            '</form>',
+            _JS_ATUALIZA + "function scBtnFn_sc_submit_ajax_bot() {\n  nm_atualiza('alterar');\n}\n")
+
+    def _pantalla_origen(self) -> str:
+        opciones = '<option value="">--</option>' + "".join(
+            f'<option value="{v}">{texto}</option>' for v, (texto, _) in CUENTAS.items())
+        script = _JS_ATUALIZA + (
+            "function do_ajax_form_transferencias_event_idcuenta_onchange()\n{\n"
+            "  var var_idcuenta = scAjaxGetFieldSelect('idcuenta');\n"
+            "  var var_script_case_init = document.F1.script_case_init.value;\n"
+            "  x_ajax_form_transferencias_event_idcuenta_onchange(var_idcuenta, var_script_case_init, do_ajax_cb);\n"
+            "}\n")
+        return _pagina(
+            '<form name="F1" method="post" action="index.php">'
+            f'<input type="hidden" name="script_case_init" value="{SCRIPT_CASE_INIT}">'
+            '<input type="hidden" name="nmgp_opcao" value="">'
+            f'<select id="id_sc_field_idcuenta" name="idcuenta">{opciones}</select>'
+            '<input id="id_sc_field_saldo" name="saldo" readonly value="">'
+            '<input id="id_sc_field_cuenta" name="cuenta" type="text">'
+            '<input type="button" id="sc_b_stepavc_b" onclick="nm_atualiza(\'avanca\');" value="Próximo">'
+            '</form>', script)
+
+    # ─────────────────────────────── POST ──────────────────────────────
+    def do_POST(self):
+        ruta = self.path.split("?", 1)[0]
+        campos = self._campos()
+        self.estado.pedidos.append(("POST", ruta, campos))
+        sesion = self._sesion()
+        if ruta == "/app_Login/":
+            return self._post_login(campos)
+        if ruta == "/app_control_2fa/":
+            if not sesion:
+                return self._redirigir("/app_Login/")
+            return self._post_2fa(sesion, campos)
+        if ruta == "/form_transferencias/index.php":
+            if not sesion or not sesion["auth"]:
+                return self._redirigir("/app_Login/")
+            return self._post_transferencia(sesion, campos)
+        self._enviar("no encontrado", 404)
+
+    def _post_login(self, campos: Dict[str, Any]):
+        if campos.get("nmgp_opcao") != "alterar" or (campos.get("login"), campos.get("pswd")) != (USUARIO, CLAVE):
+            return self._enviar(_pagina("<div class='scFormErrorMessage'>Usuario o clave inválidos</div>"))
+        sid = uuid.uuid4().hex
+        self.estado.sesiones[sid] = {"auth": False, "otp": self.estado.emitir_codigo("login"), "paso": 0}
+        self._redirigir("/app_control_2fa/", sid)
+
+    def _post_2fa(self, sesion: Dict[str, Any], campos: Dict[str, Any]):
+        if campos.get("nmgp_opcao") == "alterar":
+            if campos.get("code") != sesion["otp"]:
+                return self._error("Código inválido")
+            sesion["otp_ok"] = True
+            return self._enviar(_pagina(
+                '<form name="F1" method="post" action="./"><input type="hidden" name="nmgp_opcao" value="">'
+                '<input type="button" id="sub_form_b" onclick="nm_atualiza(\'confirmar\');" value="Aceptar">'
+                '</form>', _JS_ATUALIZA))
+        if campos.get("nmgp_opcao") == "confirmar" and sesion.get("otp_ok"):
+            sesion["auth"] = True
+            if self.estado.redir_ajax:
+                redir = {"redirInfo": {"action": "../menu/", "metodo": "post", "script_case_init": SCRIPT_CASE_INIT}}
+                return self._enviar("+:var res = " + json.dumps(redir) + "; res;")
+            return self._enviar(_pagina("", "document.location.href = '../menu/';"))
+        self._error("Paso inválido")
+
+    def _post_transferencia(self, sesion: Dict[str, Any], campos: Dict[str, Any]):
+        if campos.get("rs") == "ajax_form_transferencias_event_idcuenta_onchange":
+            cuenta, init = campos["rsargs[]"]
+            if init != SCRIPT_CASE_INIT:
+                return self._enviar('+:var res = {"fldList": []}; res;')
+            saldo = CUENTAS.get(cuenta, ("", "0,00"))[1]
+            return self._enviar("+:var res = " + json.dumps(
+                {"fldList": [{"fldName": "saldo", "valList": [{"value": saldo}]}]}) + "; res;")
+
+        paso, opcao = sesion.get("paso", 0), campos.get("nmgp_opcao")
+        if paso == 1 and opcao == "avanca" and campos.get("idcuenta") in CUENTAS and campos.get("cuenta"):
+            sesion.update(paso=2, origen=campos["idcuenta"], destino=campos["cuenta"])
+            return self._enviar(_pagina(
+                '<form name="F1" method="post" action="index.php"><input type="hidden" name="nmgp_opcao" value="">'
+                '<p>Destinatario verificado</p>'
+                '<input type="button" id="sc_b_stepavc_b" onclick="nm_atualiza(\'avanca\');" value="Próximo">'
+                '</form>', _JS_ATUALIZA))
+        if paso == 2 and opcao == "avanca":
+            sesion["paso"] = 3
+            conceptos = "".join(f'<option value="{v}">{t}</option>' for v, t in CONCEPTOS)
+            return self._enviar(_pagina(
+                '<form name="F1" method="post" action="index.php"><input type="hidden" name="nmgp_opcao" value="">'
+                '<input id="id_sc_field_importe" name="importe" type="text">'
+                f'<select id="id_sc_field_idconcepto_bcra" name="idconcepto_bcra">{conceptos}</select>'
+                '<input type="button" id="sc_b_stepavc_b" onclick="nm_atualiza(\'avanca\');" value="Próximo">'
+                '</form>', _JS_ATUALIZA))
+        if paso == 3 and opcao == "avanca" and campos.get("importe"):
+            sesion.update(paso=4, importe=campos["importe"], concepto=campos.get("idconcepto_bcra"),
+                          token=self.estado.emitir_codigo("transfer"))
+            return self._enviar(_pagina(
+                '<form name="F1" method="post" action="index.php"><input type="hidden" name="nmgp_opcao" value="">'
+                '<input id="id_sc_field_token_cliente" name="token_cliente" type="text">'
+                '<input type="button" id="sc_confirmar_bot" onclick="nm_atualiza(\'confirmar\');" value="Confirmar">'
+                '</form>', _JS_ATUALIZA))
+        if paso == 4 and opcao == "confirmar":
+            if self.estado.rechazar_token or campos.get("token_cliente") != sesion["token"]:
+                return self._error("Token inválido")
+            sesion["paso"] = 5
+            with self.estado.lock:
+                self.estado.transferencias.append({k: sesion[k] for k in ("origen", "destino", "importe", "concepto")})
+            return self._enviar(_pagina("<p>Transferencia realizada con éxito</p>"))
+        self._error("Paso inválido")
+
+
+class ServidorLohas:
+    """ThreadingHTTPServer en 127.0.0.1 (puerto 0 = libre) con su EstadoLohas."""
+
+    def __init__(self, puerto: int = 0):
+        self.estado = EstadoLohas()
+        handler = type("Handler", (_Handler,), {"estado": self.estado})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", puerto), handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._hilo = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="lohas-stub")
+
+    def iniciar(self) -> "ServidorLohas":
+        self._hilo.start()
+        return self
+
+    def cerrar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    srv = ServidorLohas(int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"Lohas de prueba en {srv.url} (usuario {USUARIO!r}, clave {CLAVE!r}); Ctrl+C para salir")
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        srv.httpd.server_close()
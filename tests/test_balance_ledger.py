@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""BalanceLedger: una fallida libera su reserva y la pasada de reintento reasigna con saldos releídos."""
+
+import bot
+
+
+def _cuentas(**saldos):
+    return [{'value': v, 'text': v, 'cbu': "", 'saldo': s} for v, s in saldos.items()]
+
+
+class _Pool:
+    """Lo que reasignar_saldos usa de TransferWorkerPool."""
+
+    def __init__(self, cuentas):
+        self.cuentas = cuentas
+
+    def leer_saldos(self):
+        return self.cuentas
+
+
+def test_fallida_libera_la_reserva_y_se_reasigna_a_otra_cuenta():
+    ledger = bot.BalanceLedger(_cuentas(a=100.0, b=150.0))
+    assert ledger.asignar({0: 100.0, 1: 100.0}) == []
+    assert {ledger.cuenta_de(0), ledger.cuenta_de(1)} == {"a", "b"}
+    cuenta_fallida = ledger.cuenta_de(0)
+
+    ledger.liberar(0)
+
+    assert ledger.cuenta_de(0) is None
+    assert ledger.disponible(cuenta_fallida) == ledger.cuentas[cuenta_fallida]['saldo']
+    # la cuenta original ya no tiene saldo (p. ej. la vació otra operación): va a la otra
+    ledger.actualizar_saldos(_cuentas(**{cuenta_fallida: 0.0, ("b" if cuenta_fallida == "a" else "a"): 250.0}))
+    assert ledger.asignar({0: 100.0}) == []
+    assert ledger.cuenta_de(0) != cuenta_fallida
+
+
+def test_actualizar_saldos_mantiene_las_reservas_vigentes():
+    ledger = bot.BalanceLedger(_cuentas(a=300.0))
+    ledger.asignar({0: 200.0})
+
+    ledger.actualizar_saldos(_cuentas(a=250.0))
+
+    assert ledger.disponible("a") == 50.0
+    assert ledger.asignar({1: 100.0}) == [1]
+
+
+def test_confirmar_despues_de_liberar_descuenta_el_saldo():
+    # fallida que igual se ejecutó (verificar_ejecutadas la confirma después de liberarla)
+    ledger = bot.BalanceLedger(_cuentas(a=300.0))
+    ledger.asignar({0: 200.0})
+    ledger.liberar(0)
+
+    ledger.confirmar(0)
+
+    assert ledger.cuentas["a"]['saldo'] == 100.0
+    assert ledger.disponible("a") == 100.0
+
+
+def test_reasignar_saldos_recupera_las_sin_saldo_y_marca_las_que_no_entran():
+    ledger = bot.BalanceLedger(_cuentas(a=100.0))
+    transfer_status = {i: {'monto': "100", 'status': 'pending'} for i in range(3)}
+    assert ledger.asignar({0: 100.0, 1: 100.0, 2: 100.0}) == [1, 2]
+    ledger.liberar(0)
+
+    # entró saldo nuevo en la cuenta: dos de las tres pendientes ya entran
+    a_reintentar, sin_saldo = bot.reasignar_saldos(_Pool(_cuentas(a=200.0)), ledger, [0, 1, 2], transfer_status)
+
+    assert a_reintentar == [0, 1]
+    assert sin_saldo == [2]
+    assert [transfer_status[i]['status'] for i in range(3)] == ['failed', 'failed', 'sin_saldo']
+    assert ledger.cuenta_de(0) == ledger.cuenta_de(1) == "a"
+
+
+def test_reasignar_saldos_sin_lectura_usa_los_saldos_locales():
+    ledger = bot.BalanceLedger(_cuentas(a=100.0))
+    ledger.asignar({0: 100.0})
+    ledger.liberar(0)
+
+    a_reintentar, sin_saldo = bot.reasignar_saldos(_Pool(None), ledger, [0], {0: {'monto': "100"}})
+
+    assert (a_reintentar, sin_saldo) == ([0], [])
+    assert ledger.cuenta_de(0) == "a"
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""BrowserPool: un navegador que se queda todo el lote no deja otro Chrome ocioso en espera."""
+
+import threading
+import time
+
+import bot
+
+
+class _Driver:
+    def execute_script(self, _):
+        return 1
+
+    def quit(self):
+        pass
+
+
+class _Fabrica:
+    def __init__(self):
+        self.creados = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.creados += 1
+        return _Driver()
+
+
+def _pool_listo(fabrica):
+    pool = bot.BrowserPool(1, fabrica, nombre="test")
+    pool.tomar(timeout=5, reponer=False)  # espera el pre-lanzado
+    return pool
+
+
+def _estable(pool, segundos=0.3):
+    time.sleep(segundos)
+    return pool._lanzando, pool._libres.qsize()
+
+
+def test_tomar_sin_reponer_no_lanza_otro_navegador():
+    fabrica = _Fabrica()
+    pool = _pool_listo(fabrica)
+
+    assert _estable(pool) == (0, 0)
+    assert fabrica.creados == 1
+    pool.cerrar()
+
+
+def test_tomar_por_defecto_repone():
+    fabrica = _Fabrica()
+    pool = bot.BrowserPool(1, fabrica, nombre="test")
+
+    pool.tomar(timeout=5)
+
+    assert _estable(pool) == (0, 1)
+    assert fabrica.creados == 2
+    pool.cerrar()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""conciliar(): duplicadas, rechazadas, ejecutadas sin registro, prioridad de COMPLETADA y ambiguas."""
+
+from conciliacion import conciliar
+from movimientos_columnas import MovimientosColumnas
+
+CBU_DESTINO = "0000003100000000000362"
+
+
+def _movimientos(*filas, contraparte="CLEANPOWER SOLUTIONS SRL362"):
+    """(id, "dd/mm/YYYY HH:MM:SS", importe, estado) -> columnas como las del export."""
+    cols = MovimientosColumnas()
+    cols.agregar_bloque([[str(mid), fecha, "BPMUP SRL", contraparte, "PES", importe,
+                          "Transferencia saliente", estado, "BPMUP SRL871 - 0000155300000000000871"]
+                         for mid, fecha, importe, estado in filas])
+    return cols.cerrar()
+
+
+def _transferencias(*ns, cbu=CBU_DESTINO, nombre=""):
+    return [{"n": n, "id": f"T{n}", "cbu_destino": cbu, "monto": "1500.50", "nombre": nombre} for n in ns]
+
+
+def _intento(n, estado, fecha):
+    return {"n": n, "estado": estado, "fecha": fecha}
+
+
+def _ns(reporte, categoria):
+    return [f["n"] for f in reporte["detalle"][categoria]]
+
+
+def test_duplicadas_dentro_de_la_ventana():
+    movs = _movimientos((63709, "02/10/2025 10:00:10", "-1.500,50 ", "Ejecutado"),
+                        (63710, "02/10/2025 10:03:00", "-1.500,50 ", "Ejecutado"),
+                        (63711, "02/10/2025 12:00:00", "-1.500,50 ", "Ejecutado"))  # fuera de la ventana
+
+    reporte = conciliar(_transferencias(1), movs, [_intento(1, "COMPLETADA", "02/10/2025 10:00:00")])
+
+    assert _ns(reporte, "confirmadas") == [1]
+    assert reporte["detalle"]["confirmadas"][0]["movimiento_id"] == 63709
+    assert [d["repetidos"] for d in reporte["detalle"]["duplicadas"]] == [[63710]]
+
+
+def test_solo_rechazado_no_confirma():
+    movs = _movimientos((63709, "02/10/2025 10:00:10", "-1.500,50 ", "Rechazado"))
+
+    reporte = conciliar(_transferencias(1), movs, [_intento(1, "COMPLETADA", "02/10/2025 10:00:00")])
+
+    assert _ns(reporte, "rechazadas") == [1]
+    assert reporte["confirmadas"] == reporte["faltantes"] == 0
+
+
+def test_ejecutado_gana_al_rechazado_y_no_es_duplicado():
+    movs = _movimientos((63709, "02/10/2025 10:00:05", "-1.500,50 ", "Rechazado"),
+                        (63710, "02/10/2025 10:02:00", "-1.500,50 ", "Ejecutado"))
+
+    reporte = conciliar(_transferencias(1), movs, [_intento(1, "COMPLETADA", "02/10/2025 10:00:00")])
+
+    assert reporte["detalle"]["confirmadas"][0]["movimiento_id"] == 63710
+    assert reporte["rechazadas"] == reporte["duplicadas"] == 0
+
+
+def test_ejecutadas_sin_registro():
+    movs = _movimientos((63709, "02/10/2025 10:00:40", "-1.500,50 ", "Ejecutado"),
+                        (63710, "02/10/2025 11:00:00", "-1.500,50 ", "Ejecutado"))
+    # #1 falló según el log pero salió; #2 no tiene ningún intento registrado; #3 nunca salió
+    intentos = [_intento(1, "FALLIDA", "02/10/2025 10:00:00"), _intento(3, "FALLIDA", "02/10/2025 14:00:00")]
+
+    reporte = conciliar(_transferencias(1, 2, 3), movs, intentos)
+
+    assert _ns(reporte, "confirmadas") == [1, 2]
+    assert _ns(reporte, "ejecutadas_sin_registro") == [1, 2]
+    assert _ns(reporte, "faltantes") == [3]
+    assert reporte["detalle"]["faltantes"][0]["estado_log"] == "FALLIDA"
+
+
+def test_completada_tiene_prioridad_sobre_fallida_anterior():
+    # un solo movimiento, a tiro de las dos: es el de la que bot.py dio por completada
+    movs = _movimientos((63709, "02/10/2025 10:00:30", "-1.500,50 ", "Ejecutado"))
+    intentos = [_intento(1, "FALLIDA", "02/10/2025 10:00:00"), _intento(2, "COMPLETADA", "02/10/2025 10:05:00")]
+
+    reporte = conciliar(_transferencias(1, 2), movs, intentos)
+
+    assert _ns(reporte, "confirmadas") == [2]
+    assert _ns(reporte, "faltantes") == [1]
+    assert reporte["ejecutadas_sin_registro"] == 0
+
+
+OTRO_CBU = "0000003100000000099362"  # mismos 3 últimos dígitos que CBU_DESTINO
+
+
+def test_otra_pedida_con_la_misma_clave_deja_la_fallida_ambigua():
+    movs = _movimientos((63709, "02/10/2025 10:00:30", "-1.500,50 ", "Ejecutado"))
+    intentos = [_intento(1, "FALLIDA", "02/10/2025 10:00:00")]
+
+    reporte = conciliar(_transferencias(1) + _transferencias(2, cbu=OTRO_CBU), movs, intentos)
+
+    assert _ns(reporte, "ambiguas") == [1]
+    assert reporte["detalle"]["ambiguas"][0]["candidatos"] == [63709]
+    assert reporte["ejecutadas_sin_registro"] == reporte["confirmadas"] == 0
+
+
+def test_dos_candidatos_en_el_intento_deja_la_fallida_ambigua():
+    movs = _movimientos((63709, "02/10/2025 10:00:20", "-1.500,50 ", "Ejecutado"),
+                        (63710, "02/10/2025 10:00:50", "-1.500,50 ", "Ejecutado"))
+    intentos = [{**_intento(1, "FALLIDA", "02/10/2025 10:01:00"), "inicio": "02/10/2025 10:00:00"}]
+
+    reporte = conciliar(_transferencias(1), movs, intentos)
+
+    assert _ns(reporte, "ambiguas") == [1]
+    assert sorted(reporte["detalle"]["ambiguas"][0]["candidatos"]) == [63709, 63710]
+
+
+def test_cbu_completo_en_la_contraparte_decide():
+    movs = _movimientos((63709, "02/10/2025 10:00:30", "-1.500,50 ", "Ejecutado"),
+                        contraparte=f"CLEANPOWER SOLUTIONS SRL - {OTRO_CBU}")
+    intentos = [_intento(1, "FALLIDA", "02/10/2025 10:00:00")]
+
+    # a otro CBU: no es candidato
+    reporte = conciliar(_transferencias(1), movs, intentos)
+    assert _ns(reporte, "faltantes") == [1]
+
+    # al mismo CBU: confirma aunque otra pedida comparta la clave
+    reporte = conciliar(_transferencias(1, cbu=OTRO_CBU) + _transferencias(2), movs, intentos)
+    assert _ns(reporte, "ejecutadas_sin_registro") == [1]
+    assert reporte["ambiguas"] == 0
+
+
+def test_nombre_de_la_contraparte_decide():
+    movs = _movimientos((63709, "02/10/2025 10:00:30", "-1.500,50 ", "Ejecutado"))
+    intentos = [_intento(1, "FALLIDA", "02/10/2025 10:00:00")]
+
+    reporte = conciliar(_transferencias(1, nombre="Peña Hnos S.A."), movs, intentos)
+    assert _ns(reporte, "faltantes") == [1]
+
+    reporte = conciliar(_transferencias(1, nombre="Cleanpower Solutions S.R.L.")
+                        + _transferencias(2, cbu=OTRO_CBU, nombre="Otra SA"), movs, intentos)
+    assert _ns(reporte, "ejecutadas_sin_registro") == [1]
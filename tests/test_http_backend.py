@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Backend HTTP de bot.py (LohasHttpSession) contra el Lohas de prueba de lohas_stub.py."""
+
+import threading
+import time
+
+import pytest
+
+import bot
+from conftest import LOHAS
+
+CBU_DESTINO = "0000003100000000000362"
+
+
+@pytest.fixture
+def lohas(monkeypatch):
+    """Estado limpio del servidor y los códigos 'por mail' leídos del buzón del stub."""
+    LOHAS.estado.reiniciar()
+    monkeypatch.setattr(bot, "_esperar_codigo_mail",
+                        lambda kind, waiter, timeout, since_uid=None: LOHAS.estado.ultimo_codigo(kind))
+    return LOHAS.estado
+
+
+@pytest.fixture
+def sesion():
+    s = bot.LohasHttpSession()
+    yield s
+    s.cerrar()
+
+
+def test_apunta_al_stub():
+    assert bot.URL_B == LOHAS.url + "/app_Login"
+    assert bot.TRANSFER_URL == LOHAS.url + "/form_transferencias/"
+
+
+@pytest.mark.parametrize("redir_ajax", [False, True], ids=["location", "redirInfo"])
+def test_login_2fa_y_transferencia(lohas, sesion, redir_ajax):
+    lohas.reiniciar(redir_ajax=redir_ajax)
+
+    ok, cbu_origen = sesion.ejecutar(CBU_DESTINO, "1500.50", cuenta_origen="10")
+
+    assert ok is True
+    assert cbu_origen == "0000155300000000000871"
+    assert lohas.transferencias == [{"origen": "10", "destino": CBU_DESTINO, "importe": "1500.50", "concepto": "7"}]
+    assert sesion.logins == 1
+    # el login mandó lo que setea el botón "Ingresar" (nm_atualiza) y los campos ocultos del form
+    login = next(c for m, r, c in lohas.pedidos if m == "POST" and r == "/app_Login/")
+    assert login["nmgp_opcao"] == "alterar" and login["script_case_init"] == "77"
+
+
+def test_leer_saldos_por_evento_ajax(lohas, sesion):
+    cuentas = sesion.leer_saldos()
+
+    assert [(c["value"], c["cbu"], c["saldo"]) for c in cuentas] == [
+        ("10", "0000155300000000000871", 24500.0),
+        ("11", "0000155300000000000999", 1000.0),
+    ]
+    ajax = [c for m, r, c in lohas.pedidos if c.get("rs")]
+    # rsargs[] en el orden de do_ajax_...: cuenta y script_case_init
+    assert [a["rsargs[]"] for a in ajax] == [["10", "77"], ["11", "77"]]
+
+
+def test_sin_cuenta_elige_la_primera_con_saldo(lohas, sesion):
+    ok, cbu_origen = sesion.ejecutar(CBU_DESTINO, "5000", cuenta_origen=None)
+
+    assert ok and cbu_origen == "0000155300000000000871"
+    assert lohas.transferencias[0]["origen"] == "10"
+
+
+def test_sin_saldo_no_envia(lohas, sesion):
+    ok, _ = sesion.ejecutar(CBU_DESTINO, "50000", cuenta_origen=None)
+
+    assert ok is False
+    assert lohas.transferencias == []
+
+
+def test_token_rechazado_es_fallida(lohas, sesion):
+    lohas.reiniciar(rechazar_token=True)
+
+    ok, cbu_origen = sesion.ejecutar(CBU_DESTINO, "100", cuenta_origen="10")
+
+    assert ok is False
+    assert cbu_origen == "0000155300000000000871"
+    assert lohas.transferencias == []
+
+
+def test_otp_incorrecto_no_autentica(lohas, sesion, monkeypatch):
+    monkeypatch.setattr(bot, "_esperar_codigo_mail", lambda kind, waiter, timeout, since_uid=None: "000000")
+
+    ok, _ = sesion.ejecutar(CBU_DESTINO, "100", cuenta_origen="10")
+
+    assert ok is False
+    assert lohas.transferencias == []
+    assert not any(s["auth"] for s in lohas.sesiones.values())
+
+
+def test_sesion_reutilizada_y_relogin_al_vencer(lohas, sesion):
+    assert sesion.ejecutar(CBU_DESTINO, "100", cuenta_origen="10")[0]
+    assert sesion.ejecutar(CBU_DESTINO, "200", cuenta_origen="11")[0]
+    assert sesion.logins == 1
+
+    lohas.vencer_sesiones()
+    assert sesion.ejecutar(CBU_DESTINO, "300", cuenta_origen="10")[0]
+
+    assert sesion.logins == 2
+    assert [t["importe"] for t in lohas.transferencias] == ["100", "200", "300"]
+
+
+def test_opcion_b_http_sin_sesion_compartida(lohas):
+    ok, cbu_origen = bot.opcion_b_http(CBU_DESTINO, "100", cuenta_origen="11")
+
+    assert ok and cbu_origen == "0000155300000000000999"
+    assert len(lohas.transferencias) == 1
+
+
+def test_workers_en_paralelo_no_se_cruzan_los_codigos(lohas, monkeypatch):
+    # el "mail" tarda: sin turno, el otro worker dispararía su código en el medio y los dos
+    # leerían el último del buzón
+    def codigo_lento(kind, waiter, timeout, since_uid=None):
+        if kind == "transfer":
+            time.sleep(0.2)
+        return lohas.ultimo_codigo(kind)
+
+    monkeypatch.setattr(bot, "_esperar_codigo_mail", codigo_lento)
+    # cada worker con su sesión ya logueada (los logins no son lo que se prueba acá)
+    sesiones = [bot.LohasHttpSession() for _ in range(3)]
+    for s in sesiones:
+        s.leer_saldos()
+    resultados = []
+
+    def worker(sesion, cuenta):
+        resultados.append(sesion.ejecutar(CBU_DESTINO, "100", cuenta_origen=cuenta)[0])
+
+    hilos = [threading.Thread(target=worker, args=(s, c)) for s, c in zip(sesiones, ("10", "11", "10"))]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    for s in sesiones:
+        s.cerrar()
+
+    assert resultados == [True, True, True]
+    assert len(lohas.transferencias) == 3
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""imap_idle_wait: un EXISTS que llega en el mismo paquete que el "+" no se pierde en el buffer."""
+
+import socket
+import threading
+import time
+
+import bot
+
+
+class _Imap:
+    """Lo que imap_idle_wait usa de imaplib.IMAP4, sobre un socketpair."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        self.tagged_commands = {}
+        self._n = 0
+
+    def _new_tag(self) -> bytes:
+        self._n += 1
+        return b"A%d" % self._n
+
+    def send(self, datos: bytes):
+        self.sock.sendall(datos)
+
+    def readline(self) -> bytes:
+        return self.file.readline()
+
+
+def _servidor(sock: socket.socket, respuesta_idle: bytes):
+    f = sock.makefile("rb")
+    tag = f.readline().split()[0]
+    sock.sendall(respuesta_idle)  # un solo paquete
+    f.readline()  # DONE
+    sock.sendall(tag + b" OK IDLE terminated\r\n")
+
+
+def _idle(respuesta_idle: bytes, timeout: float):
+    cliente, servidor = socket.socketpair()
+    hilo = threading.Thread(target=_servidor, args=(servidor, respuesta_idle), daemon=True)
+    hilo.start()
+    try:
+        t0 = time.monotonic()
+        nuevo = bot.imap_idle_wait(_Imap(cliente), timeout)
+        return nuevo, time.monotonic() - t0
+    finally:
+        hilo.join(2)
+        cliente.close()
+        servidor.close()
+
+
+def test_exists_en_el_mismo_paquete_que_la_continuacion_despierta_enseguida():
+    nuevo, demora = _idle(b"+ idling\r\n* 3 EXISTS\r\n", timeout=5)
+
+    assert nuevo is True
+    assert demora < 1
+
+
+def test_sin_aviso_espera_el_timeout():
+    nuevo, demora = _idle(b"+ idling\r\n", timeout=0.3)
+
+    assert nuevo is False
+    assert demora >= 0.3
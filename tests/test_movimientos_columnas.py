@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""movimientos_columnas.py: NumPy y Python puro dan el mismo resumen; fechas fuera de formato."""
+
+from datetime import datetime
+
+import pytest
+
+import movimientos_columnas
+from movimientos_columnas import leer_columnas
+
+np = pytest.importorskip("numpy")
+
+FILAS = [
+    ("63.709", "02/10/2025 12:12:58", "CLEANPOWER SOLUTIONS SRL362", "-100,00 ", "Ejecutado"),
+    ("63.710", "02/10/2025 23:59:59", "CLEANPOWER SOLUTIONS SRL362", "-1.234,50 ", "Ejecutado"),
+    ("63.711", "03/10/2025 00:00:00", "PEÑA HNOS SA118", "20.000,00 ", "Ejecutado"),
+    # sin segundos: el bloque vectorizado lo resuelve por el camino de `raros`
+    ("63.712", "03/10/2025 09:15", "PEÑA HNOS SA118", "-0,01 ", "Rechazado"),
+    ("63.713", "29/02/2024 18:30:00", "OTRA SRL999", "1,00 ", "Ejecutado"),
+]
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / "export.csv"
+    lineas = ['"ID";"Fecha";"Titular";"Contraparte";"Moneda";"Importe";"Tipo";"Estado";"Cuenta"']
+    for mid, fecha, contraparte, importe, estado in FILAS:
+        campos = [mid, fecha, "BPMUP SRL", contraparte, "PES", importe, "Transferencia", estado,
+                  "BPMUP SRL871 - 0000155300000000000871"]
+        lineas.append(";".join(f'"{c}"' for c in campos))
+    path.write_text("\n".join(lineas) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def _segundos(texto: str, formato: str) -> int:
+    return int((datetime.strptime(texto, formato) - datetime(1970, 1, 1)).total_seconds())
+
+
+@pytest.mark.parametrize("filas_por_bloque", [2, 1000], ids=["varios_bloques", "un_bloque"])
+def test_numpy_y_python_puro_dan_el_mismo_resumen(export, monkeypatch, filas_por_bloque):
+    con_numpy = leer_columnas(export, filas_por_bloque)
+    resumen_numpy = con_numpy.resumen()
+    monkeypatch.setattr(movimientos_columnas, "np", None)
+    sin_numpy = leer_columnas(export, filas_por_bloque)
+
+    assert isinstance(con_numpy.segundos, np.ndarray) and not isinstance(sin_numpy.segundos, np.ndarray)
+    assert resumen_numpy == sin_numpy.resumen()
+    assert list(con_numpy.segundos) == list(sin_numpy.segundos)
+    assert list(con_numpy.importes) == list(sin_numpy.importes) == [-10000, -123450, 2000000, -1, 100]
+    assert resumen_numpy["total_cent"] == 2000000 - 10000 - 123450 - 1 + 100
+
+
+def test_fecha_de_otro_largo_usa_el_respaldo():
+    textos = [f[1] for f in FILAS]
+
+    segundos = movimientos_columnas._segundos_np(textos)
+
+    assert segundos[3] == _segundos("03/10/2025 09:15", "%d/%m/%Y %H:%M")
+    assert segundos.tolist() == movimientos_columnas._segundos_py(textos)
+    assert segundos[4] == _segundos("29/02/2024 18:30:00", "%d/%m/%Y %H:%M:%S")
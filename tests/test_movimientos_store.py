@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""movimientos_store.py: parseo de campos, upsert por ID y marca de sincronización."""
+
+from datetime import datetime
+
+import pytest
+
+from movimientos_store import MovimientosStore, parsear_fecha, parsear_id, parsear_importe
+
+CUENTA = "BPMUP SRL871 (0000155300000000000871)"
+
+
+def _fila(mid: str, fecha: str = "02/10/2025 12:12:58", importe: str = "-100,00 ", estado: str = "Ejecutado"):
+    return [mid, fecha, "BPMUP SRL", "CLEANPOWER SOLUTIONS SRL362", "PES", importe,
+            "Transferencia saliente", estado, "BPMUP SRL871 - 0000155300000000000871"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = MovimientosStore(str(tmp_path / "movimientos.sqlite3"))
+    yield s
+    s.cerrar()
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("-100,00 ", -10000),
+    ("-1.234,50", -123450),
+    ("20.000,00", 2000000),
+    ("0,01", 1),
+    ("", None),
+    ("abc", None),
+])
+def test_parsear_importe(texto, esperado):
+    assert parsear_importe(texto) == esperado
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("63.709", 63709),
+    (" 1.063.709 ", 1063709),
+    ("12", 12),
+    ("ID", None),
+    ("-5", None),
+])
+def test_parsear_id(texto, esperado):
+    assert parsear_id(texto) == esperado
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("02/10/2025 12:12:58", datetime(2025, 10, 2, 12, 12, 58)),
+    ("02/10/2025 12:12", datetime(2025, 10, 2, 12, 12)),
+    (" 02/10/2025 ", datetime(2025, 10, 2)),
+    ("2025-10-02", None),
+    ("Fecha", None),
+])
+def test_parsear_fecha(texto, esperado):
+    assert parsear_fecha(texto) == esperado
+
+
+def test_importar_es_idempotente_y_actualiza_por_id(store):
+    filas = [_fila("63.709"), _fila("63.710", importe="-50,00 "), ["ID", "Fecha"], _fila("x")]
+
+    assert store.importar_filas(filas, CUENTA) == (2, 0)
+    assert store.importar_filas(filas, CUENTA) == (0, 2)
+
+    # re-export del mismo rango: el estado cambió y aparece uno nuevo
+    assert store.importar_filas([_fila("63.709", estado="Rechazado"), _fila("63.711")], CUENTA) == (1, 1)
+    por_id = {f["id"]: f for f in store.movimientos(CUENTA)}
+    assert sorted(por_id) == [63709, 63710, 63711]
+    assert por_id[63709]["estado"] == "Rechazado"
+    assert por_id[63710]["importe_cent"] == -5000
+    assert por_id[63709]["fecha"] == "2025-10-02 12:12:58"
+
+
+def test_avanzar_marca_nunca_retrocede(store):
+    assert store.marca(CUENTA) is None
+
+    store.avanzar_marca(CUENTA, datetime(2025, 10, 2, 12, 0, 0))
+    store.avanzar_marca(CUENTA, datetime(2025, 10, 1, 9, 0, 0))  # sincronización vieja que terminó tarde
+    assert store.marca(CUENTA) == datetime(2025, 10, 2, 12, 0, 0)
+
+    store.avanzar_marca(CUENTA, datetime(2025, 10, 3, 8, 30, 0))
+    assert store.marca(CUENTA) == datetime(2025, 10, 3, 8, 30, 0)
+    assert store.marca("OTRA") is None
+
+
+def test_rango_pendiente_sin_marca(store):
+    assert store.rango_pendiente(CUENTA, datetime(2025, 10, 20, 15, 0), dias_iniciales=30) == \
+        ("2025-09-20", "2025-10-20")
+
+
+def test_rango_pendiente_con_marca(store):
+    store.avanzar_marca(CUENTA, datetime(2025, 10, 18, 23, 59, 0))
+
+    # desde el día de la marca (lo de ese día se vuelve a pedir y se pisa por ID)
+    assert store.rango_pendiente(CUENTA, datetime(2025, 10, 20, 15, 0)) == ("2025-10-18", "2025-10-20")
+    assert store.rango_pendiente("OTRA", datetime(2025, 10, 20, 15, 0), dias_iniciales=2) == \
+        ("2025-10-18", "2025-10-20")
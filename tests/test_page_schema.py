@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""localizar_profundo + PageSchemaCache: sondeo corto al selector guardado; si falla, se descarta y se reescribe."""
+
+import os
+import time
+
+import pytest
+
+import bot
+
+
+class _Driver:
+    current_url = "https://app.lohas.eco/form_transferencias/?x=1"
+
+
+@pytest.fixture
+def esquema(tmp_path, monkeypatch):
+    cache = bot.PageSchemaCache(str(tmp_path / "page_schema.json"))
+    monkeypatch.setattr(bot, "PAGE_SCHEMA", cache)
+    monkeypatch.setattr(bot, "PAGE_SCHEMA_CACHE", True)
+    return cache
+
+
+def _busqueda(monkeypatch, aparece_en: int, encontrado):
+    """Simula _buscar_profundo_una_vez: nada hasta el intento `aparece_en`; registra cada llamada."""
+    llamadas = []
+
+    def buscar(driver, selectores, solo_visibles, pista=None):
+        llamadas.append((list(selectores), pista))
+        if len(llamadas) < aparece_en:
+            return None, -1, []
+        sel, path = encontrado
+        if sel in selectores:
+            return "elemento", selectores.index(sel), path
+        return None, -1, []
+
+    monkeypatch.setattr(bot, "_buscar_profundo_una_vez", buscar)
+    return llamadas
+
+
+def test_hit_lento_no_invalida_ni_escribe(esquema, monkeypatch):
+    esquema.registrar("app.lohas.eco/form_transferencias/", "token", ("id", "tok"), [0])
+    mtime = os.stat(esquema.path).st_mtime_ns
+    llamadas = _busqueda(monkeypatch, aparece_en=3, encontrado=(("id", "tok"), [0]))
+
+    el = bot.localizar_profundo(_Driver(), [("id", "tok"), ("name", "tok")], timeout=1.0, poll=0.01, campo="token")
+
+    assert el == "elemento"
+    # los tres intentos fueron solo con el selector guardado y su frame path
+    assert llamadas == [([("id", "tok")], [0])] * 3
+    assert os.stat(esquema.path).st_mtime_ns == mtime
+    assert esquema.get("app.lohas.eco/form_transferencias/", "token") == {"sel": ["id", "tok"], "path": [0]}
+
+
+def test_campo_movido_reemplaza_la_entrada(esquema, monkeypatch):
+    esquema.registrar("app.lohas.eco/form_transferencias/", "token", ("id", "viejo"), [])
+    llamadas = _busqueda(monkeypatch, aparece_en=1, encontrado=(("name", "tok"), [1]))
+
+    el = bot.localizar_profundo(_Driver(), [("id", "tok"), ("name", "tok")], timeout=0.2, poll=0.01, campo="token")
+
+    assert el == "elemento"
+    assert llamadas[-1][0] == [("id", "tok"), ("name", "tok")]
+    assert esquema.get("app.lohas.eco/form_transferencias/", "token") == {"sel": ["name", "tok"], "path": [1]}
+
+
+def test_sondeo_fijo_y_entrada_vieja_descartada(esquema, monkeypatch):
+    esquema.registrar("app.lohas.eco/form_transferencias/", "token", ("id", "tok"), [3])
+    monkeypatch.setattr(bot, "PAGE_SCHEMA_PROBE_SEC", 0.05)
+    llamadas = _busqueda(monkeypatch, aparece_en=1, encontrado=(("id", "tok"), [1]))
+    # el frame path guardado ya no lleva al campo
+    buscar = bot._buscar_profundo_una_vez
+    monkeypatch.setattr(bot, "_buscar_profundo_una_vez",
+                        lambda d, sel, vis, pista=None: (None, -1, []) if pista == [3] else buscar(d, sel, vis, pista))
+
+    t0 = time.monotonic()
+    el = bot.localizar_profundo(_Driver(), [("id", "tok")], timeout=10, poll=0.01, campo="token")
+
+    assert el == "elemento"
+    assert time.monotonic() - t0 < 1  # no la mitad del timeout
+    assert llamadas == [([("id", "tok")], None)]
+    assert esquema.get("app.lohas.eco/form_transferencias/", "token") == {"sel": ["id", "tok"], "path": [1]}
+
+
+def test_sin_elemento_descarta_la_entrada(esquema, monkeypatch):
+    esquema.registrar("app.lohas.eco/form_transferencias/", "token", ("id", "tok"), [0])
+    _busqueda(monkeypatch, aparece_en=10 ** 6, encontrado=(("id", "tok"), [0]))
+
+    assert bot.localizar_profundo(_Driver(), [("id", "tok")], timeout=0.1, poll=0.01, campo="token") is None
+    assert esquema.get("app.lohas.eco/form_transferencias/", "token") is None
+
+
+def test_respaldo_no_se_guarda(esquema, monkeypatch):
+    _busqueda(monkeypatch, aparece_en=1, encontrado=(("xpath", "//a"), []))
+
+    el = bot.localizar_profundo(_Driver(), [("id", "tok")], timeout=0.1, poll=0.01, campo="token",
+                                respaldo=[("xpath", "//a")])
+
+    assert el == "elemento"
+    assert esquema.get("app.lohas.eco/form_transferencias/", "token") is None
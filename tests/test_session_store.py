@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""session_store.py: carpeta privada con permisos 0600 y un mismo host para bot.py y bot_csv.py."""
+
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+
+import session_store
+
+pytest.importorskip("cryptography")
+
+COOKIES = [{"name": "PHPSESSID", "value": "abc", "domain": "127.0.0.1", "path": "/"}]
+
+
+def test_ruta_por_defecto_fuera_del_cwd():
+    assert os.path.dirname(session_store.SESSION_STORE_PATH) != os.getcwd()
+    assert not session_store.SESSION_STORE_PATH.startswith(os.getcwd() + os.sep)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="permisos POSIX")
+def test_guardar_crea_carpeta_0700_y_archivo_0600(tmp_path):
+    path = tmp_path / "estado" / "lohas" / "session"
+    store = session_store.SessionStore(str(path), "usuario", "http://127.0.0.1", "secreto")
+
+    store.guardar(COOKIES)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+    assert store.cargar()["cookies"] == COOKIES
+
+
+def test_bot_csv_usa_el_host_de_lohas_base_url():
+    # en otro proceso: bot_csv reemplaza builtins.print al importarse
+    env = {**os.environ, "LOHAS_BASE_URL": "http://127.0.0.1:9/", "SESSION_STORE": "0"}
+    codigo = ("import sys, bot_csv; "
+              "sys.stderr.write(repr((bot_csv.URL_B, bot_csv.TRANSFER_URL)))")
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    res = subprocess.run([sys.executable, "-c", codigo], cwd=raiz, env=env, capture_output=True, text=True,
+                         timeout=120)
+
+    assert res.returncode == 0, res.stderr
+    assert res.stderr.endswith(repr(("http://127.0.0.1:9/app_Login",
+                                     "http://127.0.0.1:9/grid_movimientos_cuenta_usuario/")))
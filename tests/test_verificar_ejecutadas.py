@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""verificar_ejecutadas: movimiento dentro del intento, store al día, aviso si no se pudo actualizar y ambiguas."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+from movimientos_store import MovimientosStore
+
+CUENTA = "BPMUP SRL871 (0000155300000000000871)"
+CBU_DESTINO = "0000003100000000000362"
+
+
+def _fila(mid: int, fecha: datetime, importe: str = "-1.500,50 ", estado: str = "Ejecutado"):
+    return [f"{mid:,}".replace(",", "."), fecha.strftime("%d/%m/%Y %H:%M:%S"), "BPMUP SRL",
+            "CLEANPOWER SOLUTIONS SRL362", "PES", importe, "Transferencia saliente", estado,
+            "BPMUP SRL871 - 0000155300000000000871"]
+
+
+class _Sincronizador:
+    """Hace de worker: carga `filas` y avanza la marca, o falla sin tocar el store."""
+
+    def __init__(self, filas, ok=True):
+        self.filas, self.ok = filas, ok
+        self.cuentas = [CUENTA]
+        self.llamadas = 0
+
+    def sincronizar(self, store, cuentas):
+        self.llamadas += 1
+        if not self.ok:
+            return False
+        store.importar_filas(self.filas, CUENTA)
+        store.avanzar_marca(CUENTA, datetime.now())
+        return True
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = MovimientosStore(str(tmp_path / "movimientos.sqlite3"))
+    yield s
+    s.cerrar()
+
+
+def _estado(inicio: datetime, fin: datetime, status="failed"):
+    return {1: {"transfer": {"ID": "T1"}, "status": status, "cbu_destino": CBU_DESTINO,
+                "cbu_origen": "", "monto": "1500.50", "intentos": [(inicio, fin)]}}
+
+
+# intentos ya viejos: ni la espera del desfase ni la hora actual influyen
+INICIO = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+FIN = INICIO + timedelta(seconds=40)
+
+
+def test_movimiento_dentro_del_intento_no_se_reintenta(store):
+    estado = _estado(INICIO, FIN)
+    sinc = _Sincronizador([_fila(63709, INICIO + timedelta(seconds=30))])
+
+    quedan = bot.verificar_ejecutadas([1], estado, "", sincronizador=sinc, store=store)
+
+    assert quedan == []
+    assert estado[1]["status"] == "done"
+    assert sinc.llamadas == 1
+
+
+def test_movimiento_fuera_del_intento_se_reintenta(store):
+    # el mismo importe a la misma contraparte, pero 10 minutos antes de empezar el intento
+    sinc = _Sincronizador([_fila(63709, INICIO - timedelta(minutes=10))])
+
+    assert bot.verificar_ejecutadas([1], _estado(INICIO, FIN), "", sincronizador=sinc, store=store) == [1]
+
+
+def test_store_al_dia_no_pide_otro_export(store):
+    store.importar_filas([_fila(63709, FIN + timedelta(seconds=20))], CUENTA)
+    store.avanzar_marca(CUENTA, datetime.now())
+    sinc = _Sincronizador([])
+
+    assert bot.verificar_ejecutadas([1], _estado(INICIO, FIN), "", sincronizador=sinc, store=store) == []
+    assert sinc.llamadas == 0
+
+
+def test_sin_actualizar_avisa_y_reintenta(store, capsys):
+    sinc = _Sincronizador([], ok=False)
+
+    assert bot.verificar_ejecutadas([1], _estado(INICIO, FIN), "", sincronizador=sinc, store=store) == [1]
+    assert "se reintentan sin verificar" in capsys.readouterr().out
+
+
+def test_movimiento_ambiguo_queda_para_revisar(store, capsys):
+    # otra del lote, pendiente, va a otro CBU con el mismo importe y los mismos 3 últimos dígitos
+    estado = _estado(INICIO, FIN)
+    estado[2] = {"transfer": {"ID": "T2"}, "status": "sin_saldo", "cbu_destino": "0000003100000000099362",
+                 "cbu_origen": "", "monto": "1500.50"}
+    sinc = _Sincronizador([_fila(63709, INICIO + timedelta(seconds=30))])
+
+    quedan = bot.verificar_ejecutadas([1], estado, "", sincronizador=sinc, store=store)
+
+    assert quedan == []
+    assert estado[1]["status"] == "revisar"
+    assert "revisar a mano" in capsys.readouterr().out